@@ -0,0 +1,339 @@
+"""
+PairSubs benchmarks.
+
+Usage:
+    python benchmarks.py [name ...]
+
+Runs all benchmarks if no name is given.
+"""
+import base64
+import itertools
+import os
+import random
+import sys
+import tempfile
+import threading
+import zlib
+import srt
+from datetime import timedelta
+from socketserver import ThreadingMixIn
+from time import sleep
+from timeit import default_timer as timer
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
+
+import pairsubs
+from pairsubs import CueStore, Subs, SubPair, SubDb, Opensubtitles
+from pairsubs_index import SubIndex
+from pairsubs_storage import JsonStorage
+
+
+def gen_srt(length, single_dur=3.0, text='Sentence number {} of the movie'):
+    """Generate SRT data with `length` cues."""
+    subs = []
+    for i in range(1, length+1):
+        subs.append(srt.Subtitle(
+            index=i,
+            start=timedelta(seconds=i*single_dur),
+            end=timedelta(seconds=i*single_dur + single_dur/2),
+            content=text.format(i)))
+    return srt.compose(subs).encode('utf-8')
+
+
+def gen_srt_times(starts, text='Sentence number {} of the movie'):
+    """Generate SRT data with cues starting at `starts` (seconds)."""
+    subs = []
+    for i, start in enumerate(starts, 1):
+        subs.append(srt.Subtitle(
+            index=i,
+            start=timedelta(seconds=start),
+            end=timedelta(seconds=start + 1),
+            content=text.format(i)))
+    return srt.compose(subs).encode('utf-8')
+
+
+def gen_srt_texts(texts, single_dur=3.0):
+    """Generate SRT data with cues of `texts`."""
+    subs = []
+    for i, text in enumerate(texts, 1):
+        subs.append(srt.Subtitle(
+            index=i,
+            start=timedelta(seconds=i*single_dur),
+            end=timedelta(seconds=i*single_dur + single_dur/2),
+            content=text))
+    return srt.compose(subs).encode('utf-8')
+
+
+def gen_sub_info(name):
+    return {'MovieName': name,
+            'SubEncoding': 'utf-8',
+            'SubFileName': '{}.srt'.format(name),
+            'SubLanguageID': 'eng',
+            'IDMovieImdb': name,
+            'IDSubtitleFile': name}
+
+
+class MockOpensubtitles:
+    """Opensubtitles XML-RPC API stand-in with injected `delay` (seconds)."""
+
+    def __init__(self, delay, length=1000):
+        self.delay = delay
+        self.data = base64.b64encode(zlib.compress(gen_srt(length))).decode()
+
+    def LogIn(self, login, password, lang, agent):
+        sleep(self.delay)
+        return {'status': '200 OK', 'token': 'token'}
+
+    def LogOut(self, token):
+        sleep(self.delay)
+        return {'status': '200 OK'}
+
+    def SearchSubtitles(self, token, params, count):
+        sleep(self.delay)
+        res = []
+        for p in params:
+            info = gen_sub_info('{}_{}'.format(p['imdbid'], p['sublanguageid']))
+            info.update(SubLanguageID=p['sublanguageid'], SubDownloadsCnt='1')
+            res.append(info)
+        return {'status': '200 OK', 'data': res}
+
+    def DownloadSubtitles(self, token, ids):
+        sleep(self.delay)
+        return {'status': '200 OK',
+                'data': [{'idsubtitlefile': x, 'data': self.data} for x in ids]}
+
+
+class MockServer(ThreadingMixIn, SimpleXMLRPCServer):
+    daemon_threads = True
+
+
+class KeepAliveHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xml-rpc',)
+
+
+class mock_opensubtitles:
+    """
+    Context manager running `MockOpensubtitles` on a local server
+    and pointing `Opensubtitles` to it.
+    """
+
+    def __init__(self, delay):
+        self.server = MockServer(('127.0.0.1', 0), KeepAliveHandler,
+                                 logRequests=False, allow_none=True)
+        self.server.register_instance(MockOpensubtitles(delay))
+
+    def __enter__(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.api_url = Opensubtitles.api_url
+        Opensubtitles.api_url = 'http://127.0.0.1:{}/xml-rpc'.format(
+                self.server.server_address[1])
+        return self.server
+
+    def __exit__(self, *args):
+        Opensubtitles.api_url = self.api_url
+        pairsubs.PooledTransport.pool.clear()
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def bench_download_latency(delay=0.1, repeat=3):
+    """`SubPair.download` latency: sequential vs concurrent languages."""
+    workers = pairsubs.DOWNLOAD_WORKERS
+    with mock_opensubtitles(delay):
+        try:
+            for n in (1, 2):
+                pairsubs.DOWNLOAD_WORKERS = n
+                best = float('inf')
+                for _ in range(repeat):
+                    t = timer()
+                    SubPair.download('tt0000001', 'eng', 'rus')
+                    best = min(best, timer() - t)
+                print('download_latency: {} worker(s), {:.0f} ms delay per call: '
+                      '{:7.1f} ms'.format(n, delay*1000, best*1000))
+        finally:
+            pairsubs.DOWNLOAD_WORKERS = workers
+
+
+def bench_memory():
+    """Memory footprint of `CueStore` vs list of `srt.Subtitle`."""
+    for length in (1000, 10000):
+        data = gen_srt(length)
+        subtitles = list(srt.parse(data.decode('utf-8')))
+        as_list = CueStore.list_nbytes(subtitles)
+        as_store = CueStore(subtitles).nbytes()
+        subs = Subs(data, gen_sub_info('memory'))
+        print('memory: {:6d} cues: list {:10d} B, CueStore {:9d} B '
+              '({:.1f}x), Subs with index {:9d} B'.format(
+                  length, as_list, as_store, as_list/as_store, subs.nbytes()))
+
+
+def bench_cues_cache(repeat=5):
+    """Cold (parse SRT) vs warm (parsed cache) `Subs.read`."""
+    files_dir = pairsubs.FILES_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        pairsubs.FILES_DIR = tmp
+        try:
+            for length in (1000, 10000):
+                info = gen_sub_info('cache_{}'.format(length))
+                Subs(gen_srt(length), info).save()
+                name = os.path.join(tmp, info['SubFileName'])
+                cold = warm = float('inf')
+                for _ in range(repeat):
+                    if os.path.exists(name + pairsubs.CUES_CACHE_EXT):
+                        os.remove(name + pairsubs.CUES_CACHE_EXT)
+                    t = timer()
+                    Subs.read(info)
+                    cold = min(cold, timer() - t)
+                    t = timer()
+                    Subs.read(info)
+                    warm = min(warm, timer() - t)
+                print('cues_cache: {:6d} cues: cold {:8.2f} ms, warm {:8.2f} ms '
+                      '({:.0f}x)'.format(length, cold*1000, warm*1000, cold/warm))
+        finally:
+            pairsubs.FILES_DIR = files_dir
+
+
+def bench_align_view(repeat=5, count=4):
+    """First/last cues of a file for the Align view: full read vs offsets."""
+    files_dir = pairsubs.FILES_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        pairsubs.FILES_DIR = tmp
+        try:
+            for length in (1000, 10000, 100000):
+                info = gen_sub_info('align_{}'.format(length))
+                Subs(gen_srt(length), info).save()
+                name = os.path.join(tmp, info['SubFileName'])
+                full = cached = ends = float('inf')
+                for _ in range(repeat):
+                    if os.path.exists(name + pairsubs.CUES_CACHE_EXT):
+                        os.remove(name + pairsubs.CUES_CACHE_EXT)
+                    t = timer()
+                    cues = Subs.read(info).sub
+                    cues[:count], cues[-1-count:-1]
+                    full = min(full, timer() - t)
+                    t = timer()
+                    cues = Subs.read(info).sub
+                    cues[:count], cues[-1-count:-1]
+                    cached = min(cached, timer() - t)
+                    t = timer()
+                    Subs.read_slice(info, 0, count), Subs.read_slice(info, -1-count, -1)
+                    ends = min(ends, timer() - t)
+                print('align_view: {:6d} cues: parse {:8.2f} ms, parsed cache {:7.2f} ms, '
+                      'offsets {:5.2f} ms'.format(length, full*1000, cached*1000, ends*1000))
+        finally:
+            pairsubs.FILES_DIR = files_dir
+
+
+def bench_auto_align(length=1500, seed=1):
+    """`SubPair.auto_align` accuracy and runtime on shifted/scaled pairs."""
+    rnd = random.Random(seed)
+    cases = ((1.0, 7.3), (25/23.976, -12.0), (23.976/25, 40.0),
+             (1.013, 30.0), (0.997, -2.5))
+    for scale, offset in cases:
+        first = sorted(rnd.uniform(0, length*3) for _ in range(length))
+        # the second subtitles miss some cues, have extra ones and jitter
+        second = [scale*t + offset + rnd.gauss(0, 0.1)
+                  for t in first if rnd.random() > 0.15]
+        second += [rnd.uniform(0, length*3) for _ in range(length // 10)]
+        second = sorted(x for x in second if x > 0)
+        sub_pair = SubPair([Subs(gen_srt_times(first), gen_sub_info('first')),
+                            Subs(gen_srt_times(second), gen_sub_info('second'))])
+        t = timer()
+        score = sub_pair.auto_align()
+        elapsed = timer() - t
+        error = max(abs(sub_pair.second_start - (scale*sub_pair.first_start + offset)),
+                    abs(sub_pair.second_end - (scale*sub_pair.first_end + offset)))
+        print('auto_align: {} cues, scale {:.4f}, offset {:6.1f} s: '
+              'max error {:6.3f} s, matched {:.0%}, {:7.1f} ms'.format(
+                  length, scale, offset, error, score, elapsed*1000))
+
+
+def bench_index(files=10000, cues=100, batch=50, repeat=20, seed=1, db_pairs=200):
+    """
+    `SubIndex` build and query latency on a corpus of `files` subtitles
+    files, `SubDb.search` latency on a library of `db_pairs` pairs.
+    """
+    rnd = random.Random(seed)
+    vocabulary = ['word{}'.format(n) for n in range(20000)]
+    # Zipf-like word frequencies
+    weights = list(itertools.accumulate(1 / (n + 1) for n in range(len(vocabulary))))
+
+    def gen_texts():
+        words = rnd.choices(vocabulary, cum_weights=weights, k=2*6*cues)
+        texts = [' '.join(words[i:i+6]) for i in range(0, len(words), 6)]
+        return texts[:cues], texts[cues:]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        index = SubIndex(tmp)
+        t = timer()
+        for n in range(0, files // 2, batch):
+            index.add_many((str(k), gen_texts()) for k in range(n, n + batch))
+        build = timer() - t
+        size = sum(os.path.getsize(os.path.join(tmp, x)) for x in os.listdir(tmp))
+        print('index: {} files, {} cues: build {:.1f} s, {:.1f} MB on disk, '
+              '{} segments'.format(files, files * cues, build, size / 2**20,
+                                   len(index.segments)))
+
+        t = timer()
+        index.add('new', gen_texts())
+        print('index: incremental add of a pair: {:.1f} ms'.format((timer() - t) * 1000))
+
+        index.close()
+        index = SubIndex(tmp)
+        for query in ('word5000', 'word50', 'word1 word2', 'word1 word5000'):
+            times = []
+            for _ in range(repeat):
+                t = timer()
+                index.search(query, limit=20)
+                times.append(timer() - t)
+            times.sort()
+            print('index: query {!r}: median {:.2f} ms, hits {}'.format(
+                query, times[len(times) // 2] * 1000, len(index.search(query))))
+        index.close()
+
+    # SubDb.search: the index and the reads of the found pairs
+    dirs = pairsubs.APP_DIR, pairsubs.FILES_DIR, pairsubs.INDEX_DIR
+    with tempfile.TemporaryDirectory() as tmp:
+        pairsubs.APP_DIR = tmp
+        pairsubs.FILES_DIR = os.path.join(tmp, 'files')
+        pairsubs.INDEX_DIR = os.path.join(tmp, 'index')
+        try:
+            db = SubDb(JsonStorage(os.path.join(tmp, 'cache.json')))
+            sub_pairs = []
+            for n in range(db_pairs):
+                sub_pairs.append(SubPair([
+                    Subs(gen_srt_texts(x), gen_sub_info('search_{}_{}'.format(n, side)))
+                    for side, x in enumerate(gen_texts())]))
+            db.add_subpairs(sub_pairs)
+            db._table_queue.join()
+            for query in ('word5000', 'word50', 'word1 word2'):
+                for sub_id in list(db.cache):
+                    db.cache.pop(sub_id)
+                t = timer()
+                cards = db.search(query)
+                cold = timer() - t
+                t = timer()
+                db.search(query)
+                warm = timer() - t
+                print('search: {} pairs, query {!r}: {} cards, cold {:.1f} ms, '
+                      'warm {:.1f} ms'.format(db_pairs, query, len(cards),
+                                              cold * 1000, warm * 1000))
+            db.close()
+        finally:
+            pairsubs.APP_DIR, pairsubs.FILES_DIR, pairsubs.INDEX_DIR = dirs
+
+
+BENCHMARKS = {
+        'memory': bench_memory,
+        'cues_cache': bench_cues_cache,
+        'download_latency': bench_download_latency,
+        'align_view': bench_align_view,
+        'auto_align': bench_auto_align,
+        'index': bench_index,
+        }
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
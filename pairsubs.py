@@ -3,17 +3,35 @@ import http.client
 import base64
 import zlib
 import srt
-from srt import SRTParseError
 from bs4 import UnicodeDammit
 from datetime import timedelta
+import io
 from urllib.parse import urlparse
+from array import array
+from bisect import bisect_left, bisect_right
 import random
 import os
-import json
+import sys
 import codecs
+import queue
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
+import math
+import asyncio
+import atexit
+import collections
+import functools
+import hashlib
+import struct
+import threading
 import re
-from time import sleep
+import weakref
+from time import sleep, monotonic, time
+import pairsubs_align
 import pairsubs_gui
+import pairsubs_index
+import pairsubs_srt
+import pairsubs_storage
 
 import logging
 from logging import NullHandler
@@ -33,9 +51,83 @@ FILES_DIR = os.path.join(APP_DIR, 'files')
 #: File in which to store details aboud downloaded subtitles
 CACHE_DB = '{}/cache.json'.format(APP_DIR)
 
+#: Extension of parsed subtitles cache files (stored next to the SRT files)
+CUES_CACHE_EXT = '.cues'
+#: Format version of the parsed subtitles cache, bumped when the cache
+#: layout or the SRT parser changes (older caches are stale)
+CUES_CACHE_VERSION = 2
+
+#: Extension of cue byte offsets files (stored next to the SRT files)
+CUE_OFFSETS_EXT = '.offsets'
+
+#: Extension of SubPair cue alignment tables (`<sub_id>.pairs` in FILES_DIR)
+CUE_TABLE_EXT = '.pairs'
+
+# Number of aligned cue groups (beads) on a practice card
+CARD_BEADS = 6
+
+# Duration of a card cut by timing while the cue table isn't built (seconds)
+CARD_LENGTH = 20
+
+#: Directory of the full-text index of the subtitles
+INDEX_DIR = os.path.join(APP_DIR, 'index')
+
+# Max number of cards found by `SubDb.search`
+SEARCH_LIMIT = 20
+
+# Index hits checked by `SubDb.search` per requested card
+SEARCH_CANDIDATES = 5
+
+#: SQLite database in which to store details aboud downloaded subtitles
+SQLITE_DB = '{}/cache.sqlite'.format(APP_DIR)
+
+#: SQLite database in which to cache Opensubtitles search results
+SEARCH_CACHE_DB = '{}/search_cache.sqlite'.format(APP_DIR)
+
+# Search results time to live and stale-while-revalidate period (seconds)
+SEARCH_CACHE_TTL = 7*24*3600
+SEARCH_CACHE_STALE_TTL = 30*24*3600
+
+#: SubDb storage engine ('sqlite' or 'json')
+DB_ENGINE = os.environ.get('PAIRSUBS_DB_ENGINE', 'sqlite')
+
+#: File in which to keep Opensubtitles session
+SESSION_FILE = '{}/session.json'.format(APP_DIR)
+
+# Opensubtitles session expires after 15 minutes of inactivity
+SESSION_TTL = 14*60
+# Statuses of API responses to a request with an expired token
+SESSION_EXPIRED_STATUS = ('401', '406')
+# Status of a successful API response
+OK_STATUS = '200'
+
+# Number of languages of a pair searched concurrently
+DOWNLOAD_WORKERS = 2
+
+# Alignment changes are written after this delay of inactivity (seconds)
+WRITE_DELAY = 2
+
+# Max number of loaded SubPairs and their memory footprint (bytes)
+CACHE_MAX_PAIRS = 32
+CACHE_MAX_BYTES = 64*1024*1024
+
+# Number of subtitles files removed concurrently
+DELETE_WORKERS = 4
+
+# Max number of files in one Opensubtitles download request
+DOWNLOAD_CHUNK_SIZE = 20
+
 # Opensubtitles API retry count
 MAX_RETRY = 5
+# Base and max delay of exponential backoff between retries (seconds)
 RETRY_DELAY = 3
+RETRY_MAX_DELAY = 30
+
+# Errors of Opensubtitles API calls which are retried
+RETRY_EXCEPTIONS = (xmlrpc.client.ProtocolError,
+                    http.client.ResponseNotReady,
+                    ConnectionError,
+                    TimeoutError)
 
 # Parse fail
 # https://www.imdb.com/title/tt0583453/?ref_=tt_ep_pr
@@ -43,67 +135,331 @@ RETRY_DELAY = 3
 
 class OpensubtitlesError(Exception):
     def __str__(self):
-        return 'Max retry number was exceeded during access to Opensubtitles.org'
+        return (super().__str__() or
+                'Max retry number was exceeded during access to Opensubtitles.org')
+
+
+def backoff_delay(attempt):
+    """
+    Returns delay (seconds) before retry #`attempt` (from 0):
+    exponential backoff with full jitter.
+    """
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_DELAY * 2**attempt))
 
 
-class ProxiedTransport(xmlrpc.client.Transport):
+def timedelta_to_us(td):
+    """Convert `timedelta` into integer number of microseconds."""
+    return (td.days * 86400 + td.seconds) * 1000000 + td.microseconds
+
+
+class ConnectionPool:
+    """
+    Pool of idle keep-alive HTTP connections.
+    Args:
+        `max_idle` (int): max number of idle connections per key
+    Attributes:
+        `opened` (int): number of opened connections
+        `reused` (int): number of times an idle connection was reused
+    """
+    def __init__(self, max_idle=4):
+        self.max_idle = max_idle
+        self.idle = {}
+        self.opened = 0
+        self.reused = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, key, factory):
+        """
+        Get an idle connection for `key` or open a new one.
+        Args:
+            `key`: connection key (host, proxy, etc.)
+            `factory` (callable): returns a new connection
+        """
+        with self.lock:
+            conns = self.idle.get(key)
+            if conns:
+                self.reused += 1
+                return conns.pop()
+            self.opened += 1
+        return factory()
+
+    def release(self, key, conn):
+        """Return the connection `conn` into the pool."""
+        if conn.sock is None:  # closed by the server
+            conn.close()
+            return
+        with self.lock:
+            conns = self.idle.setdefault(key, [])
+            if len(conns) < self.max_idle:
+                conns.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        """Close all idle connections."""
+        with self.lock:
+            idle, self.idle = self.idle, {}
+        for conns in idle.values():
+            for conn in conns:
+                conn.close()
+
+    def stats(self):
+        with self.lock:
+            return {'opened': self.opened,
+                    'reused': self.reused,
+                    'idle': sum(len(x) for x in self.idle.values())}
+
+
+class PooledTransport(xmlrpc.client.Transport):
+    """
+    XML-RPC transport which keeps HTTP connections alive.
+    Connections are shared via `pool` between all transports, so they
+    are reused across calls and across `Opensubtitles` instances.
+    The transport is thread-safe.
+    Args:
+        `use_https` (bool): use HTTPS connections
+        `context` (`ssl.SSLContext`): SSL context for HTTPS
+    """
+    pool = ConnectionPool()
+
+    def __init__(self, use_https=True, context=None, **kwargs):
+        super().__init__(**kwargs)
+        self.use_https = use_https
+        self.context = context
+        self.proxy = None
+        self.proxy_headers = None
+        self._local = threading.local()
 
     def set_proxy(self, host, port=None, headers=None):
+        """Connect through HTTP proxy (CONNECT tunnel)."""
         self.proxy = host, port
         self.proxy_headers = headers
 
-    def make_connection(self, host):
-        connection = http.client.HTTPConnection(*self.proxy)
-        connection.set_tunnel(host, headers=self.proxy_headers)
-        self._connection = host, connection
+    def _open(self, chost, x509):
+        if self.use_https:
+            conn_cls = functools.partial(http.client.HTTPSConnection,
+                                         context=self.context, **(x509 or {}))
+        else:
+            conn_cls = http.client.HTTPConnection
+        if self.proxy:
+            connection = conn_cls(*self.proxy)
+            connection.set_tunnel(chost, headers=self.proxy_headers)
+        else:
+            connection = conn_cls(chost)
         return connection
 
+    def make_connection(self, host):
+        chost, self._extra_headers, x509 = self.get_host_info(host)
+        key = (self.use_https, chost, self.proxy)
+        conn = self.pool.acquire(key, lambda: self._open(chost, x509))
+        self._local.connection = key, conn
+        return conn
+
+    def single_request(self, host, handler, request_body, verbose=False):
+        try:
+            return super().single_request(host, handler, request_body, verbose)
+        finally:
+            connection = getattr(self._local, 'connection', None)
+            if connection:
+                self._local.connection = None
+                self.pool.release(*connection)
+
+    def close(self):
+        """Close the connection of the current request."""
+        connection = getattr(self._local, 'connection', None)
+        if connection:
+            self._local.connection = None
+            connection[1].close()
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket rate limiter.
+    Args:
+        `rate` (float): tokens added per second
+        `capacity` (int): max number of tokens (burst size)
+    """
+    def __init__(self, rate, capacity=1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.stamp = monotonic()
+        self.lock = threading.Lock()
+
+    def _take(self):
+        """Take a token. Returns time to wait (seconds) if there is no token."""
+        with self.lock:
+            now = monotonic()
+            self.tokens = min(self.capacity,
+                              self.tokens + (now - self.stamp) * self.rate)
+            self.stamp = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        """Wait for a token."""
+        while True:
+            delay = self._take()
+            if not delay:
+                return
+            sleep(delay)
+
+    async def acquire_async(self):
+        """Wait for a token without blocking the event loop."""
+        while True:
+            delay = self._take()
+            if not delay:
+                return
+            await asyncio.sleep(delay)
+
 
 class Opensubtitles:
     """Class for opensuntitles.org access."""
     user_agent = "OS Test User Agent"
+    api_url = "https://api.opensubtitles.org/xml-rpc"
+    #: Default search results cache (`pairsubs_storage.SearchCache`)
+    search_cache = None
 
-    def __init__(self):
-        """Init xml-rpc proxy."""
+    def __init__(self, url=None, rate_limiter=None, search_cache=None,
+                 session_file=None):
+        """
+        Init xml-rpc proxy.
+        The login is done lazily by the first API call if `login`
+        wasn't called.
+        Args:
+            `url` (str): XML-RPC API url (`api_url` by default)
+            `rate_limiter` (`TokenBucket`): limiter of API calls rate
+            `search_cache` (`pairsubs_storage.SearchCache`): search results
+                cache (class default `search_cache` if None)
+            `session_file` (str): file in which the session token is kept
+                to be reused by next `Opensubtitles` objects
+        """
+        self.token = None
+        self.used = 0
+        self.session_file = session_file
+        self._login_lock = threading.RLock()
+        self.rate_limiter = rate_limiter
+        if search_cache is not None:
+            self.search_cache = search_cache
+        self._refresh_threads = []
+        self._lock = threading.Lock()
+        url = url or self.api_url
+        transport = PooledTransport(use_https=url.startswith('https:'))
         proxy_url = os.environ.get('http_proxy', '')
         if proxy_url:
-            parsed = urlparse(proxy_url).netloc
-            transport = ProxiedTransport()
-            transport.set_proxy(parsed)
-            self.proxy = xmlrpc.client.ServerProxy(
-                    "https://api.opensubtitles.org/xml-rpc",
-                    transport=transport)
-        else:
-            self.proxy = xmlrpc.client.ServerProxy(
-                    "https://api.opensubtitles.org/xml-rpc")
+            transport.set_proxy(urlparse(proxy_url).netloc)
+        self.proxy = xmlrpc.client.ServerProxy(url, transport=transport)
 
     def retry(func):
+        """
+        Retry API call with exponential backoff.
+        The single attempt function is available as `__wrapped__`.
+        """
+        @functools.wraps(func)
         def wrapper(self, *args, **kwargs):
             for i in range(MAX_RETRY):
+                if self.rate_limiter:
+                    self.rate_limiter.acquire()
                 try:
                     res = func(self, *args, **kwargs)
-                except (xmlrpc.client.ProtocolError, http.client.ResponseNotReady) as e:
-                    logger.info("Retry #{}".format(i+1))
-                    sleep(RETRY_DELAY)
+                except RETRY_EXCEPTIONS as e:
+                    logger.info("Retry #{} ({})".format(i+1, e))
+                    sleep(backoff_delay(i))
                 else:
                     return res
             raise OpensubtitlesError
         return wrapper
 
-    @retry
     def logout(self):
-        """Logout from api.opensubtitles.org."""
+        """Logout from api.opensubtitles.org and forget the session."""
+        self.wait_refresh()
+        if self.token:
+            self._logout()
+        self.token = None
+        self._save_session()
+
+    @retry
+    def _logout(self):
+        self.logout_once()
+
+    def logout_once(self):
+        """Single attempt of the logout, the token isn't forgotten."""
         logger.info("Opensubtitles: Logout...")
         self.proxy.LogOut(self.token)
 
     @retry
     def login(self):
         """Login into api.opensubtitles.org."""
+        self.login_once()
+
+    def login_once(self):
+        """Single attempt of `login`."""
         logger.info("Opensubtitles: Login...")
         login = self.proxy.LogIn("", "", "en", "TemporaryUserAgent")
         self.token = login['token']
+        self.used = time()
+        self._save_session()
 
-    def _select_sub_(self, subtitles):
+    def close(self):
+        """
+        Close the session keeping it alive on the server:
+        the token is saved into `session_file` to be reused later.
+        """
+        self.wait_refresh()
+        self._save_session()
+
+    def _load_session(self):
+        """Restore the token from `session_file` if it isn't expired."""
+        try:
+            with open(self.session_file) as f:
+                session = json.load(f)
+            if time() - session['used'] < SESSION_TTL:
+                self.token = session['token']
+                self.used = session['used']
+                logger.info("Opensubtitles: Reuse session")
+        except (OSError, ValueError, KeyError, TypeError):
+            pass
+
+    def _save_session(self):
+        if not self.session_file:
+            return
+        try:
+            if self.token:
+                with open(self.session_file, 'w') as f:
+                    json.dump({'token': self.token, 'used': self.used}, f)
+            elif os.path.exists(self.session_file):
+                os.remove(self.session_file)
+        except OSError as e:
+            logger.warning("Can't save session: {}".format(e))
+
+    def _call(self, method, *args):
+        """
+        Call API `method` with the session token.
+        Login lazily if there is no token and once again
+        if the server rejects the token. The login is a single attempt,
+        the calling API method is retried.
+        """
+        for i in (0, 1):
+            with self._login_lock:
+                if not self.token and self.session_file:
+                    self._load_session()
+                if not self.token:
+                    self.login_once()
+                token = self.token
+            result = getattr(self.proxy, method)(token, *args)
+            status = result.get('status', '') if isinstance(result, dict) else ''
+            if i or not status.startswith(SESSION_EXPIRED_STATUS):
+                self.used = time()
+                return result
+            logger.info("Opensubtitles: Session expired ({})".format(status))
+            with self._login_lock:
+                if self.token == token:
+                    self.token = None
+                    self._save_session()
+
+    def select_sub(self, subtitles):
         """Select subtitles that have maximal downloads count."""
         rate = 0
         top_sub = None
@@ -114,11 +470,13 @@ class Opensubtitles:
                 top_sub = sub
         return top_sub
 
-    @retry
     def search_sub(self, imdbid, lang):
         """
         Search the subtitles in Opensubtitles database
         by IMBD id and a language.
+        The search result is taken from `search_cache` if it's there.
+        A stale cached result is returned at once and refreshed
+        in background.
         Return dict as described in
         http://trac.opensubtitles.org/projects/opensubtitles/wiki/XMLRPC#SearchSubtitles
         Args:
@@ -127,17 +485,68 @@ class Opensubtitles:
         Returns:
             (dict): subtitles info in Opensubtitles API format
         """
-        logger.info("Opensubtitles: search...")
         m = re.search(r'\d+', imdbid)
         if m:
             imdb = m[0]
-            result = self.proxy.SearchSubtitles(
-                    self.token,
-                    [{'imdbid': str(imdb), 'sublanguageid': lang}],
-                    [100])
-            return self._select_sub_(result['data'])
+            cached = self.from_cache(imdb, lang)
+            if cached:
+                data, fresh = cached
+                if not fresh:
+                    self._refresh_search(imdb, lang)
+                return self.select_sub(data)
+            return self.select_sub(self._search(imdb, lang))
+
+    def from_cache(self, imdb, lang):
+        """Returns (data, fresh) search result from `search_cache` or None."""
+        if self.search_cache:
+            return self.search_cache.get(imdb, lang)
 
     @retry
+    def _search(self, imdb, lang):
+        return self.search_once(imdb, lang)
+
+    def search_once(self, imdb, lang):
+        """
+        Single attempt to search subtitles by IMDB id number `imdb`
+        and a language, the result is stored into `search_cache`.
+        Only successful responses are cached, OpensubtitlesError is raised
+        for the others.
+        Returns:
+            list of dicts: subtitles infos in Opensubtitles API format
+        """
+        logger.info("Opensubtitles: search...")
+        result = self._call(
+                'SearchSubtitles',
+                [{'imdbid': str(imdb), 'sublanguageid': lang}],
+                [100])
+        status = result.get('status', '') if isinstance(result, dict) else ''
+        if not status.startswith(OK_STATUS):
+            raise OpensubtitlesError('Search failed: {}'.format(status or 'no status'))
+        data = result.get('data') or []
+        if self.search_cache:
+            self.search_cache.put(imdb, lang, data)
+        return data
+
+    def _refresh_search(self, imdb, lang):
+        def refresh():
+            try:
+                self._search(imdb, lang)
+            except (OpensubtitlesError,) + RETRY_EXCEPTIONS as e:
+                logger.info("Search refresh failed: {}".format(e))
+
+        t = threading.Thread(target=refresh, daemon=True)
+        with self._lock:
+            self._refresh_threads = [x for x in self._refresh_threads if x.is_alive()]
+            self._refresh_threads.append(t)
+        t.start()
+
+    def wait_refresh(self):
+        """Wait for the background search refreshes."""
+        with self._lock:
+            threads, self._refresh_threads = self._refresh_threads, []
+        for t in threads:
+            t.join()
+
     def download_sub(self, sub):
         """
         Download subtitles from subtitles.org.
@@ -146,12 +555,357 @@ class Opensubtitles:
         Return:
             `data_bytes` (bytes): downloaded subtitles
         """
+        return self.download_subs([sub])[0]
+
+    def download_subs(self, subs, chunk_size=DOWNLOAD_CHUNK_SIZE, workers=4):
+        """
+        Download many subtitles from subtitles.org.
+        Subtitles are requested in chunks of `chunk_size` files per call,
+        the chunks are downloaded and decoded concurrently.
+        Args:
+            `subs` (list of dicts): subtitles info in Opensubtitles API format
+            `chunk_size` (int): max number of files per API call
+            `workers` (int): max number of concurrent API calls
+        Return:
+            list of bytes: downloaded subtitles (None if a file is missing
+                in the server response) in the order of `subs`
+        """
+        ids = []
+        for sub in subs:
+            if sub['IDSubtitleFile'] not in ids:
+                ids.append(sub['IDSubtitleFile'])
+        chunks = [ids[i:i+chunk_size] for i in range(0, len(ids), chunk_size)]
+
+        with ThreadPoolExecutor(max_workers=max(1, min(workers, len(chunks)))) as executor:
+            encoded = {}
+            for res in executor.map(self._download_chunk, chunks):
+                encoded.update(res)
+            ids = list(encoded)
+            decoded = dict(zip(ids, executor.map(self.decode_sub,
+                                                 [encoded[x] for x in ids])))
+
+        result = []
+        for sub in subs:
+            data = decoded.get(str(sub['IDSubtitleFile']))
+            if data is None:
+                logger.info("Subtitles {} aren't downloaded".format(
+                    sub['IDSubtitleFile']))
+            result.append(data)
+        return result
+
+    @retry
+    def _download_chunk(self, ids):
+        return self.download_chunk_once(ids)
+
+    def download_chunk_once(self, ids):
+        """
+        Single attempt to download a chunk of subtitles files.
+        Returns:
+            dict of {str: str}: {IDSubtitleFile: base64 encoded data}
+        """
         logger.info("Opensubtitles: download...")
-        result = self.proxy.DownloadSubtitles(self.token,
-                                              [sub['IDSubtitleFile']])
-        data_zipped = base64.b64decode(result['data'][0]['data'])
-        data_bytes = zlib.decompress(data_zipped, 15+32)
-        return data_bytes
+        result = self._call('DownloadSubtitles', ids)
+        data = result['data'] or []
+        if all('idsubtitlefile' in x for x in data):
+            return {str(x['idsubtitlefile']): x['data'] for x in data}
+        # No file ids in the response: the order of the request is kept
+        return {str(i): x['data'] for i, x in zip(ids, data)}
+
+    @staticmethod
+    def decode_sub(data):
+        """Decode base64 encoded gzipped subtitles data into bytes."""
+        data_zipped = base64.b64decode(data)
+        return zlib.decompress(data_zipped, 15+32)
+
+
+class CueStore:
+    """
+    Compact storage for a list of subtitles.
+
+    Cue indexes and times are kept in parallel arrays, the text of all cues
+    in one string. Items are returned as `srt.Subtitle` objects created on
+    access, so a `CueStore` can be used wherever a list of `Subtitles`
+    was used before.
+    Args:
+        `subtitles` (iterable of `Subtitles`)
+    Attributes:
+        `indexes` (array of int): cue indexes
+        `starts` (array of int): cue start times (microseconds)
+        `ends` (array of int): cue end times (microseconds)
+        `offsets` (array of int): cue text boundaries in `text`
+        `text` (str): content of all cues
+        `proprietary` (dict of {int: str}): non-empty proprietary fields
+    """
+    # cues count, text length, proprietary length
+    _header = struct.Struct('<qqq')
+
+    def __init__(self, subtitles=()):
+        self.indexes = array('q')
+        self.starts = array('q')
+        self.ends = array('q')
+        self.offsets = array('q', [0])
+        self.proprietary = {}
+
+        texts = []
+        pos = 0
+        for i, s in enumerate(subtitles):
+            self.indexes.append(s.index if s.index is not None else 0)
+            self.starts.append(timedelta_to_us(s.start))
+            self.ends.append(timedelta_to_us(s.end))
+            pos += len(s.content)
+            self.offsets.append(pos)
+            texts.append(s.content)
+            if s.proprietary:
+                self.proprietary[i] = s.proprietary
+        self.text = ''.join(texts)
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get(i) for i in range(*key.indices(len(self)))]
+        if key < 0:
+            key += len(self)
+        if not 0 <= key < len(self):
+            raise IndexError('cue index out of range')
+        return self._get(key)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._get(i)
+
+    def __eq__(self, other):
+        try:
+            if len(self) != len(other):
+                return False
+        except TypeError:
+            return NotImplemented
+        return all(a == b for a, b in zip(self, other))
+
+    def __repr__(self):
+        return "CueStore: [{} cues]".format(len(self))
+
+    def _get(self, i):
+        return srt.Subtitle(index=self.indexes[i],
+                            start=timedelta(microseconds=self.starts[i]),
+                            end=timedelta(microseconds=self.ends[i]),
+                            content=self.text[self.offsets[i]:self.offsets[i+1]],
+                            proprietary=self.proprietary.get(i, ''))
+
+    def to_bytes(self):
+        """Serialize the store into bytes (see `from_bytes`)."""
+        text = self.text.encode('utf-8')
+        prop = json.dumps(self.proprietary).encode('utf-8') if self.proprietary else b''
+        return b''.join((
+            self._header.pack(len(self), len(text), len(prop)),
+            self.indexes.tobytes(), self.starts.tobytes(), self.ends.tobytes(),
+            self.offsets.tobytes(), text, prop))
+
+    @classmethod
+    def from_bytes(cls, data):
+        """Create the store from bytes produced by `to_bytes`."""
+        count, text_len, prop_len = cls._header.unpack_from(data)
+        store = cls()
+        pos = cls._header.size
+        for a, n in ((store.indexes, count), (store.starts, count),
+                     (store.ends, count)):
+            a.frombytes(data[pos:pos + n*a.itemsize])
+            pos += n*a.itemsize
+        store.offsets = array('q')
+        store.offsets.frombytes(data[pos:pos + (count+1)*8])
+        pos += (count+1)*8
+        store.text = data[pos:pos + text_len].decode('utf-8')
+        pos += text_len
+        if prop_len:
+            prop = json.loads(data[pos:pos + prop_len].decode('utf-8'))
+            store.proprietary = {int(k): v for k, v in prop.items()}
+        if len(store.offsets) != count + 1 or len(store.ends) != count:
+            raise ValueError('Truncated cues data')
+        return store
+
+    def nbytes(self):
+        """Returns memory footprint of the store (bytes)."""
+        size = sys.getsizeof(self) + sys.getsizeof(self.text)
+        for a in (self.indexes, self.starts, self.ends, self.offsets):
+            size += sys.getsizeof(a)
+        size += sys.getsizeof(self.proprietary)
+        size += sum(sys.getsizeof(v) for v in self.proprietary.values())
+        return size
+
+    @staticmethod
+    def list_nbytes(subtitles):
+        """Returns memory footprint of a list of `Subtitles` (bytes)."""
+        size = sys.getsizeof(subtitles)
+        for s in subtitles:
+            size += sys.getsizeof(s) + sys.getsizeof(vars(s))
+            size += sum(sys.getsizeof(v) for v in vars(s).values())
+        return size
+
+
+def _file_digest(data):
+    return hashlib.blake2b(data, digest_size=16).digest()
+
+
+# magic, version, source mtime (ns), source size, source digest
+_cues_cache_header = struct.Struct('<3sBqq16s')
+_CUES_CACHE_MAGIC = b'PSC'
+
+
+def read_cues_cache(name):
+    """
+    Read parsed subtitles from the cache file next to the SRT file `name`.
+    The cache is fresh if its recorded mtime and size match the SRT file,
+    or if the SRT file content has the recorded hash.
+    Args:
+        `name` (str): SRT file name
+    Returns:
+        `CueStore` object or None if the cache is missing or stale
+    """
+    try:
+        with open(name + CUES_CACHE_EXT, 'rb') as f:
+            data = f.read()
+        st = os.stat(name)
+        magic, version, mtime, size, digest = _cues_cache_header.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    if (magic != _CUES_CACHE_MAGIC or version != CUES_CACHE_VERSION
+            or size != st.st_size):
+        return None
+    if mtime != st.st_mtime_ns:
+        with open(name, 'rb') as f:
+            if _file_digest(f.read()) != digest:
+                return None
+        # Content is the same (file was touched or copied): update stamp
+        write_cues_cache(name, None, data)
+    try:
+        return CueStore.from_bytes(data[_cues_cache_header.size:])
+    except (ValueError, struct.error):
+        return None
+
+
+def write_cues_cache(name, cues, cache_data=None):
+    """
+    Write parsed subtitles `cues` into the cache file next to the SRT file.
+    Args:
+        `name` (str): SRT file name
+        `cues` (`CueStore`): subtitles parsed from the file
+        `cache_data` (bytes): existing cache data to restamp (instead of `cues`)
+    """
+    try:
+        with open(name, 'rb') as f:
+            src = f.read()
+            st = os.fstat(f.fileno())
+        if cache_data is not None:
+            body = cache_data[_cues_cache_header.size:]
+        else:
+            body = cues.to_bytes()
+        header = _cues_cache_header.pack(_CUES_CACHE_MAGIC, CUES_CACHE_VERSION,
+                                         st.st_mtime_ns, st.st_size, _file_digest(src))
+        tmp_name = name + CUES_CACHE_EXT + '.tmp'
+        with open(tmp_name, 'wb') as f:
+            f.write(header + body)
+        os.replace(tmp_name, name + CUES_CACHE_EXT)
+    except OSError as e:
+        logger.warning("Can't write subtitles cache for {}: {}".format(name, e))
+
+
+# source mtime (ns), source size, number of cues
+_cue_offsets_header = struct.Struct('<4sqqq')
+_CUE_OFFSETS_MAGIC = b'PSO1'
+
+
+def write_cue_offsets(name):
+    """
+    Scan the SRT file `name` and write byte offsets of its cues into
+    the offsets file next to it (see `pairsubs_srt.cue_offsets`).
+    Returns:
+        array of int: offsets of the cues and of the file end
+    """
+    with open(name, 'rb') as f:
+        offsets = pairsubs_srt.cue_offsets(f)
+        st = os.fstat(f.fileno())
+    try:
+        tmp_name = name + CUE_OFFSETS_EXT + '.tmp'
+        with open(tmp_name, 'wb') as f:
+            f.write(_cue_offsets_header.pack(_CUE_OFFSETS_MAGIC, st.st_mtime_ns,
+                                             st.st_size, len(offsets) - 1))
+            f.write(offsets.tobytes())
+        os.replace(tmp_name, name + CUE_OFFSETS_EXT)
+    except OSError as e:
+        logger.warning("Can't write cue offsets for {}: {}".format(name, e))
+    return offsets
+
+
+def _read_cue_range(name, start, stop):
+    """
+    Returns byte range of cues `[start:stop]` of the SRT file `name`.
+    Only the header and two entries of the offsets file are read, the
+    file is rebuilt if it is missing or stale.
+    """
+    st = os.stat(name)
+    try:
+        with open(name + CUE_OFFSETS_EXT, 'rb') as f:
+            magic, mtime, size, count = _cue_offsets_header.unpack(
+                    f.read(_cue_offsets_header.size))
+            if (magic == _CUE_OFFSETS_MAGIC and mtime == st.st_mtime_ns and
+                    size == st.st_size):
+                start, stop, _ = slice(start, stop).indices(count)
+                stop = max(start, stop)
+                entry = array('q')
+                for i in (start, stop):
+                    f.seek(_cue_offsets_header.size + i * entry.itemsize)
+                    entry.frombytes(f.read(entry.itemsize))
+                return tuple(entry)
+    except (OSError, struct.error, ValueError):
+        pass
+    offsets = write_cue_offsets(name)
+    start, stop, _ = slice(start, stop).indices(len(offsets) - 1)
+    return offsets[start], offsets[max(start, stop)]
+
+
+# alignment key
+_cue_table_header = struct.Struct('<4s16s')
+_CUE_TABLE_MAGIC = b'PST1'
+
+
+def read_cue_table(name, key):
+    """
+    Read cue alignment table from file `name`.
+    Args:
+        `name` (str): table file name
+        `key` (bytes): alignment key the table must be built for
+    Returns:
+        array of int (see `SubPair.get_cue_table`) or None if the table
+        is missing or stale
+    """
+    try:
+        with open(name, 'rb') as f:
+            data = f.read()
+        magic, table_key = _cue_table_header.unpack_from(data)
+    except (OSError, struct.error):
+        return None
+    if magic != _CUE_TABLE_MAGIC or table_key != key:
+        return None
+    table = array('i')
+    try:
+        table.frombytes(data[_cue_table_header.size:])
+    except ValueError:
+        return None
+    return table
+
+
+def write_cue_table(name, key, table):
+    """Write cue alignment `table` built for alignment `key` into file `name`."""
+    try:
+        # a table of the pair can be written by several threads
+        # (from different SubPair objects)
+        tmp_name = '{}.{}.tmp'.format(name, threading.get_ident())
+        with open(tmp_name, 'wb') as f:
+            f.write(_cue_table_header.pack(_CUE_TABLE_MAGIC, key) + table.tobytes())
+        os.replace(tmp_name, name)
+    except OSError as e:
+        logger.warning("Can't write cue table {}: {}".format(name, e))
 
 
 class Subs:
@@ -163,19 +917,21 @@ class Subs:
         `decode` (bool): True if to decode subtitles as SubLanguageID defines
     Attributes:
         `sub_info` (dict): subtitles information
-        `sub` (list of `Subtitles`)
+        `sub` (`CueStore`): subtitles
+        `start_index` (array of int): sorted start times (microseconds)
+        `start_order` (array of int): positions in `sub` for `start_index`
     """
 
-    def __init__(self, sub_data, sub_info, decode=True):
-        info_keys = ('SubLanguageID',
-                     'SubFileName',
-                     'SubEncoding',
-                     'MovieName',
-                     'IDMovieImdb',
-                     'IDSubtitleFile')
+    info_keys = ('SubLanguageID',
+                 'SubFileName',
+                 'SubEncoding',
+                 'MovieName',
+                 'IDMovieImdb',
+                 'IDSubtitleFile')
 
+    def __init__(self, sub_data, sub_info, decode=True):
         self.sub_info = {}
-        for k in info_keys:
+        for k in self.info_keys:
             self.sub_info[k] = sub_info.get(k, None)
 
         # Decode bytes to Unicode string
@@ -185,8 +941,8 @@ class Subs:
         else:
             data_decoded = sub_data
 
-        # Parse bytes into a list of Subtitles objects
-        self.sub = self._parse_subtitles(data_decoded)
+        self.sub = self._parse_subtitles(io.StringIO(data_decoded))
+        self.build_index()
 
     def __repr__(self):
         return "Subs: [{}] [{}] [{}]".format(self.sub_info['MovieName'],
@@ -213,8 +969,10 @@ class Subs:
         """Save subtitles file."""
         data = srt.compose(self.sub)
         file_name = name if name else self.sub_info['SubFileName']
-        with open(os.path.join(FILES_DIR, file_name), 'w') as f:
+        path = os.path.join(FILES_DIR, file_name)
+        with open(path, 'w') as f:
             f.write(data)
+        write_cue_offsets(path)
 
     @classmethod
     def read(cls, sub_info):
@@ -226,9 +984,57 @@ class Subs:
             `Subs` object
         """
         name = os.path.join(FILES_DIR, sub_info['SubFileName'])
+        cues = read_cues_cache(name)
+        if cues is not None:
+            return cls.from_cues(cues, sub_info)
+
         with open(name, 'r') as f:
-            data = f.read()
-        return cls(data, sub_info, decode=False)
+            cues = cls._parse_subtitles(f)
+        write_cues_cache(name, cues)
+        return cls.from_cues(cues, sub_info)
+
+    @staticmethod
+    def read_slice(sub_info, start, stop):
+        """
+        Read cues `[start:stop]` of the subtitles file (negative positions
+        count from the end). Only these cues are read and parsed, they are
+        found by the cue offsets file.
+        Returns:
+            list of `Subtitles`
+        """
+        name = os.path.join(FILES_DIR, sub_info['SubFileName'])
+        lo, hi = _read_cue_range(name, start, stop)
+        with open(name, 'rb') as f:
+            f.seek(lo)
+            data = f.read(hi - lo)
+        # decoded as `open(name, 'r')` does
+        return list(pairsubs_srt.iter_srt(io.TextIOWrapper(io.BytesIO(data))))
+
+    @classmethod
+    def from_cues(cls, cues, sub_info):
+        """
+        Create subtitles from already parsed cues.
+        Args:
+            `cues` (`CueStore`): subtitles
+            `sub_info` (dict): subtitles information
+        Returns:
+            `Subs` object
+        """
+        subs = cls.__new__(cls)
+        subs.sub_info = {k: sub_info.get(k, None) for k in cls.info_keys}
+        subs.sub = cues
+        subs.build_index()
+        return subs
+
+    def build_index(self):
+        """
+        Build the sorted start time index used by `get_subs`.
+        Must be called again if `sub` is modified.
+        """
+        starts = self.sub.starts
+        order = sorted(range(len(starts)), key=starts.__getitem__)
+        self.start_order = array('q', order)
+        self.start_index = array('q', (starts[i] for i in order))
 
     def get_subs(self, start, end):
         """
@@ -237,29 +1043,52 @@ class Subs:
             `start` (float): start time of subtitles (seconds)
             `end` (float): end time of subtitles (seconds)
         Returns:
-            list` of `Subtitles`
+            list` of `Subtitles` (in file order)
         """
-        subs = []
-        for s in self.sub:
-            if (s.start >= self.seconds_to_timedelta(start) and
-                    s.start <= self.seconds_to_timedelta(end)):
-                subs.append(s)
-        return subs
+        lo = bisect_left(self.start_index,
+                         timedelta_to_us(self.seconds_to_timedelta(start)))
+        hi = bisect_right(self.start_index,
+                          timedelta_to_us(self.seconds_to_timedelta(end)))
+        return [self.sub[i] for i in sorted(self.start_order[lo:hi])]
+
+    def start_times(self):
+        """Returns sorted start times of the subtitles (seconds)."""
+        return [x / 1e6 for x in self.start_index]
+
+    def cue_texts(self):
+        """Returns texts of the cues sorted by start."""
+        cues = self.sub
+        return [cues.text[cues.offsets[i]:cues.offsets[i+1]] for i in self.start_order]
+
+    def cue_timeline(self):
+        """
+        Returns (start, end, text length) of the cues sorted by start
+        (times in seconds).
+        """
+        cues = self.sub
+        return [(cues.starts[i] / 1e6, cues.ends[i] / 1e6,
+                 cues.offsets[i+1] - cues.offsets[i]) for i in self.start_order]
 
-    def _parse_subtitles(self, data):
+    def nbytes(self):
+        """Returns memory footprint of the subtitles (bytes)."""
+        return (self.sub.nbytes() + sys.getsizeof(self.start_index) +
+                sys.getsizeof(self.start_order))
+
+    @staticmethod
+    def _parse_subtitles(lines):
         """
-        Parse subtitles from str.
+        Parse subtitles, malformed blocks are skipped.
         Args:
-            `data` (str): subtitles data
+            `lines` (iterable of str): subtitles data lines
         Returns:
-            list of `Subtitles`
+            `CueStore` object
         """
-        try:
-            sub = list(srt.parse(data))
-        except (ValueError, SRTParseError) as e:
-            logger.error("Subtitles parsing failed: {}".format(e))
-            sub = []
-        return sub
+        errors = []
+        cues = CueStore(pairsubs_srt.iter_srt(lines, errors))
+        if errors:
+            logger.warning("Subtitles parsing: skipped {} bad blocks "
+                           "(first at line {})".format(len(errors), errors[0].line))
+        return cues
 
     def seconds_to_timedelta(self, seconds):
         s = int(seconds)
@@ -267,57 +1096,217 @@ class Subs:
         return timedelta(seconds=s,  milliseconds=ms)
 
 
+def _interpolate(points, t):
+    """
+    Piecewise linear function through sorted `points` (x, y) at `t`,
+    extrapolated by the first or the last segment.
+    """
+    i = min(max(bisect_right(points, (t, math.inf)) - 1, 0), len(points) - 2)
+    (x0, y0), (x1, y1) = points[i], points[i+1]
+    return y0 + (t - x0) * (y1 - y0) / (x1 - x0) if x1 != x0 else y0
+
+
 class SubPair:
     """Pair of subtitles.
+        The timelines of the subtitles are aligned by anchors: pairs of
+        matching times of the first and the second subtitles. Time is
+        mapped by linear interpolation between the nearest anchors.
         Attributes:
             `subs`: tuple of two `Subs` objects
-            `first_start` (float):
-            `first_end` (float):
-            `second_start` (float):
-            `second_end` (float):
+            `anchors` (list of (float, float)): anchors sorted by the
+                first subtitles time (seconds), at least two
+            `first_start` (float): first anchor time of the first subtitles
+            `first_end` (float): last anchor time of the first subtitles
+            `second_start` (float): first anchor time of the second subtitles
+            `second_end` (float): last anchor time of the second subtitles
+            `dirty` (bool): alignment is changed and not saved yet
     """
+    #: Alignment fields of SubPair info saved before anchors
+    align_keys = ('first_start', 'first_end', 'second_start', 'second_end')
+
     def __init__(self, subs):
         """
         Args:
             `subs`: tuple of two `Subs` objects
         """
         self.subs = subs
-        self.first_start = 0
-        self.first_end = subs[0].sub[-1].start.total_seconds()
-        self.second_start = 0
-        self.second_end = subs[0].sub[-1].start.total_seconds()
+        self.anchors = [(0, 0), (subs[0].sub[-1].start.total_seconds(),
+                                 subs[0].sub[-1].start.total_seconds())]
+        self.dirty = False
+        self.cue_table = None
+        self.cue_table_key = None
+        self._table_lock = threading.Lock()
+
+    @property
+    def first_start(self):
+        return self.anchors[0][0]
+
+    @first_start.setter
+    def first_start(self, value):
+        self.anchors[0] = (value, self.anchors[0][1])
+
+    @property
+    def first_end(self):
+        return self.anchors[-1][0]
+
+    @first_end.setter
+    def first_end(self, value):
+        self.anchors[-1] = (value, self.anchors[-1][1])
+
+    @property
+    def second_start(self):
+        return self.anchors[0][1]
+
+    @second_start.setter
+    def second_start(self, value):
+        self.anchors[0] = (self.anchors[0][0], value)
+
+    @property
+    def second_end(self):
+        return self.anchors[-1][1]
+
+    @second_end.setter
+    def second_end(self, value):
+        self.anchors[-1] = (self.anchors[-1][0], value)
+
+    def set_anchors(self, anchors):
+        """
+        Set alignment anchors.
+        Args:
+            `anchors` (iterable of (float, float)): pairs of matching times
+                (seconds) of the first and the second subtitles
+        """
+        anchors = sorted((float(f), float(s)) for f, s in anchors)
+        if len(anchors) < 2:
+            raise ValueError('At least two anchors are required')
+        self.anchors = anchors
+        self.dirty = True
+
+    def add_anchor(self, first_time, second_time):
+        """Add an anchor (replaces an anchor with the same first time)."""
+        anchors = [x for x in self.anchors if x[0] != first_time]
+        self.set_anchors(anchors + [(first_time, second_time)])
+
+    def map_time(self, t):
+        """Map time `t` of the first subtitles to the second ones (seconds)."""
+        return self.map_times([t])[0]
+
+    def map_times(self, times):
+        """
+        Map times of the first subtitles to the second ones (seconds).
+        Times before the first or after the last anchor are extrapolated
+        by the first or the last segment.
+        Args:
+            `times` (iterable of float): times of the first subtitles
+        Returns:
+            list of float
+        """
+        anchors = self.anchors
+        firsts = [f for f, _ in anchors]
+        last = len(anchors) - 2
+        res = []
+        i = 0
+        prev = None
+        for t in times:
+            # sorted input is mapped in one pass over the segments
+            if prev is not None and t >= prev:
+                while i < last and firsts[i+1] <= t:
+                    i += 1
+            else:
+                i = min(max(bisect_right(firsts, t) - 1, 0), last)
+            prev = t
+            (f0, s0), (f1, s1) = anchors[i], anchors[i+1]
+            res.append(s0 + (t - f0) * (s1 - s0) / (f1 - f0) if f1 != f0 else s0)
+        return res
 
     def __repr__(self):
         return "[{}, {}]".format(self.subs[0].__repr__(),
                                  self.subs[1].__repr__())
 
     @classmethod
-    def download(cls, imdbid, lang1, lang2, enc1=None, enc2=None):
+    def download(cls, imdbid, lang1, lang2, enc1=None, enc2=None, osub=None):
+        """
+        Download subtitles from Opensubtitles.org.
+        Both languages are searched concurrently and downloaded
+        with one API call.
+        Args:
+            `imdbid` (str): INDB id string (or URL)
+            `lang1` (str): first language
+            `lang2` (str): second language
+            `osub` (`Opensubtitles`): session to use
+                (a new session is opened and closed if None)
+        Returns:
+            `SubPair` object or None
+        """
         logger.info("Start subtitles download: {} ({}, {})".format(
                                            imdbid, lang1, lang2))
-        logger.info("Login into Opensubtitles...")
-        osub = Opensubtitles()
-        osub.login()
+        own_session = osub is None
+        if own_session:
+            osub = Opensubtitles()
 
-        subs = []
-        for lang, enc in [(lang1, enc1), (lang2, enc2)]:
+        try:
+            infos = cls.search(osub, imdbid, lang1, lang2)
+            if not infos:
+                return None
+            logger.info("Download {}, {}...".format(lang1, lang2))
+            data = osub.download_subs(infos)
+        finally:
+            if own_session:
+                osub.logout()
+
+        return cls.from_data(infos, data)
+
+    @staticmethod
+    def search(osub, imdbid, lang1, lang2):
+        """
+        Search subtitles of both languages concurrently.
+        If either of them isn't found, the other search is cancelled.
+        Args:
+            `osub` (`Opensubtitles`): logged in Opensubtitles session
+            `imdbid` (str): INDB id string (or URL)
+            `lang1` (str): first language
+            `lang2` (str): second language
+        Returns:
+            list of two subtitles infos (dict) or None
+        """
+        def search_sub(lang):
             logger.info("Search {}...".format(lang))
             sub = osub.search_sub(imdbid, lang)
-            if sub:
-                logger.info("Download {}...".format(lang))
-                sub_b = osub.download_sub(sub)
-                s = Subs(sub_b, sub)
-                if s.sub:
-                    subs.append(s)
-                else:
-                    logger.info("Failed the subtitles parsing".format(lang))
-                    return None
-            else:
+            if not sub:
                 logger.info("Subtitles #{} aren't found".format(lang))
-                osub.logout()
-                return None
+            return sub
+
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as executor:
+            futures = [executor.submit(search_sub, lang) for lang in (lang1, lang2)]
+            for f in as_completed(futures):
+                if not f.cancelled() and (f.exception() or not f.result()):
+                    for other in futures:
+                        other.cancel()
+        infos = [f.result() for f in futures if not f.cancelled()]
+        if len(infos) < 2 or not all(infos):
+            return None
+        return infos
 
-        osub.logout()
+    @classmethod
+    def from_data(cls, infos, data):
+        """
+        Create SubPair from downloaded subtitles.
+        Args:
+            `infos` (list of dicts): subtitles info in Opensubtitles API format
+            `data` (list of bytes): subtitles data
+        Returns:
+            `SubPair` object or None if the subtitles can't be parsed
+        """
+        subs = []
+        for info, sub_b in zip(infos, data):
+            if sub_b is None:
+                return None
+            s = Subs(sub_b, info)
+            if not s.sub:
+                logger.info("Failed the subtitles parsing ({})".format(
+                    info['SubLanguageID']))
+                return None
+            subs.append(s)
         return cls(subs)
 
     @classmethod
@@ -326,7 +1315,124 @@ class SubPair:
         for sub in info['subs']:
             s = Subs.read(sub)
             subs.append(s)
-        return cls(subs)
+        sub_pair = cls(subs)
+        if info.get('anchors'):
+            sub_pair.anchors = [tuple(x) for x in info['anchors']]
+        else:
+            # SubPair info without anchors (two anchors only)
+            for k in cls.align_keys:
+                if k in info:
+                    setattr(sub_pair, k, info[k])
+        return sub_pair
+
+    def alignment_key(self):
+        """Returns digest of the alignment the cue table depends on."""
+        data = json.dumps([self.anchors, len(self.subs[0].sub), len(self.subs[1].sub)])
+        return _file_digest(data.encode('utf-8'))
+
+    def build_cue_table(self):
+        """
+        Pair the cues of the subtitles (see `pairsubs_align.align_cues`).
+        Returns:
+            array of int: (i0, i1, j0, j1) of each bead, the positions are
+            in the start order of the subtitles (`Subs.start_order`)
+        """
+        first = self.subs[0].cue_timeline()
+        starts = self.map_times([x[0] for x in first])
+        ends = self.map_times([x[1] for x in first])
+        first = [(s, e, x[2]) for s, e, x in zip(starts, ends, first)]
+        beads = pairsubs_align.align_cues(first, self.subs[1].cue_timeline())
+        return array('i', [x for bead in beads for x in bead])
+
+    def get_cue_table(self, build=True):
+        """
+        Returns cue alignment table (see `build_cue_table`) for the
+        current alignment. The table is kept in `FILES_DIR` and built
+        only if it's missing or the alignment has changed.
+        The table is built by one thread at a time.
+        Args:
+            `build` (bool): build a missing table; if False, None is returned
+                when the table is missing or another thread builds it
+        """
+        if not self._table_lock.acquire(blocking=build):
+            return None
+        try:
+            key = self.alignment_key()
+            if self.cue_table is None or self.cue_table_key != key:
+                name = os.path.join(FILES_DIR, self.get_id() + CUE_TABLE_EXT)
+                table = read_cue_table(name, key)
+                if table is None:
+                    if not build:
+                        return None
+                    table = self.build_cue_table()
+                    if self.alignment_key() != key:
+                        # realigned while the table was built
+                        return table
+                    write_cue_table(name, key, table)
+                self.cue_table = table
+                self.cue_table_key = key
+            return self.cue_table
+        finally:
+            self._table_lock.release()
+
+    def get_card(self, start, count=CARD_BEADS):
+        """
+        Returns `count` aligned cue groups from the cue table.
+        The table isn't built here: if it's missing, the card is cut
+        from the timeline by `get_parallel_subs`.
+        Args:
+            `start` (float): 0-100 percentage of the table from the begin
+            `count` (int): number of cue groups
+        Returns:
+            list of to two lists of `Subtitles`
+        """
+        table = self.get_cue_table(build=False)
+        if table is None:
+            return self.get_parallel_subs(start, CARD_LENGTH)
+        beads = len(table) // 4
+        return self._card(table, min(int(beads * start / 100), max(beads - count, 0)),
+                          count)
+
+    def get_card_at(self, side, position, count=CARD_BEADS):
+        """
+        Returns `count` aligned cue groups around a cue.
+        The table isn't built here (see `get_card`).
+        Args:
+            `side` (int): 0 for the first subtitles, 1 for the second ones
+            `position` (int): cue position in the start order
+            `count` (int): number of cue groups
+        Returns:
+            list of to two lists of `Subtitles`
+        """
+        table = self.get_cue_table(build=False)
+        if table is None:
+            # no cue table yet: cut the card by timing around the cue
+            t = self.subs[side].start_index[position] / 1e6
+            if side:
+                t = _interpolate(sorted((s, f) for f, s in self.anchors), t)
+            f_start = t - CARD_LENGTH / 2
+            f_end = f_start + CARD_LENGTH
+            return [self.subs[0].get_subs(f_start, f_end),
+                    self.subs[1].get_subs(*self.map_times((f_start, f_end)))]
+        beads = len(table) // 4
+        # first cue positions of the side in the beads
+        starts = table[2*side::4]
+        k = bisect_right(starts, position) - 1
+        # skip beads without cues of the side
+        while k > 0 and table[4*k+2*side] == table[4*k+2*side+1]:
+            k -= 1
+        k0 = max(0, min(k - count // 2, beads - count))
+        return self._card(table, k0, count)
+
+    def _card(self, table, k0, count):
+        beads = len(table) // 4
+        s1, s2 = self.subs
+        first, second = [], []
+        for k in range(k0, min(k0 + count, beads)):
+            i0, i1, j0, j1 = table[4*k:4*k+4]
+            first.extend(s1.sub[s1.start_order[p]] for p in range(i0, i1))
+            second.extend(s2.sub[s2.start_order[p]] for p in range(j0, j1))
+        return [first, second]
 
     def get_parallel_subs(self, start, length):
         """
@@ -337,15 +1443,12 @@ class SubPair:
             list of to two lists of `Subtitles`
         """
         first_len = self.first_end - self.first_start
-        second_len = self.second_end - self.second_start
-        coeff = first_len/second_len
         offset = first_len * start / 100
 
         f_start = self.first_start + offset
         f_end = f_start + length
 
-        s_start = self.second_start + offset/coeff
-        s_end = s_start + length/coeff
+        s_start, s_end = self.map_times((f_start, f_end))
 
         par_subs = []
         for s, params in zip(self.subs, [(f_start, f_end), (s_start, s_end)]):
@@ -355,33 +1458,172 @@ class SubPair:
         return par_subs
 
     def align_subs(self, left_start, right_start, left_end, right_end):
-        self.first_start = self.subs[0].sub[left_start-1].start.total_seconds()
-        self.first_end = self.subs[0].sub[left_end-1].start.total_seconds()
-
-        self.second_start = self.subs[1].sub[right_start-1].start.total_seconds()
-        self.second_end = self.subs[1].sub[right_end-1].start.total_seconds()
+        """Align the subtitles by two pairs of cues (indexes from 1)."""
+        first, second = self.subs[0].sub, self.subs[1].sub
+        self.set_anchors([
+            (first[left_start-1].start.total_seconds(),
+             second[right_start-1].start.total_seconds()),
+            (first[left_end-1].start.total_seconds(),
+             second[right_end-1].start.total_seconds())])
+
+    def auto_align(self):
+        """
+        Align the subtitles by their cues timing (see `pairsubs_align`).
+        The first and the last cues of the first subtitles are used as
+        anchors.
+        Returns:
+            share of the first subtitles cues matched by the second ones
+        """
+        first = self.subs[0].start_times()
+        scale, offset, score = pairsubs_align.estimate(
+                first, self.subs[1].start_times())
+        self.set_anchors([(t, scale * t + offset) for t in (first[0], first[-1])])
+        logger.info("Auto alignment: scale {:.4f}, offset {:.2f} s, "
+                    "matched {:.0%}".format(scale, offset, score))
+        return score
 
     def save_subs(self):
         for sub in self.subs:
             sub.save()
 
     def get_id(self):
-        return '_'.join([
-                self.subs[0].sub_info['IDSubtitleFile'],
-                self.subs[1].sub_info['IDSubtitleFile']
-                ])
+        return self.make_id([self.subs[0].sub_info, self.subs[1].sub_info])
+
+    @staticmethod
+    def make_id(infos):
+        """Returns SubPair id for the pair of subtitles infos."""
+        return '_'.join([infos[0]['IDSubtitleFile'], infos[1]['IDSubtitleFile']])
+
+    def nbytes(self):
+        """Returns memory footprint of the subtitles (bytes)."""
+        return sum(x.nbytes() for x in self.subs)
+
+    def get_alignment(self):
+        return {'first_start': self.first_start,
+                'first_end': self.first_end,
+                'second_start': self.second_start,
+                'second_end': self.second_end,
+                'anchors': [list(x) for x in self.anchors]}
 
     def get_data(self):
         return {'first_start': self.first_start,
                 'first_end': self.first_end,
                 'second_start': self.second_start,
                 'second_end': self.second_end,
+                'anchors': [list(x) for x in self.anchors],
                 'subs': [
                     self.subs[0].sub_info,
                     self.subs[1].sub_info
                     ]}
 
 
+class SubPairCache:
+    """
+    LRU cache of loaded SubPairs bounded by number of pairs and their
+    memory footprint (`SubPair.nbytes`). The last added pair is kept
+    even if it alone exceeds the bounds.
+    Args:
+        `max_pairs` (int): max number of pairs
+        `max_bytes` (int): max memory footprint of the pairs
+        `on_evict` (callable): called as `on_evict(sub_id, sub_pair)`
+            before a pair is evicted
+    """
+    def __init__(self, max_pairs=CACHE_MAX_PAIRS, max_bytes=CACHE_MAX_BYTES,
+                 on_evict=None):
+        self.max_pairs = max_pairs
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.pairs = collections.OrderedDict()
+        self.sizes = {}
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __contains__(self, sub_id):
+        return sub_id in self.pairs
+
+    def __len__(self):
+        return len(self.pairs)
+
+    def __iter__(self):
+        return iter(self.pairs)
+
+    def __getitem__(self, sub_id):
+        return self.pairs[sub_id]
+
+    def items(self):
+        return self.pairs.items()
+
+    def values(self):
+        return self.pairs.values()
+
+    def get(self, sub_id):
+        """Returns cached SubPair (and marks it as recently used) or None."""
+        sub_pair = self.pairs.get(sub_id)
+        if sub_pair is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.pairs.move_to_end(sub_id)
+        return sub_pair
+
+    def put(self, sub_id, sub_pair):
+        self.pop(sub_id)
+        self.pairs[sub_id] = sub_pair
+        self.sizes[sub_id] = sub_pair.nbytes()
+        self.nbytes += self.sizes[sub_id]
+        while len(self.pairs) > 1 and (len(self.pairs) > self.max_pairs or
+                                       self.nbytes > self.max_bytes):
+            old_id, old_pair = next(iter(self.pairs.items()))
+            if self.on_evict:
+                self.on_evict(old_id, old_pair)
+            self.pop(old_id)
+            self.evictions += 1
+
+    def pop(self, sub_id, default=None):
+        sub_pair = self.pairs.pop(sub_id, None)
+        if sub_pair is None:
+            return default
+        self.nbytes -= self.sizes.pop(sub_id)
+        return sub_pair
+
+    def stats(self):
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'pairs': len(self.pairs),
+                'nbytes': self.nbytes}
+
+
+class DeleteReport:
+    """
+    Result of `SubDb.delete_many`.
+    Attributes:
+        `deleted` (list of str): ids of deleted SubPairs
+        `not_found` (list of str): ids which are not in the database
+        `missing_files` (list of (str, str)): SubPair ids and names of
+            their files which were already removed
+        `failed` (list of (str, str)): ids of SubPairs which were not
+            deleted and reasons
+    """
+    def __init__(self):
+        self.deleted = []
+        self.not_found = []
+        self.missing_files = []
+        self.failed = []
+
+
+# SubDb objects which aren't closed, their pending writes are flushed on exit
+_open_dbs = weakref.WeakSet()
+
+
+@atexit.register
+def _flush_open_dbs():
+    for db in list(_open_dbs):
+        db.flush()
+
+
 class SubDb():
     """Subtitles Database Class.
 
@@ -394,6 +1636,8 @@ class SubDb():
                 `first_end`: (float)
                 `second_start`: (float)
                 `second_end`: (float)
+                `anchors`: (list of [float, float]) alignment anchors,
+                    missing in old entries (the four fields above are used)
                 `subs`: sub_info (list of dicts)
 
                 sub_info (dict) : sub info dictionary with fields:
@@ -404,11 +1648,32 @@ class SubDb():
                     `IDMovieImdb` : (str)
                     `IDSubtitleFile` :(str)
 
-        cache: (dict of {str: `SubPair`}) SubPairs dictionary with fields:
+        cache: (`SubPairCache`) loaded SubPairs by id
+        storage: (`pairsubs_storage.Storage`) storage engine
+        osub: (`Opensubtitles`) session shared by downloads
+        lock: (`threading.RLock`) lock of `data` and `cache` for
+            background downloads
+        write_delay: (float) delay of alignment writes (seconds),
+            changes made during the delay are written at once
+        version: (int) counter of alignment changes and deletions,
+            cards made at an older version may be stale
     """
-    def __init__(self):
+    def __init__(self, storage=None, write_delay=WRITE_DELAY,
+                 cache_pairs=CACHE_MAX_PAIRS, cache_bytes=CACHE_MAX_BYTES,
+                 index=None):
+        self.storage = storage
+        self.index = index
+        self._index_checked = False
+        self.osub = None
+        self.lock = threading.RLock()
         self.data = self.load_data()
-        self.cache = {}
+        self.cache = SubPairCache(cache_pairs, cache_bytes, self._on_evict)
+        self.write_delay = write_delay
+        self._write_timer = None
+        self._table_queue = queue.Queue()
+        self._table_thread = None
+        self.version = 0
+        _open_dbs.add(self)
 
     def load_data(self):
         """Load subtitles info data."""
@@ -420,22 +1685,60 @@ class SubDb():
         if not os.path.exists(FILES_DIR):
             os.makedirs(FILES_DIR)
 
-        # If the cache db doesn't exist we create it.
-        # Otherwise we only open for reading
-        if not os.path.isfile(CACHE_DB):
-            with open(CACHE_DB, 'a'):
-                os.utime(CACHE_DB, None)
+        if self.storage is None:
+            self.storage = self.open_storage()
+        if self.index is None:
+            self.index = pairsubs_index.SubIndex(INDEX_DIR)
+        return self.storage.load()
 
-        data = {}
+    @staticmethod
+    def open_storage(engine=None):
+        """
+        Open the storage engine.
+        The JSON database is migrated into SQLite database on the first run.
+        Args:
+            `engine` (str): 'sqlite' or 'json' (`DB_ENGINE` by default)
+        Returns:
+            `pairsubs_storage.Storage` object
+        """
+        engine = engine or DB_ENGINE
+        if engine == 'json':
+            return pairsubs_storage.JsonStorage(CACHE_DB)
+        storage = pairsubs_storage.SqliteStorage(SQLITE_DB)
+        pairsubs_storage.migrate_json(CACHE_DB, storage)
+        return storage
+
+    def close(self):
+        self.flush()
+        _open_dbs.discard(self)
+        if self._table_thread:
+            self._table_queue.put(None)
+        logger.info("SubPairs cache: {}".format(self.cache.stats()))
+        if self.osub:
+            self.osub.close()
+        if self.storage:
+            self.storage.close()
+        if self.index:
+            self.index.close()
+
+    def get_session(self):
+        """
+        Returns Opensubtitles session shared by downloads.
+        The session is kept in `SESSION_FILE` and reused by next runs.
+        """
+        if self.osub is None:
+            self.osub = Opensubtitles(session_file=SESSION_FILE)
+        return self.osub
 
-        # We know from above that this file exists so we open it
-        #   for reading only.
-        with open(CACHE_DB, 'r') as f:
-            try:
-                data = json.load(f)
-            except ValueError:
-                pass
-        return data
+    def ids(self):
+        """Returns a list of SubPair ids (a snapshot taken under `lock`)."""
+        with self.lock:
+            return list(self.data)
+
+    def info(self, sub_id):
+        """Returns SubPair info (see `data`) or None if it isn't in the db."""
+        with self.lock:
+            return self.data.get(sub_id)
 
     def is_in_db(self, sub_pair):
         sub_id = sub_pair.get_id()
@@ -457,46 +1760,116 @@ class SubDb():
         Returns:
             `SubPair` object
         """
-        sub_pair = SubPair.download(imdbid, lang1, lang2)
+        sub_pair = SubPair.download(imdbid, lang1, lang2, osub=self.get_session())
         if sub_pair:
-            self.add_subpair(sub_pair)
-            self.add_to_cache(sub_pair)
-            self.write_db()
-            sub_pair.save_subs()
+            with self.lock:
+                self.add_subpair(sub_pair)
+                self.add_to_cache(sub_pair)
+                self.write_db([sub_pair.get_id()])
+                sub_pair.save_subs()
+                self._index_pairs([sub_pair])
             return sub_pair.get_id()
 
-    def write_db(self):
-        # update db data with the alignment data from cache
-        keys = ('first_start', 'first_end',
-                'second_start', 'second_end')
-        for sub_id in self.cache:
-            for k in keys:
-                self.data[sub_id][k] = getattr(self.cache[sub_id], k)
+    def add_subpairs(self, sub_pairs):
+        """
+        Add downloaded SubPairs to the database and save their files.
+        The database is written once for all of them.
+        Args:
+            `sub_pairs` (list of `SubPair`)
+        Returns:
+            list of ids of added SubPairs (already known ones are skipped)
+        """
+        added = []
+        with self.lock:
+            for sub_pair in sub_pairs:
+                if not self.is_in_db(sub_pair):
+                    sub_pair.save_subs()
+                    self.add_subpair(sub_pair)
+                    added.append(sub_pair.get_id())
+            if added:
+                self.write_db(added)
+                self._index_pairs([x for x in sub_pairs if x.get_id() in added])
+        return added
+
+    def write_db(self, sub_ids=None, removed=()):
+        """
+        Save subtitles info data.
+        Only SubPairs with changed alignment are synced from the cache.
+        Args:
+            `sub_ids` (iterable of str): SubPairs to save
+                (all SubPairs with changed alignment if None)
+            `removed` (iterable of str): SubPairs to remove from the storage
+        """
+        if sub_ids is None:
+            sub_ids = [k for k, v in self.cache.items() if v.dirty]
+        else:
+            sub_ids = list(sub_ids)
 
-        with open(CACHE_DB, 'w') as f:
-            f.write(json.dumps(self.data))
+        # update db data with the alignment data from cache
+        for sub_id in sub_ids:
+            sub_pair = self.cache.get(sub_id)
+            if sub_pair is not None and sub_pair.dirty:
+                self.data[sub_id].update(sub_pair.get_alignment())
+                sub_pair.dirty = False
+
+        if removed:
+            self.storage.remove_many(removed)
+        if sub_ids:
+            self.storage.put_many({k: self.data[k] for k in sub_ids})
+            # new or realigned pairs
+            self.schedule_cue_tables(sub_ids)
+
+    def flush(self):
+        """Write the pending alignment changes."""
+        with self.lock:
+            if self._write_timer:
+                self._write_timer.cancel()
+                self._write_timer = None
+            if any(v.dirty for v in self.cache.values()):
+                self.write_db()
+
+    def _schedule_write(self):
+        """Write alignment changes after `write_delay` of inactivity."""
+        if self.write_delay <= 0:
+            self.flush()
+            return
+        if self._write_timer:
+            self._write_timer.cancel()
+        self._write_timer = threading.Timer(self.write_delay, self.flush)
+        self._write_timer.daemon = True
+        self._write_timer.start()
 
     def add_to_cache(self, sub_pair):
         sub_id = sub_pair.get_id()
         if sub_id not in self.cache:
-            self.cache[sub_id] = sub_pair
+            self.cache.put(sub_id, sub_pair)
+
+    def _on_evict(self, sub_id, sub_pair):
+        # don't lose the alignment which isn't written yet
+        if sub_pair.dirty and sub_id in self.data:
+            self.data[sub_id].update(sub_pair.get_alignment())
+            sub_pair.dirty = False
+            self.storage.put_many({sub_id: self.data[sub_id]})
 
     def read_subpair(self, sub_id):
-        if sub_id not in self.cache:
+        """Returns SubPair from the cache, it is read if it isn't cached."""
+        sub_pair = self.cache.get(sub_id)
+        if sub_pair is None:
             sub_info = self.data[sub_id]
             sub_pair = SubPair.read(sub_info)
             self.add_to_cache(sub_pair)
+        return sub_pair
 
     def get_subs(self, sub_id=None):
-        if self.data:
-            if not sub_id:  # get random sub
-                sub_id = random.choice(list(self.data.keys()))
+        with self.lock:
+            if self.data:
+                if not sub_id:  # get random sub
+                    sub_id = random.choice(list(self.data.keys()))
 
-            if sub_id not in self.cache:
-                self.read_subpair(sub_id)
-            position = random.randint(0, 100)
-            subs = self.cache[sub_id].get_parallel_subs(position, 20)
-            return sub_id, subs
+                sub_pair = self.read_subpair(sub_id)
+                position = random.randint(0, 100)
+                subs = sub_pair.get_card(position)
+                return sub_id, subs
 
     def get_subs_to_align(self, sub_id, count=4):
         """
@@ -510,40 +1883,258 @@ class SubDb():
             `subs` (tuple): tuple of 4 lists of `Subtitles`
                     ([`first_begin`], [`second_begin`], [`first_end`], [`second_end`])
         """
-        if self.data:
-            if sub_id not in self.cache:
-                self.read_subpair(sub_id)
-            subs = (self.cache[sub_id].subs[0].sub[:count],  # First sub, begin
-                    self.cache[sub_id].subs[1].sub[:count],  # Second sub, begin,
-                    self.cache[sub_id].subs[0].sub[-1-count:-1],  # First sub, end
-                    self.cache[sub_id].subs[1].sub[-1-count:-1],  # Second sub, end
-                    )
-            return subs
+        with self.lock:
+            if not self.data:
+                return None
+            sub_pair = self.cache.get(sub_id)
+            infos = self.data[sub_id]['subs']
+        if sub_pair is not None:
+            cues = [x.sub for x in sub_pair.subs]
+            heads = [x[:count] for x in cues]
+            tails = [x[-1-count:-1] for x in cues]
+        else:
+            # only the ends of the files are needed
+            heads = [Subs.read_slice(x, 0, count) for x in infos]
+            tails = [Subs.read_slice(x, -1-count, -1) for x in infos]
+        subs = (heads[0],  # First sub, begin
+                heads[1],  # Second sub, begin,
+                tails[0],  # First sub, end
+                tails[1],  # Second sub, end
+                )
+        return subs
 
     def delete(self, sub_id):
-        """Removes subtitles files."""
-        for s in self.data[sub_id]['subs']:
-            filename = os.path.join(FILES_DIR, s['SubFileName'])
-            try:
-                os.remove(filename)
-            except FileNotFoundError:
-                print('File {} is not found'.format(filename))
+        """
+        Removes SubPair and its subtitles files.
+        Returns:
+            `DeleteReport` object
+        """
+        return self.delete_many([sub_id])
 
-        del self.data[sub_id]
+    def delete_many(self, sub_ids, workers=DELETE_WORKERS):
+        """
+        Removes SubPairs and their subtitles files.
+        The files are removed concurrently, the database is written once.
+        A pair is kept in the database if any of its files can't be removed.
+        Args:
+            `sub_ids` (iterable of str): SubPair ids
+            `workers` (int): number of concurrent file removals
+        Returns:
+            `DeleteReport` object
+        """
+        report = DeleteReport()
+        with self.lock:
+            files = []
+            for sub_id in sub_ids:
+                if sub_id not in self.data:
+                    report.not_found.append(sub_id)
+                    continue
+                for s in self.data[sub_id]['subs']:
+                    filename = os.path.join(FILES_DIR, s['SubFileName'])
+                    files.append((sub_id, filename))
+                    files.append((sub_id, filename + CUES_CACHE_EXT))
+                    files.append((sub_id, filename + CUE_OFFSETS_EXT))
+                files.append((sub_id, os.path.join(FILES_DIR, sub_id + CUE_TABLE_EXT)))
+
+            failed = {}
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                results = executor.map(self._remove_file, [f for _, f in files])
+                for (sub_id, filename), error in zip(files, results):
+                    if error is None:
+                        continue
+                    if isinstance(error, FileNotFoundError):
+                        if not filename.endswith((CUES_CACHE_EXT, CUE_OFFSETS_EXT,
+                                                  CUE_TABLE_EXT)):
+                            report.missing_files.append((sub_id, filename))
+                    elif sub_id not in failed:
+                        failed[sub_id] = str(error)
+
+            for sub_id in dict.fromkeys(x for x, _ in files):
+                if sub_id in failed:
+                    report.failed.append((sub_id, failed[sub_id]))
+                    continue
+                del self.data[sub_id]
+                self.cache.pop(sub_id, None)
+                report.deleted.append(sub_id)
+
+            if report.deleted:
+                self.version += 1
+                self.write_db([], removed=report.deleted)
+                if self.index is not None:
+                    self.index.remove_many(report.deleted)
+
+        for sub_id, filename in report.missing_files:
+            logger.warning('File {} is not found'.format(filename))
+        for sub_id, reason in report.failed:
+            logger.warning("Can't delete {}: {}".format(sub_id, reason))
+        return report
 
+    @staticmethod
+    def _remove_file(filename):
         try:
-            del self.cache[sub_id]
-        except KeyError:
-            pass
-
-        self.write_db()
+            os.remove(filename)
+        except OSError as e:
+            return e
 
     def align_subs(self, sub_id, left_start, right_start, left_end, right_end):
-        if sub_id not in self.cache:
-            self.read_subpair(sub_id)
-        self.cache[sub_id].align_subs(left_start, right_start, left_end, right_end)
-        self.write_db()
-        return self.cache[sub_id]
+        with self.lock:
+            sub_pair = self.read_subpair(sub_id)
+            sub_pair.align_subs(left_start, right_start, left_end, right_end)
+            self.version += 1
+            self._schedule_write()
+            return sub_pair
+
+    def _index_pairs(self, sub_pairs):
+        if self.index is not None:
+            self.index.add_many((x.get_id(), [s.cue_texts() for s in x.subs])
+                                for x in sub_pairs)
+
+    def update_index(self):
+        """
+        Index SubPairs which aren't in the full-text index yet.
+        The pairs are read without holding the lock.
+        """
+        with self.lock:
+            missing = [(x, self.data[x]) for x in self.data if x not in self.index]
+        for n in range(0, len(missing), DOWNLOAD_CHUNK_SIZE):
+            texts = [(sub_id, [Subs.read(x).cue_texts() for x in info['subs']])
+                     for sub_id, info in missing[n:n+DOWNLOAD_CHUNK_SIZE]]
+            with self.lock:
+                self.index.add_many(x for x in texts if x[0] in self.data)
+        self._index_checked = True
+
+    def search(self, query, lang=None, limit=SEARCH_LIMIT):
+        """
+        Find cards with a word or a phrase.
+        At most `limit * SEARCH_CANDIDATES` cues found by the index are
+        checked, each SubPair is read once. The pairs aren't read under
+        the lock, so cards and downloads aren't blocked by a search.
+        Args:
+            `query` (str): word or phrase
+            `lang` (str): language of the cues to search (any if None)
+            `limit` (int): max number of cards
+        Returns:
+            list of (sub_id, subs) tuples, `subs` is a card
+                (see `SubPair.get_card`) around the found cue
+        """
+        phrase = ' {} '.format(' '.join(pairsubs_index.tokenize(query)))
+        if not self._index_checked:
+            self.update_index()
+        with self.lock:
+            hits = self.index.search(query, limit=limit * SEARCH_CANDIDATES)
+        found = collections.OrderedDict()
+        for sub_id, side, position in hits:
+            found.setdefault(sub_id, []).append((side, position))
+
+        cards = []
+        for sub_id, cues in found.items():
+            with self.lock:
+                info = self.data.get(sub_id)
+                sub_pair = self.cache.get(sub_id) if sub_id in self.cache else None
+            if info is None:
+                continue
+            if lang:
+                cues = [x for x in cues if info['subs'][x[0]]['SubLanguageID'] == lang]
+            if not cues:
+                continue
+            if sub_pair is None:
+                sub_pair = SubPair.read(info)
+                with self.lock:
+                    if sub_id in self.cache:
+                        sub_pair = self.cache.get(sub_id)
+                    elif sub_id in self.data:
+                        self.add_to_cache(sub_pair)
+            for side, position in cues:
+                subs = sub_pair.subs[side]
+                cue = subs.sub[subs.start_order[position]]
+                # all words are in the cue, check their order
+                text = ' {} '.format(' '.join(pairsubs_index.tokenize(cue.content)))
+                if phrase not in text:
+                    continue
+                cards.append((sub_id, sub_pair.get_card_at(side, position)))
+                if len(cards) >= limit:
+                    return cards
+        return cards
+
+    def build_cue_tables(self, sub_ids=None):
+        """
+        Build missing or stale cue alignment tables (offline pass, see
+        `SubPair.get_cue_table`), so cards are served without alignment.
+        Args:
+            `sub_ids` (iterable of str): SubPairs (all if None)
+        Returns:
+            number of processed SubPairs
+        """
+        with self.lock:
+            sub_ids = list(self.data if sub_ids is None else sub_ids)
+        for sub_id in sub_ids:
+            with self.lock:
+                sub_pair = self.cache.pairs.get(sub_id)
+                info = self.data.get(sub_id)
+            if sub_pair is None and info is not None:
+                # don't evict the pairs in use
+                sub_pair = SubPair.read(info)
+            if sub_pair is not None:
+                sub_pair.get_cue_table()
+        return len(sub_ids)
+
+    def schedule_cue_tables(self, sub_ids):
+        """
+        Build cue tables of SubPairs in the background thread.
+        New pairs are queued too: the table of the default alignment
+        (start and end anchors) serves their cards until they are aligned,
+        `pairsubs_align.align_cues` fixes the local offsets of the cues.
+        """
+        for sub_id in sub_ids:
+            self._table_queue.put(sub_id)
+        if self._table_thread is None:
+            self._table_thread = threading.Thread(target=self._build_tables, daemon=True)
+            self._table_thread.start()
+
+    def _build_tables(self):
+        while True:
+            sub_id = self._table_queue.get()
+            if sub_id is None:
+                return
+            try:
+                self.build_cue_tables([sub_id])
+            except Exception as e:
+                # a broken pair must not stop the builder
+                logger.warning("Can't build cue table of {}: {}".format(sub_id, e))
+            finally:
+                self._table_queue.task_done()
+
+    def add_anchor(self, sub_id, first_index, second_index):
+        """
+        Add an alignment anchor: the cues start at the same moment.
+        Args:
+            `sub_id` (str): SubPair id
+            `first_index` (int): cue index of the first subtitles (from 1)
+            `second_index` (int): cue index of the second subtitles (from 1)
+        Returns:
+            `SubPair` object
+        """
+        with self.lock:
+            sub_pair = self.read_subpair(sub_id)
+            sub_pair.add_anchor(
+                sub_pair.subs[0].sub[first_index-1].start.total_seconds(),
+                sub_pair.subs[1].sub[second_index-1].start.total_seconds())
+            self.version += 1
+            self._schedule_write()
+            return sub_pair
+
+    def auto_align(self, sub_id):
+        """
+        Align SubPair automatically (see `SubPair.auto_align`).
+        Returns:
+            share of matched cues
+        """
+        with self.lock:
+            sub_pair = self.read_subpair(sub_id)
+            score = sub_pair.auto_align()
+            self.version += 1
+            self._schedule_write()
+            return score
 
 
 if __name__ == '__main__':
@@ -551,11 +2142,13 @@ if __name__ == '__main__':
     logger.setLevel(logging.INFO)
 
     db = SubDb()
+    Opensubtitles.search_cache = pairsubs_storage.SearchCache(
+            SEARCH_CACHE_DB, SEARCH_CACHE_TTL, stale_ttl=SEARCH_CACHE_STALE_TTL)
     app = pairsubs_gui.App(db)
 
-    log_box = app.get_search_box()
-    loop = app.get_loop()
-    log_handler = logging.StreamHandler(pairsubs_gui.SubsLogStream(log_box, loop))
+    log_handler = logging.StreamHandler(app.get_log_stream())
     logger.addHandler(log_handler)
 
     app.run()
+    db.close()
+    Opensubtitles.search_cache.close()
@@ -0,0 +1,251 @@
+"""
+Automatic timing alignment of subtitles pairs.
+
+The timeline of the second subtitles is modelled as a linear function
+of the first one: `second = scale * first + offset`. The offset is
+found by voting: every pair of cue starts closer than `MAX_OFFSET`
+votes for its difference, so the offset shared by most cues wins
+(a histogram cross-correlation of the two start time series).
+Frame rate conversions and a drift estimated from offsets of short
+windows along the files are tried as scales, then the best model is
+refined by least squares over the matched cues.
+
+Functions work with sorted lists of cue start times (seconds).
+
+Once the timelines are aligned, `align_cues` pairs individual cues.
+"""
+import math
+from bisect import bisect_left, bisect_right
+
+#: Timeline scales of common frame rate conversions
+FRAME_RATE_SCALES = (1.0, 25/23.976, 23.976/25, 25/24, 24/25)
+
+# Max offset between the timelines (seconds)
+MAX_OFFSET = 120
+# Width of a vote bin (seconds)
+OFFSET_BIN = 0.25
+# Max number of cues of the first subtitles which vote
+MAX_VOTERS = 400
+# Max distance of matched cues (seconds)
+MATCH_TOLERANCE = 1.0
+# Number and size (cues) of windows used to estimate the drift
+DRIFT_WINDOWS = 16
+DRIFT_WINDOW_CUES = 15
+# Number of least squares refinements
+REFINE_STEPS = 3
+
+#: Cue alignment beads: (first cues, second cues)
+BEADS = ((1, 1), (1, 0), (0, 1), (2, 1), (1, 2))
+# Cost of an unmatched cue
+SKIP_COST = 3.0
+# Extra cost of 2:1 and 1:2 matches
+MERGE_COST = 1.0
+# Time difference (seconds) which costs as much as a skip / SKIP_COST
+TIME_SCALE = 1.0
+# Half width of the cue alignment band (cues)
+ALIGN_BAND = 20
+
+
+def vote_offset(first, second, scale=1.0, max_offset=MAX_OFFSET,
+                bin_size=OFFSET_BIN):
+    """
+    Estimate offset of `second` timeline relative to scaled `first` one.
+    Args:
+        `first` (list of float): sorted start times of the first subtitles
+        `second` (list of float): sorted start times of the second subtitles
+        `scale` (float): timeline scale
+        `max_offset` (float): max absolute offset (seconds)
+        `bin_size` (float): offset resolution (seconds)
+    Returns:
+        (offset, votes) tuple: offset (seconds) and number of cues voted for it
+    """
+    step = max(1, len(first) // MAX_VOTERS)
+    votes = {}
+    for t in first[::step]:
+        x = scale * t
+        lo = bisect_left(second, x - max_offset)
+        hi = bisect_right(second, x + max_offset)
+        for s in second[lo:hi]:
+            k = round((s - x) / bin_size)
+            votes[k] = votes.get(k, 0) + 1
+    if not votes:
+        return 0.0, 0
+    # a peak may be split between two neighbour bins
+    best = max(votes, key=lambda k: (votes[k] + votes.get(k-1, 0) + votes.get(k+1, 0),
+                                     votes[k]))
+    count = votes[best] + votes.get(best-1, 0) + votes.get(best+1, 0)
+    return best * bin_size, count
+
+
+def match_cues(first, second, scale, offset, tolerance=MATCH_TOLERANCE):
+    """
+    Match cues of `first` to the nearest cues of `second` under the model.
+    Returns:
+        list of (first time, second time) tuples
+    """
+    pairs = []
+    for t in first:
+        x = scale * t + offset
+        i = bisect_left(second, x)
+        near = [s for s in second[max(0, i-1):i+1] if abs(s - x) <= tolerance]
+        if near:
+            pairs.append((t, min(near, key=lambda s: abs(s - x))))
+    return pairs
+
+
+def fit_line(pairs):
+    """Least squares fit of `y = scale * x + offset`. Returns (scale, offset)."""
+    n = len(pairs)
+    mx = sum(x for x, _ in pairs) / n
+    my = sum(y for _, y in pairs) / n
+    sxx = sum((x - mx) ** 2 for x, _ in pairs)
+    if not sxx:
+        return 1.0, my - mx
+    scale = sum((x - mx) * (y - my) for x, y in pairs) / sxx
+    return scale, my - scale * mx
+
+
+def _drift_scale(first, second, windows=DRIFT_WINDOWS, size=DRIFT_WINDOW_CUES):
+    """
+    Scale estimated from offsets of short windows along the first timeline.
+    Offsets of some windows may be wrong, so the line through two
+    windows which agrees with most of the others is taken.
+    """
+    if len(first) < windows * size:
+        windows = len(first) // size
+    if windows < 3:
+        return None
+    points = []
+    for w in range(windows):
+        i = (len(first) - size) * w // (windows - 1)
+        window = first[i:i+size]
+        offset, _ = vote_offset(window, second)
+        points.append((sum(window) / size, offset))
+
+    best = []
+    for n, (t1, o1) in enumerate(points):
+        for t2, o2 in points[n+1:]:
+            if t2 <= t1:
+                continue
+            slope = (o2 - o1) / (t2 - t1)
+            inliers = [(t, o) for t, o in points
+                       if abs(o1 + slope * (t - t1) - o) <= MATCH_TOLERANCE]
+            if len(inliers) > len(best):
+                best = inliers
+    if len(best) < 3:
+        return None
+    scale = 1 + fit_line(best)[0]
+    return scale if 0.5 < scale < 2 else None
+
+
+def estimate(first, second):
+    """
+    Estimate the linear map from the `first` timeline to the `second` one.
+    Args:
+        `first` (list of float): sorted start times of the first subtitles
+        `second` (list of float): sorted start times of the second subtitles
+    Returns:
+        (scale, offset, score) tuple, `score` is the share of the first
+        cues which have a matching cue in the second subtitles
+    """
+    if not first or not second:
+        return 1.0, 0.0, 0.0
+    scales = list(FRAME_RATE_SCALES)
+    drift_scale = _drift_scale(first, second)
+    if drift_scale:
+        scales.append(drift_scale)
+
+    best = None
+    for scale in scales:
+        offset, votes = vote_offset(first, second, scale)
+        if best is None or votes > best[2]:
+            best = (scale, offset, votes)
+    scale, offset = best[:2]
+
+    pairs = []
+    for _ in range(REFINE_STEPS):
+        pairs = match_cues(first, second, scale, offset)
+        if len(pairs) < 2:
+            break
+        scale, offset = fit_line(pairs)
+    return scale, offset, len(pairs) / len(first)
+
+
+def _bead_cost(first, second, i0, i1, j0, j1, ratio):
+    """Cost of matching cues `first[i0:i1]` with `second[j0:j1]`."""
+    if i0 == i1 or j0 == j1:
+        return SKIP_COST
+    time_cost = (abs(first[i0][0] - second[j0][0]) +
+                 abs(first[i1-1][1] - second[j1-1][1])) / TIME_SCALE
+    l1 = sum(x[2] for x in first[i0:i1])
+    l2 = sum(x[2] for x in second[j0:j1])
+    length_cost = abs(math.log((l2 + 1) / (l1 * ratio + 1)))
+    merge_cost = 0 if i1 - i0 == j1 - j0 == 1 else MERGE_COST
+    return time_cost + length_cost + merge_cost
+
+
+def align_cues(first, second, band=ALIGN_BAND):
+    """
+    Pair cues of two subtitles (sentence alignment in the style of
+    Gale and Church). A dynamic program over both cue sequences finds
+    the cheapest sequence of beads: 1:1, 1:2 and 2:1 matches and
+    unmatched cues (1:0, 0:1). The cost of a match grows with the
+    difference of its start and end times and with the deviation of
+    its text length ratio from the ratio of the whole subtitles.
+    Only cells within `band` cues of the time diagonal are computed.
+    Args:
+        `first` (list of (start, end, length)): cues of the first subtitles
+            sorted by start, times are mapped to the second timeline
+        `second` (list of (start, end, length)): cues of the second
+            subtitles sorted by start
+        `band` (int): half width of the computed band (cues)
+    Returns:
+        list of beads (i0, i1, j0, j1): `first[i0:i1]` is paired with
+        `second[j0:j1]`
+    """
+    n, m = len(first), len(second)
+    total1 = sum(x[2] for x in first)
+    total2 = sum(x[2] for x in second)
+    ratio = total2 / total1 if total1 else 1.0
+    starts = [x[0] for x in second]
+
+    # rows[i] = (lo, costs, backs) for j in lo..lo+len(costs)-1
+    rows = []
+    prev_lo, prev_hi = 0, 0
+    for i in range(n + 1):
+        centre = bisect_left(starts, first[i-1][0]) if i else 0
+        lo = max(0, min(centre - band, prev_hi))
+        hi = min(m, max(centre + band, prev_lo))
+        if i == n:
+            hi = m
+        costs = []
+        backs = []
+        for j in range(lo, hi + 1):
+            best, back = (0.0, None) if i == j == 0 else (math.inf, None)
+            for a, b in BEADS:
+                pi, pj = i - a, j - b
+                if pi < 0 or pj < 0:
+                    continue
+                plo, pcosts, _ = rows[pi] if a else (lo, costs, None)
+                if not plo <= pj < plo + len(pcosts):
+                    continue
+                c = pcosts[pj - plo]
+                if c == math.inf:
+                    continue
+                c += _bead_cost(first, second, pi, i, pj, j, ratio)
+                if c < best:
+                    best, back = c, (a, b)
+            costs.append(best)
+            backs.append(back)
+        rows.append((lo, costs, backs))
+        prev_lo, prev_hi = lo, hi
+
+    beads = []
+    i, j = n, m
+    while i or j:
+        lo, _, backs = rows[i]
+        a, b = backs[j - lo]
+        beads.append((i - a, i, j - b, j))
+        i, j = i - a, j - b
+    beads.reverse()
+    return beads
@@ -0,0 +1,141 @@
+"""Asyncio API of the Opensubtitles.org client."""
+import asyncio
+import re
+
+import pairsubs
+from pairsubs import Opensubtitles, OpensubtitlesError, TokenBucket, backoff_delay
+
+import logging
+from logging import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+
+class AsyncOpensubtitles:
+    """
+    Asyncio client of opensubtitles.org.
+
+    The XML-RPC calls of the wrapped `pairsubs.Opensubtitles` run in
+    the loop's thread pool executor, so the event loop is never blocked.
+    Failed calls are retried with exponential backoff and jitter.
+    The number of calls in flight is limited by a semaphore and their
+    rate by a token bucket, both shared by all calls of the client.
+    Args:
+        `osub` (`pairsubs.Opensubtitles`): sync client (session, search
+            cache, connection pool) to wrap; a new one if None
+        `max_in_flight` (int): max number of concurrent API calls
+        `rate` (float): max API calls per second
+        `burst` (int): max burst of API calls
+        `executor` (`concurrent.futures.Executor`): executor for the calls
+            (the loop's default executor if None)
+    """
+
+    def __init__(self, osub=None, max_in_flight=4, rate=4.0, burst=4,
+                 executor=None):
+        self.osub = osub or Opensubtitles()
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.rate_limiter = TokenBucket(rate, burst)
+        self.executor = executor
+        self._login_lock = asyncio.Lock()
+        self._refresh_tasks = set()
+
+    async def _call(self, func, *args):
+        """
+        Call a single attempt API method `func(*args)` of `osub`
+        with retries.
+        """
+        loop = asyncio.get_event_loop()
+        for i in range(pairsubs.MAX_RETRY):
+            await self.rate_limiter.acquire_async()
+            async with self.semaphore:
+                try:
+                    return await loop.run_in_executor(self.executor, func, *args)
+                except pairsubs.RETRY_EXCEPTIONS as e:
+                    logger.info("Retry #{} ({})".format(i+1, e))
+            await asyncio.sleep(backoff_delay(i))
+        raise OpensubtitlesError
+
+    async def login(self):
+        """Login into api.opensubtitles.org."""
+        async with self._login_lock:
+            await self._call(self.osub.login_once)
+
+    async def _ensure_login(self):
+        if not self.osub.token:
+            async with self._login_lock:
+                if not self.osub.token:
+                    await self._call(self.osub.login_once)
+
+    async def logout(self):
+        """
+        Logout from api.opensubtitles.org and forget the session
+        (see `pairsubs.Opensubtitles.logout`).
+        """
+        await self.wait_refresh()
+        loop = asyncio.get_event_loop()
+        await loop.run_in_executor(self.executor, self.osub.logout)
+
+    async def search_sub(self, imdbid, lang):
+        """
+        Search the subtitles by IMBD id and a language
+        (see `pairsubs.Opensubtitles.search_sub`).
+        """
+        m = re.search(r'\d+', imdbid)
+        if m:
+            imdb = m[0]
+            # the cache is an SQLite database
+            loop = asyncio.get_event_loop()
+            cached = await loop.run_in_executor(
+                    self.executor, self.osub.from_cache, imdb, lang)
+            if cached:
+                data, fresh = cached
+                if not fresh:
+                    task = asyncio.ensure_future(self._search(imdb, lang))
+                    self._refresh_tasks.add(task)
+                    task.add_done_callback(self._on_refresh_done)
+                return self.osub.select_sub(data)
+            return self.osub.select_sub(await self._search(imdb, lang))
+
+    async def _search(self, imdb, lang):
+        await self._ensure_login()
+        return await self._call(self.osub.search_once, imdb, lang)
+
+    def _on_refresh_done(self, task):
+        self._refresh_tasks.discard(task)
+        if not task.cancelled() and task.exception():
+            logger.info("Search refresh failed: {}".format(task.exception()))
+
+    async def wait_refresh(self):
+        """Wait for the background search refreshes."""
+        if self._refresh_tasks:
+            await asyncio.gather(*self._refresh_tasks, return_exceptions=True)
+
+    async def download_sub(self, sub):
+        """Download subtitles (see `pairsubs.Opensubtitles.download_sub`)."""
+        return (await self.download_subs([sub]))[0]
+
+    async def download_subs(self, subs, chunk_size=pairsubs.DOWNLOAD_CHUNK_SIZE):
+        """
+        Download many subtitles, chunks are downloaded concurrently
+        (see `pairsubs.Opensubtitles.download_subs`).
+        """
+        ids = []
+        for sub in subs:
+            if sub['IDSubtitleFile'] not in ids:
+                ids.append(sub['IDSubtitleFile'])
+        chunks = [ids[i:i+chunk_size] for i in range(0, len(ids), chunk_size)]
+
+        await self._ensure_login()
+        encoded = {}
+        for res in await asyncio.gather(*[
+                self._call(self.osub.download_chunk_once, chunk)
+                for chunk in chunks]):
+            encoded.update(res)
+
+        loop = asyncio.get_event_loop()
+        ids = list(encoded)
+        decoded = dict(zip(ids, await asyncio.gather(*[
+            loop.run_in_executor(self.executor, Opensubtitles.decode_sub, encoded[x])
+            for x in ids])))
+        return [decoded.get(str(sub['IDSubtitleFile'])) for sub in subs]
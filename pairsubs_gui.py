@@ -1,30 +1,210 @@
 import urwid
+import collections
 import io
+import os
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic
 
 SUBS_CNT_FOR_ALIGN = 12
 
+# Max number of messages in the log box and its max redraw rate
+LOG_MAX_LINES = 200
+LOG_FPS = 10
+
+# Number of practice cards prepared ahead
+PREFETCH_DEPTH = 2
+
+# Number of cached rows of the subtitles list
+WIDGET_CACHE_SIZE = 256
+
+# Max wait for the running download on exit (seconds)
+STOP_TIMEOUT = 5
+
 
 class SubsLogStream(io.StringIO):
     """Stream for logging into a Text box.
+        The last `max_lines` messages are kept in a ring buffer.
+        Messages may be written from any thread, the box is updated
+        by the main loop not more than `fps` times per second.
         Attributes:
             `box` (`urwid.Text`): text widget to print into
             `loop` (`urwid.MainLoop`): main loop to redraw
         """
-    def __init__(self, box, loop):
+    def __init__(self, box, loop, max_lines=LOG_MAX_LINES, fps=LOG_FPS):
         self.box = box
         self.loop = loop
+        self.lines = collections.deque(maxlen=max_lines)
+        self.interval = 1 / fps
+        self.last_draw = 0
+        self.pending = False
+        self.stopped = False
+        self.lock = threading.Lock()
+        self.pipe = loop.watch_pipe(self._on_pipe)
 
     def write(self, message):
         """Writes message into Text box."""
-        self.box.set_text(self.box.text+message)
-        self.loop.draw_screen()
+        self.lines.append(message)
+        with self.lock:
+            if self.pending or self.stopped:
+                return
+            self.pending = True
+            # wake up the main loop
+            os.write(self.pipe, b'.')
+
+    def stop(self):
+        """
+        Stop waking up the main loop (after it has exited), later
+        messages are only kept in the buffer.
+        """
+        with self.lock:
+            if self.stopped:
+                return
+            self.stopped = True
+            self.loop.remove_watch_pipe(self.pipe)
+            os.close(self.pipe)
+
+    def clear(self):
+        self.lines.clear()
+        self.box.set_text('')
+
+    def _on_pipe(self, data):
+        delay = max(0, self.last_draw + self.interval - monotonic())
+        self.loop.set_alarm_in(delay, self._flush)
+        return True
+
+    def _flush(self, loop=None, user_data=None):
+        with self.lock:
+            self.pending = False
+        self.last_draw = monotonic()
+        # The screen is redrawn by the main loop after the alarm
+        self.box.set_text(''.join(self.lines))
+
+
+class DownloadWorker:
+    """Background worker downloading subtitles.
+        Downloads are queued and run one by one, so the UI
+        isn't blocked.
+        Attributes:
+            `db` (`pairsubs.SubDb`): subtitles database
+            `out` (`SubsLogStream`): thread-safe stream for progress messages
+        """
+    def __init__(self, db, out):
+        self.db = db
+        self.out = out
+        self.queue = queue.Queue()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def submit(self, url, lang1, lang2):
+        """Queue the download."""
+        self.queue.put((url, lang1, lang2))
+        self.out.write('Queued: {} ({}, {})\n'.format(url, lang1, lang2))
+
+    def pending(self):
+        return self.queue.qsize()
+
+    def stop(self, timeout=STOP_TIMEOUT):
+        """
+        Stop the worker: the queued downloads are dropped, the running
+        one is waited for `timeout` seconds at most (the thread is a
+        daemon one, so it doesn't keep the process alive).
+        Returns:
+            number of dropped downloads
+        """
+        self.stopped.set()
+        dropped = 0
+        while True:
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                break
+            self.queue.task_done()
+            dropped += 1
+        self.queue.put(None)
+        self.thread.join(timeout)
+        return dropped
+
+    def _run(self):
+        while True:
+            job = self.queue.get()
+            try:
+                if job is None or self.stopped.is_set():
+                    break
+                try:
+                    sub_id = self.db.download(*job)
+                except Exception as e:
+                    self.out.write('Failed: {} ({})\n'.format(job[0], e))
+                else:
+                    status = 'Done' if sub_id else 'Not found'
+                    self.out.write('{}: {} ({}, {})\n'.format(status, *job))
+            finally:
+                self.queue.task_done()
+
+
+class CardPrefetcher:
+    """Prepares next practice cards in a background thread.
+        A card is the result of `SubDb.get_subs`: the SubPair is read
+        and sliced while the user is reading the current card.
+        Cards prepared before a realignment or a deletion
+        (`SubDb.version` change) are dropped.
+        Attributes:
+            `db` (`pairsubs.SubDb`): subtitles database
+            `depth` (int): number of cards prepared ahead
+        """
+    def __init__(self, db, depth=PREFETCH_DEPTH):
+        self.db = db
+        self.depth = depth
+        self.sub_id = None
+        self.version = None
+        self.cards = collections.deque()
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+    def get(self, sub_id=None):
+        """
+        Returns next card of the SubPair `sub_id` (of random SubPairs if None)
+        and starts preparing the following ones.
+        Returns:
+            (sub_id, subs) tuple (see `SubDb.get_subs`)
+        """
+        if sub_id != self.sub_id or self.version != self.db.version:
+            self.discard()
+            self.sub_id = sub_id
+            self.version = self.db.version
+        card = None
+        while card is None and self.cards:
+            try:
+                card = self.cards.popleft().result()
+            except Exception:
+                card = None
+            # the SubPair could be deleted while the card was prepared
+            if card and self.db.info(card[0]) is None:
+                card = None
+        if card is None:
+            card = self.db.get_subs(sub_id)
+        while len(self.cards) < self.depth:
+            self.cards.append(self.executor.submit(self.db.get_subs, sub_id))
+        return card
+
+    def discard(self):
+        """Drop the prepared cards."""
+        for f in self.cards:
+            f.cancel()
+        self.cards.clear()
+
+    def stop(self):
+        self.discard()
+        self.executor.shutdown()
 
 
 class AppBox(urwid.Frame):
     """Frame to show subtitles text."""
-    def __init__(self, db, sub_id=None):
+    def __init__(self, db, sub_id=None, prefetcher=None):
         # import ipdb; ipdb.set_trace()
         self.db = db
+        self.prefetcher = prefetcher
         self.sub_id = sub_id
         self.random = False if sub_id else True
         self.state = 'show'
@@ -45,15 +225,19 @@ class AppBox(urwid.Frame):
 
     def get_subs(self):
         sub_id = None if self.random else self.sub_id
-        self.sub_id, self.subs = self.db.get_subs(sub_id)
+        if self.prefetcher:
+            self.sub_id, self.subs = self.prefetcher.get(sub_id)
+        else:
+            self.sub_id, self.subs = self.db.get_subs(sub_id)
         if self.subs:
             text = '\n'.join([s.content for s in self.subs[0]])
             self.left_text.set_text(text)
             self.right_text.set_text('')
+            subs = self.db.info(self.sub_id)['subs']
             sub_title = '{} ({}, {})'.format(
-                    self.db.data[self.sub_id]['subs'][0]['MovieName'],
-                    self.db.data[self.sub_id]['subs'][0]['SubLanguageID'],
-                    self.db.data[self.sub_id]['subs'][1]['SubLanguageID']
+                    subs[0]['MovieName'],
+                    subs[0]['SubLanguageID'],
+                    subs[1]['SubLanguageID']
                     )
             self.title.set_text(sub_title)
 
@@ -76,6 +260,8 @@ class SearchBox(urwid.Frame):
     """Frame to search subtitles."""
     def __init__(self, db):
         self.db = db
+        self.worker = None
+        self.log_stream = None
         self.url = urwid.Edit('URL:  ')
         self.lang1 = urwid.Edit('Lang #1:  ')
         self.lang2 = urwid.Edit('Lang #2:  ')
@@ -98,32 +284,155 @@ class SearchBox(urwid.Frame):
         elif key == 'up' and self.focus_position == 'footer':
             self.set_focus_path(['body', 2])
         elif key == 'enter' and self.focus_position == 'footer':
-            self.log.set_text('')
             url = self.url.get_edit_text()
             lang1 = self.lang1.get_edit_text()
             lang2 = self.lang2.get_edit_text()
             if url and lang1 and lang2:
-                self.db.download(url, lang1, lang2)
+                self.worker.submit(url, lang1, lang2)
         else:
             return self.focus.keypress(size, key)
 
+    def clear_log(self):
+        if self.log_stream:
+            self.log_stream.clear()
+        else:
+            self.log.set_text('')
+
     def get_sub_id(self):
         return None
 
 
+class SubsListWalker(urwid.ListWalker):
+    """
+    List walker of SubPairs which creates check boxes on demand.
+        Only the ids of the pairs are kept in order, the widgets are created
+        for the rows shown by `urwid.ListBox` and a few of them are cached.
+        Checked state is kept by id, so it survives widget re-creation.
+        Removed rows are left as gaps (None) which are skipped, the list is
+        compacted when most of it is gaps, so a removal costs O(1).
+        Attributes:
+            `ids` (list of str): SubPair ids by position (None for removed rows)
+            `rows` (dict of {str: int}): positions by SubPair id
+            `checked` (set of str): ids of checked pairs
+            `focus` (int): position in focus
+    """
+    def __init__(self, ids, sub_format, cache_size=WIDGET_CACHE_SIZE):
+        self.ids = list(ids)
+        self.rows = {x: i for i, x in enumerate(self.ids)}
+        self.sub_format = sub_format
+        self.checked = set()
+        self.focus = 0
+        self.cache_size = cache_size
+        self.widgets = collections.OrderedDict()
+
+    def __len__(self):
+        return len(self.rows)
+
+    def __getitem__(self, position):
+        if not 0 <= position < len(self.ids) or self.ids[position] is None:
+            raise IndexError(position)
+        sub_id = self.ids[position]
+        widget = self.widgets.get(sub_id)
+        if widget is None:
+            widget = urwid.CheckBox(self.sub_format(sub_id), sub_id in self.checked,
+                                    on_state_change=self._on_state_change,
+                                    user_data=sub_id)
+            self.widgets[sub_id] = widget
+            if len(self.widgets) > self.cache_size:
+                self.widgets.popitem(last=False)
+        else:
+            self.widgets.move_to_end(sub_id)
+        return widget
+
+    def _on_state_change(self, widget, state, sub_id):
+        if state:
+            self.checked.add(sub_id)
+        else:
+            self.checked.discard(sub_id)
+
+    def next_position(self, position):
+        position += 1
+        while position < len(self.ids) and self.ids[position] is None:
+            position += 1
+        if position >= len(self.ids):
+            raise IndexError(position)
+        return position
+
+    def prev_position(self, position):
+        position -= 1
+        while position >= 0 and self.ids[position] is None:
+            position -= 1
+        if position < 0:
+            raise IndexError(position)
+        return position
+
+    def positions(self, reverse=False):
+        order = range(len(self.ids) - 1, -1, -1) if reverse else range(len(self.ids))
+        return (x for x in order if self.ids[x] is not None)
+
+    def first_position(self):
+        """Returns the first position (None if the list is empty)."""
+        return next(self.positions(), None)
+
+    def last_position(self):
+        """Returns the last position (None if the list is empty)."""
+        return next(self.positions(reverse=True), None)
+
+    def set_focus(self, position):
+        self.focus = position
+        self._modified()
+
+    def get_checked(self):
+        """Returns checked ids in the list order."""
+        return sorted(self.checked, key=self.rows.__getitem__)
+
+    def remove(self, sub_ids):
+        """
+        Remove pairs from the list.
+        Args:
+            `sub_ids` (iterable of str): ids of SubPairs to remove
+        """
+        removed = False
+        for sub_id in sub_ids:
+            position = self.rows.pop(sub_id, None)
+            if position is None:
+                continue
+            self.ids[position] = None
+            self.checked.discard(sub_id)
+            self.widgets.pop(sub_id, None)
+            removed = True
+        if not removed:
+            return
+        if 0 <= self.focus < len(self.ids) and self.ids[self.focus] is None:
+            # the next row takes the focus, the previous one at the end
+            try:
+                self.focus = self.next_position(self.focus)
+            except IndexError:
+                self.focus = self.last_position() or 0
+        if len(self.rows) * 2 < len(self.ids):
+            self._compact()
+        self._modified()
+
+    def _compact(self):
+        focus_id = self.ids[self.focus] if self.focus < len(self.ids) else None
+        self.ids = [x for x in self.ids if x is not None]
+        self.rows = {x: i for i, x in enumerate(self.ids)}
+        self.focus = self.rows.get(focus_id, 0)
+
+
 class SubsListBox(urwid.Frame):
     """Frame to show a list of subtitles."""
     def __init__(self, db, top_frame):
         self.db = db
         self.top_frame = top_frame
-        self.subs_list = list(self.db.data.items())
-        s = [urwid.CheckBox(self.sub_format(x[1])) for x in self.subs_list]
-        self.subs = urwid.ListBox(urwid.SimpleFocusListWalker(s))
+        self.walker = SubsListWalker(self.db.ids(), self.sub_format)
+        self.subs = urwid.ListBox(self.walker)
         self.app_box = urwid.LineBox(self.subs)
         self.app_but = urwid.Padding(urwid.Button('Delete'), 'center', 10)
         super().__init__(self.app_box, footer=self.app_but, focus_part='footer')
 
-    def sub_format(self, sub):
+    def sub_format(self, sub_id):
+        sub = self.db.info(sub_id)
         return '{} ({}, {})'.format(
                 sub['subs'][0]['MovieName'],
                 sub['subs'][0]['SubLanguageID'],
@@ -131,27 +440,26 @@ class SubsListBox(urwid.Frame):
                 )
 
     def keypress(self, size, key):
-        if key == 'down' and self.get_focus_path() == ['body', len(self.subs.body)-1]:
+        if key == 'down' and self.get_focus_path() == ['body', self.walker.last_position()]:
             self.focus_position = 'footer'
-        elif key == 'up' and self.focus_position == 'footer' and self.subs.body:
-            self.set_focus_path(['body', 0])
+        elif key == 'up' and self.focus_position == 'footer' and len(self.walker):
+            self.set_focus_path(['body', self.walker.first_position()])
         elif key == 'enter' and self.focus_position == 'footer':
-            self.delete_subs()
-            self.__init__(self.db, self.top_frame)
-            self.focus_position = 'body'
-            self.focus_position = 'footer'
+            self.walker.remove(self.delete_subs())
         elif key == 'enter' and self.focus_position == 'body':
             idx = self.get_focus_path()[1]  # ['body', 0]
-            sub_id = self.subs_list[idx][0]
+            sub_id = self.walker.ids[idx]
             self.top_frame.set_show_mode(None, sub_id)
         else:
             return self.focus.keypress(size, key)
 
     def delete_subs(self):
-        # import ipdb; ipdb.set_trace()
-        for i, e in enumerate(self.subs.body):
-            if e.get_state():
-                self.db.delete(self.subs_list[i][0])
+        """
+        Delete checked SubPairs.
+        Returns:
+            list of deleted ids
+        """
+        return self.db.delete_many(self.walker.get_checked()).deleted
 
     def get_sub_id(self):
         return None
@@ -208,6 +516,9 @@ class SubsAlignBox(urwid.Frame):
                                self.subs[2][self._find_rbutton(self.left_bot)].index,
                                self.subs[3][self._find_rbutton(self.right_bot)].index)
             self.top_frame.set_show_mode(None, self.subs_id)
+        elif key == 'a':
+            self.db.auto_align(self.subs_id)
+            self.top_frame.set_show_mode(None, self.subs_id)
         else:
             return self.focus.keypress(size, key)
 
@@ -236,10 +547,11 @@ class CtrlButtons(urwid.Columns):
 
 class TopFrame(urwid.Frame):
     """Top application frame."""
-    def __init__(self, db, *args, **kwargs):
+    def __init__(self, db, *args, prefetcher=None, **kwargs):
         super().__init__(*args, **kwargs)
 
         self.db = db
+        self.prefetcher = prefetcher
         self.search_box = SearchBox(self.db)
         # self.app_box = AppBox()
 
@@ -258,11 +570,11 @@ class TopFrame(urwid.Frame):
 
     def set_search_mode(self, button):
         body = self.search_box
-        body.log.set_text('')
+        body.clear_log()
         self.contents['body'] = (body, body.options())
 
     def set_show_mode(self, button, sub_id=None):
-        body = AppBox(self.db, sub_id)
+        body = AppBox(self.db, sub_id, self.prefetcher)
         self.contents['body'] = (body, body.options())
         self.focus_position = 'body'
 
@@ -279,10 +591,17 @@ class TopFrame(urwid.Frame):
 
 class App:
     """Main application."""
-    def __init__(self, db):
+    def __init__(self, db, prefetch_depth=PREFETCH_DEPTH):
         self.db = db
-        self.top = TopFrame(self.db, AppBox(self.db), footer=CtrlButtons(), focus_part='footer')
+        self.prefetcher = CardPrefetcher(self.db, prefetch_depth)
+        self.top = TopFrame(self.db, AppBox(self.db, prefetcher=self.prefetcher),
+                            footer=CtrlButtons(), focus_part='footer',
+                            prefetcher=self.prefetcher)
         self.loop = urwid.MainLoop(self.top)
+        self.log_stream = SubsLogStream(self.get_search_box(), self.loop)
+        self.worker = DownloadWorker(self.db, self.log_stream)
+        self.top.search_box.worker = self.worker
+        self.top.search_box.log_stream = self.log_stream
 
     def get_search_box(self):
         return self.top.search_box.log
@@ -290,8 +609,15 @@ class App:
     def get_loop(self):
         return self.loop
 
+    def get_log_stream(self):
+        return self.log_stream
+
     def run(self):
         self.loop.run()
+        # nobody reads the log pipe any more
+        self.log_stream.stop()
+        self.worker.stop()
+        self.prefetcher.stop()
 
 
 
@@ -0,0 +1,212 @@
+"""
+Bulk import of subtitles pairs.
+
+Usage:
+    python pairsubs_import.py [options] FILE
+
+FILE contains one job per line: IMDB id (or URL) and two languages,
+e.g. `tt0111161 eng rus`. The languages may be omitted if `--langs`
+is given. Empty lines and lines starting with '#' are ignored.
+"""
+import argparse
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from timeit import default_timer as timer
+
+import pairsubs
+from pairsubs import Opensubtitles, OpensubtitlesError, SubDb, SubPair, TokenBucket
+from pairsubs_storage import SearchCache
+
+import logging
+from logging import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+#: Import job: IMDB id (or URL) and two languages
+ImportJob = namedtuple('ImportJob', ('imdbid', 'lang1', 'lang2'))
+
+
+class ImportReport:
+    """
+    Result of the bulk import.
+    Attributes:
+        `added` (list of str): ids of added SubPairs
+        `skipped` (list of `ImportJob`): jobs whose pairs were already in db
+        `failed` (list of (`ImportJob`, str)): failed jobs and reasons
+        `searched` (int): number of processed jobs
+        `elapsed` (float): import duration (seconds)
+        `commits` (int): number of database writes
+    """
+    def __init__(self):
+        self.searched = 0
+        self.added = []
+        self.skipped = []
+        self.failed = []
+        self.elapsed = 0
+        self.commits = 0
+
+    def __str__(self):
+        done = self.searched
+        rate = done / self.elapsed if self.elapsed else 0
+        return ('Jobs: {}, added: {}, skipped: {}, failed: {}\n'
+                'Elapsed: {:.1f} s, throughput: {:.2f} jobs/s, '
+                'database writes: {}'.format(
+                    done, len(self.added), len(self.skipped), len(self.failed),
+                    self.elapsed, rate, self.commits))
+
+
+def parse_jobs(lines, langs=None):
+    """
+    Parse import jobs.
+    Args:
+        `lines` (iterable of str): job lines
+        `langs` (tuple of str): default languages
+    Returns:
+        list of `ImportJob`
+    """
+    jobs = []
+    for n, line in enumerate(lines, 1):
+        fields = line.split('#', 1)[0].split()
+        if not fields:
+            continue
+        if len(fields) == 1 and langs:
+            fields += list(langs)
+        if len(fields) != 3:
+            raise ValueError('Line {}: expected IMDB id and two languages'.format(n))
+        jobs.append(ImportJob(*fields))
+    return jobs
+
+
+def _retrying(retries, func, *args):
+    for i in range(retries + 1):
+        try:
+            return func(*args)
+        except (OpensubtitlesError, OSError) as e:
+            logger.info("Import failed ({}), retry #{}".format(e, i+1))
+            if i == retries:
+                raise
+            sleep(pairsubs.RETRY_DELAY)
+
+
+def bulk_import(db, jobs, workers=4, rate=4.0, retries=2, batch_size=20,
+                osub=None):
+    """
+    Download subtitles pairs for `jobs` with one shared Opensubtitles
+    session and add them into the database.
+    Jobs are processed in batches of `batch_size`: the subtitles are
+    searched in parallel, downloaded with as few API calls as possible,
+    parsed and written into the database at once.
+    Args:
+        `db` (`SubDb`): subtitles database
+        `jobs` (list of `ImportJob`)
+        `workers` (int): number of concurrent API calls
+        `rate` (float): max Opensubtitles API calls per second
+        `retries` (int): number of retries of a failed API call
+        `batch_size` (int): number of jobs per database write
+        `osub` (`Opensubtitles`): session to use (a new session is opened
+            and closed if None)
+    Returns:
+        `ImportReport` object
+    """
+    report = ImportReport()
+    start = timer()
+    own_session = osub is None
+    if own_session:
+        osub = Opensubtitles()
+    # the import rate is used only during the import
+    rate_limiter = osub.rate_limiter
+    osub.rate_limiter = TokenBucket(rate, capacity=workers)
+
+    try:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for n in range(0, len(jobs), batch_size):
+                batch = jobs[n:n+batch_size]
+                futures = [executor.submit(_retrying, retries, SubPair.search,
+                                           osub, *job) for job in batch]
+                found = []
+                for job, f in zip(batch, futures):
+                    try:
+                        infos = f.result()
+                    except (OpensubtitlesError, OSError) as e:
+                        report.failed.append((job, str(e)))
+                        continue
+                    if not infos:
+                        report.failed.append((job, 'subtitles not found'))
+                    elif SubPair.make_id(infos) in db.data:
+                        report.skipped.append(job)
+                    else:
+                        found.append((job, infos))
+                report.searched += len(batch)
+                if found:
+                    _download_batch(db, osub, found, report, workers, retries)
+    finally:
+        osub.rate_limiter = rate_limiter
+        if own_session:
+            osub.logout()
+        report.elapsed = timer() - start
+    return report
+
+
+def _download_batch(db, osub, found, report, workers, retries):
+    try:
+        data = _retrying(retries, osub.download_subs,
+                         [x for job, infos in found for x in infos],
+                         pairsubs.DOWNLOAD_CHUNK_SIZE, workers)
+    except (OpensubtitlesError, OSError) as e:
+        report.failed.extend((job, str(e)) for job, infos in found)
+        return
+
+    pairs = []
+    for i, (job, infos) in enumerate(found):
+        sub_pair = SubPair.from_data(infos, data[2*i:2*i+2])
+        if sub_pair:
+            pairs.append((job, sub_pair))
+        else:
+            report.failed.append((job, 'subtitles not downloaded or parsed'))
+
+    added = db.add_subpairs([sp for job, sp in pairs])
+    report.skipped.extend(job for job, sp in pairs if sp.get_id() not in added)
+    report.added.extend(added)
+    if added:
+        report.commits += 1
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk import of subtitles pairs.')
+    parser.add_argument('file', help='file with IMDB ids/URLs and languages')
+    parser.add_argument('--langs', nargs=2, metavar=('LANG1', 'LANG2'),
+                        help='languages for lines without them')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='concurrent API calls')
+    parser.add_argument('--rate', type=float, default=4.0,
+                        help='max API calls per second')
+    parser.add_argument('--retries', type=int, default=2,
+                        help='retries of a failed API call')
+    parser.add_argument('--batch-size', type=int, default=20)
+    args = parser.parse_args(argv)
+
+    logging.basicConfig(level=logging.INFO)
+    with open(args.file) as f:
+        jobs = parse_jobs(f, args.langs)
+
+    db = SubDb()
+    Opensubtitles.search_cache = SearchCache(
+            pairsubs.SEARCH_CACHE_DB, pairsubs.SEARCH_CACHE_TTL,
+            stale_ttl=pairsubs.SEARCH_CACHE_STALE_TTL)
+    try:
+        report = bulk_import(db, jobs, workers=args.workers, rate=args.rate,
+                             retries=args.retries, batch_size=args.batch_size,
+                             osub=db.get_session())
+    finally:
+        db.close()
+        print('Search cache: {}'.format(Opensubtitles.search_cache.stats()))
+        Opensubtitles.search_cache.close()
+    for job, reason in report.failed:
+        print('Failed: {} ({}, {}): {}'.format(*job, reason))
+    print(report)
+
+
+if __name__ == '__main__':
+    main()
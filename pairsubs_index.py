@@ -0,0 +1,289 @@
+"""
+Full-text index of the downloaded subtitles.
+
+The index maps a token to postings: (document, side, cue position).
+A document is a SubPair, the side is 0 for the first subtitles and 1 for
+the second ones, the cue position is in the start order of the subtitles
+(`pairsubs.Subs.start_order`).
+
+The index is a set of immutable segments in a directory:
+    `manifest.json`: SubPair ids to document numbers, list of segments
+    `<segment>.terms`: JSON dictionary {token: [offset, count]}
+    `<segment>.post`: postings (int64), memory-mapped on search
+Adding SubPairs writes a new segment and merges the newest segments
+while they are not smaller than the previous one, so there are about
+log2(N) segments. Removed SubPairs are dropped from the manifest only,
+their postings are skipped on search and purged by merges.
+"""
+import json
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_left
+
+import logging
+from logging import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_TAG_RE = re.compile(r'<[^>]*>')
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Returns lowercase word tokens of `text` (markup tags are skipped)."""
+    return _TOKEN_RE.findall(_TAG_RE.sub(' ', text).lower())
+
+
+def _posting(doc, side, cue):
+    return doc << 32 | cue << 1 | side
+
+
+def _contains(postings, posting):
+    i = bisect_left(postings, posting)
+    return i < len(postings) and postings[i] == posting
+
+
+def _unpack(posting):
+    """Returns (doc, side, cue) of a posting."""
+    return posting >> 32, posting & 1, (posting & 0xffffffff) >> 1
+
+
+class _Segment:
+    """Read-only segment of the index."""
+
+    def __init__(self, path):
+        with open(path + '.terms') as f:
+            self.terms = json.load(f)
+        self.file = open(path + '.post', 'rb')
+        size = os.fstat(self.file.fileno()).st_size
+        self.postings_map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ) \
+            if size else b''
+
+    def count(self, token):
+        entry = self.terms.get(token)
+        return entry[1] if entry else 0
+
+    def postings(self, token):
+        """Returns sorted postings of `token` (array of int)."""
+        res = array('q')
+        entry = self.terms.get(token)
+        if entry:
+            offset, count = entry
+            res.frombytes(self.postings_map[offset*8:(offset+count)*8])
+        return res
+
+    def tokens(self):
+        return self.terms.keys()
+
+    def close(self):
+        if self.postings_map:
+            self.postings_map.close()
+        self.file.close()
+
+    @staticmethod
+    def write(path, postings):
+        """
+        Write a segment.
+        Args:
+            `path` (str): segment path without extension
+            `postings` (dict of {str: list or array of int}): sorted
+                postings by token
+        """
+        terms = {}
+        offset = 0
+        with open(path + '.post', 'wb') as f:
+            for token in sorted(postings):
+                values = postings[token]
+                if not isinstance(values, array):
+                    values = array('q', values)
+                f.write(values.tobytes())
+                terms[token] = [offset, len(values)]
+                offset += len(values)
+        with open(path + '.terms', 'w') as f:
+            # json.dumps uses the C encoder, json.dump doesn't
+            f.write(json.dumps(terms, separators=(',', ':')))
+
+
+class SubIndex:
+    """
+    Inverted index of subtitles cues.
+    Args:
+        `path` (str): index directory
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        self.manifest_path = os.path.join(path, 'manifest.json')
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            manifest = {}
+        self.docs = manifest.get('docs', {})
+        self.next_doc = manifest.get('next_doc', 0)
+        self.next_segment = manifest.get('next_segment', 0)
+        # [segment name, number of documents]
+        self.segments = manifest.get('segments', [])
+        self.doc_ids = {v: k for k, v in self.docs.items()}
+        self._open = {}
+        self._remove_orphans()
+
+    def __contains__(self, sub_id):
+        return sub_id in self.docs
+
+    def __len__(self):
+        return len(self.docs)
+
+    def add(self, sub_id, texts):
+        """Index SubPair (see `add_many`)."""
+        self.add_many([(sub_id, texts)])
+
+    def add_many(self, items):
+        """
+        Index SubPairs as one segment. A SubPair which is already
+        indexed is replaced.
+        Args:
+            `items` (iterable of (str, (list of str, list of str))): SubPair
+                ids and texts of the cues of both subtitles in start order
+        """
+        postings = {}
+        docs = 0
+        for sub_id, texts in items:
+            if sub_id in self.docs:
+                del self.doc_ids[self.docs[sub_id]]
+            doc = self.next_doc
+            self.next_doc += 1
+            self.docs[sub_id] = doc
+            self.doc_ids[doc] = sub_id
+            docs += 1
+            for side, cues in enumerate(texts):
+                for cue, text in enumerate(cues):
+                    value = _posting(doc, side, cue)
+                    for token in set(tokenize(text)):
+                        postings.setdefault(token, []).append(value)
+        if not docs:
+            return
+        for values in postings.values():
+            values.sort()
+        self.segments.append([self._write_segment(postings), docs])
+        merged = self._merge()
+        self._write_manifest()
+        for name in merged:
+            self._drop_segment(name)
+
+    def remove_many(self, sub_ids):
+        """Remove SubPairs from the index."""
+        removed = [self.docs.pop(x) for x in sub_ids if x in self.docs]
+        if removed:
+            for doc in removed:
+                del self.doc_ids[doc]
+            self._write_manifest()
+
+    def search(self, query, limit=None):
+        """
+        Find cues containing all tokens of `query`.
+        Args:
+            `query` (str): words to find
+            `limit` (int): max number of results
+        Returns:
+            list of (sub_id, side, cue position) tuples
+        """
+        tokens = set(tokenize(query))
+        if not tokens:
+            return []
+        found = []
+        # documents of a segment are newer than ones of the previous
+        # segments, so the postings are found in the sorted order
+        for name, _ in self.segments:
+            segment = self._segment(name)
+            # start with the rarest token
+            ordered = sorted(tokens, key=segment.count)
+            if not segment.count(ordered[0]):
+                continue
+            others = [segment.postings(x) for x in ordered[1:]]
+            for posting in segment.postings(ordered[0]):
+                if posting >> 32 in self.doc_ids and all(_contains(x, posting)
+                                                         for x in others):
+                    found.append(posting)
+                    if len(found) == limit:
+                        break
+            if len(found) == limit:
+                break
+        res = []
+        for posting in found:
+            doc, side, cue = _unpack(posting)
+            res.append((self.doc_ids[doc], side, cue))
+        return res
+
+    def close(self):
+        for segment in self._open.values():
+            segment.close()
+        self._open = {}
+
+    def _segment(self, name):
+        if name not in self._open:
+            self._open[name] = _Segment(os.path.join(self.path, name))
+        return self._open[name]
+
+    def _write_segment(self, postings):
+        name = 'seg_{:06d}'.format(self.next_segment)
+        self.next_segment += 1
+        _Segment.write(os.path.join(self.path, name), postings)
+        return name
+
+    def _merge(self):
+        """
+        Merge the newest segments while they aren't smaller than previous ones.
+        Returns:
+            names of merged segments to remove after the manifest is written
+        """
+        dropped = []
+        while len(self.segments) > 1 and self.segments[-1][1] >= self.segments[-2][1]:
+            merged = self.segments[-2:]
+            # some documents were removed or replaced
+            purge = self.next_doc != len(self.docs)
+            postings = {}
+            for name, _ in merged:
+                segment = self._segment(name)
+                for token in segment.tokens():
+                    values = segment.postings(token)
+                    if purge:
+                        values = array('q', (x for x in values if x >> 32 in self.doc_ids))
+                    if values:
+                        postings.setdefault(token, array('q')).extend(values)
+            # postings of the newer segment have greater document numbers
+            self.segments[-2:] = [[self._write_segment(postings),
+                                   sum(x[1] for x in merged)]]
+            dropped.extend(x[0] for x in merged)
+        return dropped
+
+    def _drop_segment(self, name):
+        segment = self._open.pop(name, None)
+        if segment:
+            segment.close()
+        for ext in ('.terms', '.post'):
+            try:
+                os.remove(os.path.join(self.path, name + ext))
+            except FileNotFoundError:
+                pass
+
+    def _write_manifest(self):
+        tmp = self.manifest_path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps({'docs': self.docs,
+                                'next_doc': self.next_doc,
+                                'next_segment': self.next_segment,
+                                'segments': self.segments}))
+        os.replace(tmp, self.manifest_path)
+
+    def _remove_orphans(self):
+        """Remove segments which aren't in the manifest (interrupted writes)."""
+        names = {x[0] for x in self.segments}
+        for filename in os.listdir(self.path):
+            name, ext = os.path.splitext(filename)
+            if ext in ('.terms', '.post') and name not in names:
+                os.remove(os.path.join(self.path, filename))
@@ -0,0 +1,150 @@
+"""
+Streaming SRT parser.
+
+`srt.parse` needs the whole file in one string and stops at the first
+garbled block. `iter_srt` reads the subtitles line by line from any
+iterable of lines (a file object, `io.StringIO`) and yields cues as
+soon as they are complete, so the caller decides how many cues to keep
+and when to stop reading. Malformed blocks are skipped and reported,
+the rest of the file is still parsed.
+
+The accepted format follows `srt.parse`: the index line is optional,
+blank lines inside the content are kept if the next lines don't start
+a new cue, a missing blank line before the next cue is tolerated.
+"""
+import collections
+import re
+from array import array
+
+import srt
+
+import logging
+from logging import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+_TIMING_RE = re.compile(r'\s*({ts}) *-[ -] *> *({ts}) ?(.*)$'.format(ts=srt.RGX_TIMESTAMP))
+_INDEX_RE = re.compile(r'\s*({})\s*$'.format(srt.RGX_INDEX))
+
+#: Skipped part of SRT data: first line number (1-based) and its lines
+BadBlock = collections.namedtuple('BadBlock', 'line text')
+
+
+def _parse_index(line):
+    m = _INDEX_RE.match(line)
+    return int(m.group(1).split('.')[0]) if m else None
+
+
+def _parse_timing(line):
+    """
+    Returns (start, end, proprietary) of a timing line, None if `line`
+    isn't a timing line.
+    """
+    m = _TIMING_RE.match(line) if '>' in line else None
+    if m:
+        return (srt.srt_timestamp_to_timedelta(m.group(1)),
+                srt.srt_timestamp_to_timedelta(m.group(2)), m.group(3))
+    return None
+
+
+def _is_bad_timing(line, prev_line):
+    """
+    Returns True if `line` is a malformed timing line: it looks like
+    a timing line and follows an index line. Elsewhere such a line
+    (`2 --> 3`) is cue text, as in `srt.parse`.
+    """
+    return ('-->' in line and line.lstrip()[:1].isdigit() and
+            _parse_index(prev_line) is not None)
+
+
+def iter_srt(lines, errors=None):
+    """
+    Parse SRT subtitles incrementally.
+    Args:
+        `lines` (iterable of str): SRT data lines (with or without
+            line endings)
+        `errors` (list): `BadBlock` objects of skipped blocks are appended
+    Yields:
+        `srt.Subtitle` objects in the file order
+    """
+    cue = None        # [index, start, end, proprietary]
+    content = []      # content lines of `cue` or lines of a bad block
+    bad_line = 0      # first line of the bad block in `content`
+    prev_line = ''
+
+    def finish():
+        while content and not content[-1].strip():
+            content.pop()
+        if cue is not None:
+            return srt.Subtitle(*cue[:3], content='\n'.join(content), proprietary=cue[3])
+        if content:
+            logger.debug("Skipped bad SRT block at line {}".format(bad_line))
+            if errors is not None:
+                errors.append(BadBlock(bad_line, '\n'.join(content)))
+        return None
+
+    for lineno, line in enumerate(lines, 1):
+        line = line.rstrip('\r\n')
+        timing = _parse_timing(line)
+        if timing is None and _is_bad_timing(line, prev_line):
+            timing = False
+        prev_line = line
+        if timing is None:
+            if cue is None and not content:
+                if not line.strip():
+                    continue
+                bad_line = lineno
+            content.append(line)
+            continue
+
+        # Timing line: the previous line may be the index of the cue
+        index_line = content[-1] if content else ''
+        index = _parse_index(index_line)
+        if index is not None:
+            content.pop()
+        sub = finish()
+        if sub is not None:
+            yield sub
+        content = []
+        if timing:
+            cue = [index] + list(timing)
+        else:
+            cue = None
+            bad_line = lineno if index is None else lineno - 1
+            if index is not None:
+                content.append(index_line)
+            content.append(line)
+
+    sub = finish()
+    if sub is not None:
+        yield sub
+
+
+def cue_offsets(f):
+    """
+    Find byte offsets of the cues in a binary SRT file. A cue starts at
+    its index line or at its timing line if there is no index, so
+    `iter_srt` parses any `[offsets[i]:offsets[j]]` slice of the file
+    into cues `i` to `j - 1`.
+    Args:
+        `f` (binary file object): SRT file
+    Returns:
+        array of int: offsets of the cues and the offset of the file end
+    """
+    offsets = array('q')
+    pos = 0
+    prev = None       # (offset, line) of the previous line
+    for raw in f:
+        # timing and index lines are ASCII, other bytes are irrelevant
+        line = raw.decode('latin-1').rstrip('\r\n')
+        timing = _parse_timing(line)
+        if timing:
+            if prev and _parse_index(prev[1]) is not None:
+                offsets.append(prev[0])
+            else:
+                offsets.append(pos)
+        prev = (pos, line)
+        pos += len(raw)
+    offsets.append(pos)
+    return offsets
@@ -0,0 +1,387 @@
+"""Storage engines for the subtitles database (`pairsubs.SubDb`) and search cache."""
+import json
+import os
+import sqlite3
+import threading
+import time
+
+import logging
+from logging import NullHandler
+
+logger = logging.getLogger(__name__)
+logger.addHandler(NullHandler())
+
+# Max number of records in the JSON storage journal before compaction
+JOURNAL_COMPACT_RECORDS = 500
+
+
+class Storage:
+    """
+    Base class for SubDb storage engines.
+
+    The engine keeps SubPairs info dictionaries (see `pairsubs.SubDb.data`)
+    keyed by SubPair id.
+    """
+
+    def load(self):
+        """
+        Load all SubPairs info.
+        Returns:
+            (dict of dicts): {`sub_id`: subpair_info}
+        """
+        raise NotImplementedError
+
+    def put_many(self, items):
+        """
+        Insert or update SubPairs info.
+        Args:
+            `items` (dict of dicts): {`sub_id`: subpair_info}
+        """
+        raise NotImplementedError
+
+    def remove_many(self, sub_ids):
+        """
+        Remove SubPairs info.
+        Args:
+            `sub_ids` (iterable of str): SubPair ids
+        """
+        raise NotImplementedError
+
+    def save_all(self, data):
+        """Replace the whole stored data with `data`."""
+        raise NotImplementedError
+
+    def put(self, sub_id, info):
+        self.put_many({sub_id: info})
+
+    def remove(self, sub_id):
+        self.remove_many([sub_id])
+
+    def close(self):
+        pass
+
+
+class JsonStorage(Storage):
+    """
+    Storage in a JSON snapshot file and an append-only journal.
+    Each change appends one JSON record (a line) to `<path>.journal`,
+    so a write costs the size of the change and a torn write loses only
+    the last record. The journal is compacted into the snapshot every
+    `compact_every` records and on load: the snapshot is written into
+    a temporary file which is renamed over the old one.
+    Args:
+        `path` (str): JSON file name
+        `compact_every` (int): max number of records in the journal
+    """
+
+    def __init__(self, path, compact_every=JOURNAL_COMPACT_RECORDS):
+        self.path = path
+        self.journal_path = path + '.journal'
+        self.compact_every = compact_every
+        self.data = {}
+        self.records = 0
+        self.journal = None
+
+    def load(self):
+        # If the file doesn't exist we create it.
+        if not os.path.isfile(self.path):
+            with open(self.path, 'a'):
+                os.utime(self.path, None)
+
+        with open(self.path, 'r') as f:
+            text = f.read()
+        try:
+            self.data = json.loads(text) if text.strip() else {}
+        except ValueError:
+            # keep the broken file for recovery
+            os.replace(self.path, self.path + '.corrupt')
+            logger.error("Database {} is corrupted, saved as {}.corrupt".format(
+                self.path, self.path))
+            self.data = {}
+
+        self.records, torn = self._replay()
+        # a torn record must be cut off before new records are appended
+        if self.records or torn:
+            self.compact()
+        return self.data
+
+    def _replay(self):
+        """
+        Apply the journal records to `data`.
+        Returns:
+            (records, torn) tuple: number of applied records and True
+            if a torn record was skipped
+        """
+        if not os.path.isfile(self.journal_path):
+            return 0, False
+        records = 0
+        with open(self.journal_path, 'rb') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    logger.warning("Torn record in {} is skipped".format(
+                        self.journal_path))
+                    return records, True
+                self.data.update(record.get('put', {}))
+                for sub_id in record.get('remove', []):
+                    self.data.pop(sub_id, None)
+                records += 1
+        return records, False
+
+    def put_many(self, items):
+        self.data.update(items)
+        self._append({'put': items})
+
+    def remove_many(self, sub_ids):
+        sub_ids = list(sub_ids)
+        for sub_id in sub_ids:
+            self.data.pop(sub_id, None)
+        self._append({'remove': sub_ids})
+
+    def save_all(self, data):
+        self.data = data
+        self.compact()
+
+    def _append(self, record):
+        if self.journal is None:
+            self.journal = open(self.journal_path, 'a')
+        self.journal.write(json.dumps(record) + '\n')
+        self.journal.flush()
+        os.fsync(self.journal.fileno())
+        self.records += 1
+        if self.records >= self.compact_every:
+            self.compact()
+
+    def compact(self):
+        """Write the snapshot and truncate the journal."""
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write(json.dumps(self.data))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # Replaying the old journal over the new snapshot is harmless,
+        # so a crash here loses nothing.
+        if self.journal is not None:
+            self.journal.close()
+        self.journal = open(self.journal_path, 'w')
+        self.records = 0
+
+    def close(self):
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+
+
+class SqliteStorage(Storage):
+    """
+    Storage in a SQLite database (WAL mode), one row per SubPair.
+    Rows are indexed by IMDB id and languages of the pair.
+    Args:
+        `path` (str): database file name
+    """
+    schema = (
+        """CREATE TABLE IF NOT EXISTS subpairs (
+               sub_id TEXT PRIMARY KEY,
+               imdb_id TEXT,
+               lang1 TEXT,
+               lang2 TEXT,
+               data TEXT NOT NULL)""",
+        """CREATE INDEX IF NOT EXISTS subpairs_imdb_lang
+               ON subpairs (imdb_id, lang1, lang2)""",
+        )
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        with self.conn:
+            for sql in self.schema:
+                self.conn.execute(sql)
+
+    @staticmethod
+    def _row(sub_id, info):
+        subs = info.get('subs') or [{}, {}]
+        return (sub_id,
+                subs[0].get('IDMovieImdb'),
+                subs[0].get('SubLanguageID'),
+                subs[1].get('SubLanguageID'),
+                json.dumps(info))
+
+    def load(self):
+        with self.lock:
+            rows = self.conn.execute(
+                'SELECT sub_id, data FROM subpairs ORDER BY rowid').fetchall()
+        return {sub_id: json.loads(data) for sub_id, data in rows}
+
+    def put_many(self, items):
+        rows = [self._row(k, v) for k, v in items.items()]
+        with self.lock, self.conn:
+            # UPSERT needs SQLite 3.24 and INSERT OR REPLACE changes
+            # the rowid (the order), so update first and insert the rest
+            self.conn.executemany(
+                '''UPDATE subpairs SET imdb_id = ?, lang1 = ?, lang2 = ?, data = ?
+                   WHERE sub_id = ?''', [r[1:] + r[:1] for r in rows])
+            self.conn.executemany(
+                'INSERT OR IGNORE INTO subpairs VALUES (?, ?, ?, ?, ?)', rows)
+
+    def remove_many(self, sub_ids):
+        with self.lock, self.conn:
+            self.conn.executemany('DELETE FROM subpairs WHERE sub_id = ?',
+                                  [(x,) for x in sub_ids])
+
+    def save_all(self, data):
+        rows = [self._row(k, v) for k, v in data.items()]
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM subpairs')
+            self.conn.executemany(
+                'INSERT INTO subpairs VALUES (?, ?, ?, ?, ?)', rows)
+
+    def find(self, imdb_id, lang1=None, lang2=None):
+        """
+        Find SubPairs by IMDB id and languages.
+        Returns:
+            list of SubPair ids
+        """
+        sql = 'SELECT sub_id FROM subpairs WHERE imdb_id = ?'
+        args = [imdb_id]
+        for col, val in (('lang1', lang1), ('lang2', lang2)):
+            if val is not None:
+                sql += ' AND {} = ?'.format(col)
+                args.append(val)
+        with self.lock:
+            return [r[0] for r in self.conn.execute(sql, args)]
+
+    def count(self):
+        with self.lock:
+            return self.conn.execute('SELECT COUNT(*) FROM subpairs').fetchone()[0]
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def migrate_json(json_path, storage):
+    """
+    One-time migration of a JSON database into `storage`.
+    The JSON file is renamed to `<json_path>.migrated` afterwards.
+    Args:
+        `json_path` (str): JSON database file name
+        `storage` (`Storage`): destination storage
+    Returns:
+        (int): number of migrated SubPairs
+    """
+    if not os.path.isfile(json_path):
+        return 0
+    json_storage = JsonStorage(json_path)
+    data = json_storage.load()
+    json_storage.close()
+    if data:
+        storage.put_many(data)
+    os.replace(json_path, json_path + '.migrated')
+    if os.path.exists(json_storage.journal_path):
+        os.remove(json_storage.journal_path)
+    logger.info("Migrated {} subtitles pairs from {}".format(len(data), json_path))
+    return len(data)
+
+
+class SearchCache:
+    """
+    Persistent cache of Opensubtitles search results in a SQLite database.
+    Entries are keyed by (IMDB id, language), expire after `ttl` seconds
+    and the least recently used ones are evicted above `max_entries`.
+    Args:
+        `path` (str): database file name
+        `ttl` (float): time to live of an entry (seconds)
+        `max_entries` (int): max number of entries
+        `stale_ttl` (float): time after `ttl` during which an expired
+            entry is still returned as stale (stale-while-revalidate);
+            0 disables it
+    """
+    schema = (
+        """CREATE TABLE IF NOT EXISTS search_cache (
+               imdb_id TEXT,
+               lang TEXT,
+               created REAL,
+               accessed REAL,
+               data TEXT NOT NULL,
+               PRIMARY KEY (imdb_id, lang))""",
+        """CREATE INDEX IF NOT EXISTS search_cache_accessed
+               ON search_cache (accessed)""",
+        )
+
+    def __init__(self, path, ttl=7*24*3600, max_entries=1000, stale_ttl=0):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stale_ttl = stale_ttl
+        self.hits = 0
+        self.misses = 0
+        self.stale = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        with self.conn:
+            for sql in self.schema:
+                self.conn.execute(sql)
+
+    def get(self, imdb_id, lang):
+        """
+        Get cached search result.
+        Returns:
+            (data, fresh) tuple, where `fresh` is False for a stale entry,
+            or None if there is no valid entry
+        """
+        now = time.time()
+        with self.lock, self.conn:
+            row = self.conn.execute(
+                'SELECT created, data FROM search_cache '
+                'WHERE imdb_id = ? AND lang = ?', (imdb_id, lang)).fetchone()
+            if row is None or now - row[0] > self.ttl + self.stale_ttl:
+                self.misses += 1
+                return None
+            self.conn.execute(
+                'UPDATE search_cache SET accessed = ? WHERE imdb_id = ? AND lang = ?',
+                (now, imdb_id, lang))
+            fresh = now - row[0] <= self.ttl
+            if fresh:
+                self.hits += 1
+            else:
+                self.stale += 1
+            return json.loads(row[1]), fresh
+
+    def put(self, imdb_id, lang, data):
+        """Store search result `data` (JSON serializable)."""
+        now = time.time()
+        with self.lock, self.conn:
+            self.conn.execute(
+                'INSERT OR REPLACE INTO search_cache VALUES (?, ?, ?, ?, ?)',
+                (imdb_id, lang, now, now, json.dumps(data)))
+            count = self.conn.execute('SELECT COUNT(*) FROM search_cache').fetchone()[0]
+            if count > self.max_entries:
+                self.evictions += count - self.max_entries
+                self.conn.execute(
+                    'DELETE FROM search_cache WHERE rowid IN ('
+                    'SELECT rowid FROM search_cache ORDER BY accessed LIMIT ?)',
+                    (count - self.max_entries,))
+
+    def clear(self):
+        with self.lock, self.conn:
+            self.conn.execute('DELETE FROM search_cache')
+
+    def stats(self):
+        with self.lock:
+            entries = self.conn.execute('SELECT COUNT(*) FROM search_cache').fetchone()[0]
+            return {'hits': self.hits,
+                    'misses': self.misses,
+                    'stale': self.stale,
+                    'evictions': self.evictions,
+                    'entries': entries}
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
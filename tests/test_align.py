@@ -0,0 +1,50 @@
+import random
+
+import pytest
+
+import pairsubs_align
+
+
+def gen_times(length, scale, offset, seed=1):
+    rnd = random.Random(seed)
+    first = sorted(rnd.uniform(0, length*3) for _ in range(length))
+    second = [scale*t + offset + rnd.gauss(0, 0.1)
+              for t in first if rnd.random() > 0.15]
+    second += [rnd.uniform(0, length*3) for _ in range(length // 10)]
+    return first, sorted(second)
+
+
+@pytest.mark.parametrize('scale, offset', [(1.0, 7.3), (25/23.976, -12.0), (1.013, 30.0)])
+def test_estimate(scale, offset):
+    first, second = gen_times(600, scale, offset)
+    s, o, score = pairsubs_align.estimate(first, second)
+    assert s == pytest.approx(scale, abs=1e-4)
+    assert o == pytest.approx(offset, abs=0.1)
+    assert score > 0.8
+
+
+def test_estimate_empty():
+    assert pairsubs_align.estimate([], [1.0]) == (1.0, 0.0, 0.0)
+
+
+def test_fit_line():
+    assert pairsubs_align.fit_line([(0, 1), (10, 21)]) == (2.0, 1.0)
+
+
+def test_align_cues():
+    first = [(10, 12, 20), (20, 24, 40), (30, 32, 20), (40, 42, 20), (50, 52, 20)]
+    second = [(10.1, 12, 22),
+              (20, 22, 20), (22.1, 24, 20),  # split cue
+              (40, 42.1, 21),  # missing cue
+              (45, 46, 5),  # extra cue
+              (50, 52, 20)]
+    assert pairsubs_align.align_cues(first, second) == [
+            (0, 1, 0, 1), (1, 2, 1, 3), (2, 3, 3, 3), (3, 4, 3, 4),
+            (4, 4, 4, 5), (4, 5, 5, 6)]
+
+
+def test_align_cues_band():
+    first = [(t*3.0, t*3.0 + 2, 20) for t in range(300)]
+    second = [(t*3.0 + 0.2, t*3.0 + 2.2, 25) for t in range(300)]
+    beads = pairsubs_align.align_cues(first, second, band=3)
+    assert beads == [(i, i+1, i, i+1) for i in range(300)]
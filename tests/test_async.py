@@ -0,0 +1,162 @@
+import asyncio
+import base64
+import threading
+import zlib
+from time import sleep
+
+import pytest
+import xmlrpc.client
+
+import pairsubs
+from pairsubs import Opensubtitles
+from pairsubs_async import AsyncOpensubtitles
+from pairsubs_storage import SearchCache
+
+
+def run_loop(coro):
+    # asyncio.run() needs Python 3.7
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coro)
+    finally:
+        loop.close()
+
+
+class mockproxy():
+    '''
+    xmlrpc.client.ServerProxy mock class with delays and failures
+    '''
+    delay = 0.05
+    failures = 0
+    in_flight = 0
+    max_in_flight = 0
+    lock = threading.Lock()
+
+    def __init__(self, path, transport=None):
+        self.calls = []
+
+    def _enter(self, name):
+        cls = type(self)
+        with cls.lock:
+            self.calls.append(name)
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        sleep(self.delay)
+        with cls.lock:
+            cls.in_flight -= 1
+            if cls.failures:
+                cls.failures -= 1
+                raise xmlrpc.client.ProtocolError('url', 503, 'Unavailable', {})
+
+    def LogIn(self, login, password, lang, agent):
+        self._enter('LogIn')
+        return {'token': '42'}
+
+    def LogOut(self, token):
+        self._enter('LogOut')
+
+    def SearchSubtitles(self, token, params, count):
+        self._enter('SearchSubtitles')
+        lang = params[0]['sublanguageid']
+        return {'status': '200 OK',
+                'data': [{'SubDownloadsCnt': '1', 'SubLanguageID': lang,
+                          'IDSubtitleFile': 'id_{}'.format(lang)}]}
+
+    def DownloadSubtitles(self, token, ids):
+        self._enter('DownloadSubtitles')
+        return {'data': [{'idsubtitlefile': x,
+                          'data': base64.b64encode(zlib.compress(x.encode()))}
+                         for x in ids]}
+
+
+@pytest.fixture
+def proxy(monkeypatch):
+    monkeypatch.setattr(xmlrpc.client, 'ServerProxy', mockproxy)
+    monkeypatch.setattr(mockproxy, 'delay', 0.05)
+    monkeypatch.setattr(mockproxy, 'failures', 0)
+    monkeypatch.setattr(mockproxy, 'in_flight', 0)
+    monkeypatch.setattr(mockproxy, 'max_in_flight', 0)
+    monkeypatch.setattr(pairsubs, 'RETRY_DELAY', 0.01)
+    return mockproxy
+
+
+def test_concurrent_calls(proxy):
+    async def run():
+        client = AsyncOpensubtitles(max_in_flight=2, rate=1000, burst=10)
+        langs = ['eng', 'rus', 'fre', 'ger', 'spa', 'ita']
+        subs = await asyncio.gather(*[client.search_sub('tt0001', x) for x in langs])
+        data = await client.download_subs(subs, chunk_size=2)
+        await client.logout()
+        return client, subs, data
+
+    client, subs, data = run_loop(run())
+    assert [x['SubLanguageID'] for x in subs] == ['eng', 'rus', 'fre', 'ger', 'spa', 'ita']
+    assert data == [x['IDSubtitleFile'].encode() for x in subs]
+    assert proxy.max_in_flight == 2
+    calls = client.osub.proxy.calls
+    assert calls.count('LogIn') == 1
+    assert calls.count('DownloadSubtitles') == 3
+    assert calls[-1] == 'LogOut'
+
+
+def test_backoff(proxy):
+    proxy.failures = 2
+
+    async def run():
+        client = AsyncOpensubtitles(rate=1000)
+        return await client.search_sub('tt0001', 'eng')
+
+    assert run_loop(run())['SubLanguageID'] == 'eng'
+    assert proxy.failures == 0
+
+
+def test_rate_limit(proxy):
+    proxy.delay = 0
+
+    async def run():
+        client = AsyncOpensubtitles(max_in_flight=10, rate=50, burst=1)
+        loop = asyncio.get_event_loop()
+        t = loop.time()
+        await asyncio.gather(*[client.search_sub('tt0001', str(x)) for x in range(5)])
+        return loop.time() - t
+
+    # login + 5 searches at 50 calls/s
+    assert run_loop(run()) >= 0.09
+
+
+def test_max_retry(proxy):
+    proxy.failures = 100
+
+    async def run():
+        client = AsyncOpensubtitles(rate=1000)
+        await client.login()
+
+    with pytest.raises(pairsubs.OpensubtitlesError):
+        run_loop(run())
+
+
+def test_refresh_and_logout(proxy, tmp_path, caplog):
+    session_file = tmp_path / 'session.json'
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), ttl=10, stale_ttl=10)
+
+    async def run():
+        client = AsyncOpensubtitles(
+            Opensubtitles(search_cache=cache, session_file=str(session_file)),
+            rate=1000)
+        await client.search_sub('tt0001', 'eng')
+        assert session_file.exists()
+        # a failed refresh of a stale result is logged
+        cache.conn.execute('UPDATE search_cache SET created = created - 15')
+        proxy.failures = 100
+        assert (await client.search_sub('tt0001', 'eng'))['SubLanguageID'] == 'eng'
+        await client.wait_refresh()
+        proxy.failures = 0
+        await client.logout()
+        return client
+
+    with caplog.at_level('INFO', logger='pairsubs_async'):
+        client = run_loop(run())
+    assert 'Search refresh failed' in caplog.text
+    assert client.osub.token is None
+    assert not session_file.exists()
+    cache.close()
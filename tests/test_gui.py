@@ -0,0 +1,214 @@
+import os
+import threading
+from unittest.mock import Mock
+
+import pytest
+import urwid
+
+from pairsubs_gui import CardPrefetcher, DownloadWorker, SubsListWalker, SubsLogStream
+
+
+class mockstream():
+    def __init__(self):
+        self.lines = []
+
+    def write(self, message):
+        self.lines.append(message)
+
+
+def test_download_worker():
+    started = threading.Event()
+    release = threading.Event()
+
+    def download(url, lang1, lang2):
+        started.set()
+        release.wait(5)
+        if url == 'error':
+            raise OSError('network is down')
+        return 'sub_id' if url == 'found' else None
+
+    db = Mock()
+    db.download = Mock(side_effect=download)
+    out = mockstream()
+    worker = DownloadWorker(db, out)
+    worker.submit('found', 'eng', 'rus')
+    assert started.wait(5)
+    # submit doesn't wait for the running download
+    worker.submit('missing', 'eng', 'rus')
+    worker.submit('error', 'eng', 'rus')
+    assert worker.pending() == 2
+    release.set()
+    worker.queue.join()
+    assert worker.stop() == 0
+
+    assert db.download.call_count == 3
+    assert out.lines[-3:] == ['Done: found (eng, rus)\n',
+                              'Not found: missing (eng, rus)\n',
+                              'Failed: error (network is down)\n']
+
+
+def test_download_worker_stop():
+    started = threading.Event()
+    release = threading.Event()
+
+    def download(url, lang1, lang2):
+        started.set()
+        release.wait(5)
+
+    db = Mock()
+    db.download = Mock(side_effect=download)
+    worker = DownloadWorker(db, mockstream())
+    worker.submit('first', 'eng', 'rus')
+    assert started.wait(5)
+    worker.submit('second', 'eng', 'rus')
+    worker.submit('third', 'eng', 'rus')
+    # queued downloads are dropped, the running one isn't waited for
+    assert worker.stop(timeout=0.1) == 2
+    assert worker.thread.is_alive()
+    release.set()
+    worker.thread.join(5)
+    assert not worker.thread.is_alive()
+    assert db.download.call_count == 1
+
+
+class mockloop():
+    def __init__(self):
+        self.alarms = []
+
+    def watch_pipe(self, callback):
+        self.callback = callback
+        self.rfd, wfd = os.pipe()
+        return wfd
+
+    def remove_watch_pipe(self, wfd):
+        os.close(self.rfd)
+
+    def set_alarm_in(self, sec, callback):
+        self.alarms.append(callback)
+
+    def run_pipe(self):
+        self.callback(os.read(self.rfd, 1024))
+
+
+def test_log_stream():
+    box = Mock()
+    loop = mockloop()
+    stream = SubsLogStream(box, loop, max_lines=3)
+    for i in range(10):
+        stream.write('line {}\n'.format(i))
+    # one wake up and one redraw for many messages
+    loop.run_pipe()
+    assert len(loop.alarms) == 1
+    box.set_text.assert_not_called()
+    loop.alarms.pop()()
+    box.set_text.assert_called_once_with('line 7\nline 8\nline 9\n')
+
+    stream.write('line 10\n')
+    loop.run_pipe()
+    loop.alarms.pop()()
+    box.set_text.assert_called_with('line 8\nline 9\nline 10\n')
+
+    # after the main loop exit the messages are only buffered
+    stream.stop()
+    stream.write('line 11\n')
+    assert list(stream.lines)[-1] == 'line 11\n'
+    assert len(loop.alarms) == 0
+
+
+def test_subs_list_walker():
+    ids = ['id{}'.format(i) for i in range(100000)]
+    walker = SubsListWalker(ids, lambda x: 'Movie ' + x)
+    assert not walker.widgets
+    urwid.ListBox(walker).render((40, 5), focus=True)
+    # only visible rows are created
+    assert 0 < len(walker.widgets) <= 5
+
+    walker[1].set_state(True)
+    walker[3].set_state(True)
+    walker[99999].set_state(True)
+    assert walker.get_checked() == ['id1', 'id3', 'id99999']
+
+    walker.set_focus(3)
+    walker.remove(['id1', 'id3'])
+    assert len(walker) == 99998
+    # removed rows are skipped, the next row takes the focus
+    assert walker.ids[walker.focus] == 'id4'
+    assert walker.next_position(0) == walker.rows['id2']
+    assert walker.prev_position(walker.rows['id4']) == walker.rows['id2']
+    with pytest.raises(IndexError):
+        walker[1]
+    assert walker.get_checked() == ['id99999']
+    assert walker[walker.last_position()].get_state()
+    urwid.ListBox(walker).render((40, 5), focus=True)
+
+    # the list is compacted when most of it is removed
+    walker.remove(ids[5:60000])
+    assert len(walker) == len(walker.ids) == 40003
+    assert walker.ids[:4] == ['id0', 'id2', 'id4', 'id60000']
+    assert walker.ids[walker.focus] == 'id4'
+    assert walker.rows['id99999'] == walker.last_position() == 40002
+
+    walker.set_focus(walker.last_position())
+    walker.remove(['id99999'])
+    assert walker.ids[walker.focus] == 'id99998'
+    walker.remove(list(walker.rows))
+    assert len(walker) == 0
+    assert walker.first_position() is None
+    urwid.ListBox(walker).render((40, 5), focus=True)
+
+
+def test_card_prefetcher():
+    cards = iter(range(100))
+    threads = []
+
+    def get_subs(sub_id=None):
+        threads.append(threading.current_thread())
+        return (sub_id or 'random', next(cards))
+
+    db = Mock()
+    db.version = 0
+    db.data = {'random': {}, 'a': {}}
+    db.info = db.data.get
+    db.get_subs = Mock(side_effect=get_subs)
+    prefetcher = CardPrefetcher(db, depth=2)
+    assert prefetcher.get() == ('random', 0)
+    assert threads[0] is threading.current_thread()
+    # next cards are served from the prefetch
+    assert prefetcher.get() == ('random', 1)
+    assert prefetcher.get() == ('random', 2)
+    assert threads[1] is not threading.current_thread()
+
+    # cards of another SubPair are discarded
+    sub_id, card = prefetcher.get('a')
+    assert sub_id == 'a'
+    del db.data['a']
+    sub_id, card = prefetcher.get('a')
+    prefetcher.stop()
+    assert db.get_subs.call_count >= 6
+
+
+def test_card_prefetcher_stale_cards():
+    db = Mock()
+    db.version = 0
+    db.data = {'a': {}, 'b': {}}
+    db.info = db.data.get
+
+    def get_subs(sub_id=None):
+        # a random card of the first pair, made at the current version
+        return (sub_id or min(db.data), db.version)
+
+    db.get_subs = Mock(side_effect=get_subs)
+    prefetcher = CardPrefetcher(db, depth=2)
+    assert prefetcher.get('a') == ('a', 0)
+    # realigned pair
+    db.version = 1
+    assert prefetcher.get('a') == ('a', 1)
+    assert prefetcher.get('a') == ('a', 1)
+
+    assert prefetcher.get() == ('a', 1)
+    # deleted pair
+    db.version = 2
+    del db.data['a']
+    assert prefetcher.get() == ('b', 2)
+    assert prefetcher.get() == ('b', 2)
+    prefetcher.stop()
@@ -0,0 +1,103 @@
+import pytest
+from unittest.mock import Mock
+
+import base64
+import srt
+import xmlrpc.client
+import zlib
+from datetime import timedelta
+
+import pairsubs
+from pairsubs import SubDb
+from pairsubs_import import ImportJob, bulk_import, parse_jobs
+
+
+def gen_srt(name):
+    subs = [srt.Subtitle(index=i, start=timedelta(seconds=i),
+                         end=timedelta(seconds=i+0.5),
+                         content='{} #{}'.format(name, i))
+            for i in range(1, 4)]
+    return srt.compose(subs).encode()
+
+
+class mockproxy():
+    '''
+    xmlrpc.client.ServerProxy mock class
+    '''
+    instances = []
+
+    def __init__(self, path, transport=None):
+        self.calls = []
+        self.instances.append(self)
+
+    def LogIn(self, login, password, lang, agent):
+        self.calls.append('LogIn')
+        return {'token': '42'}
+
+    def LogOut(self, token):
+        self.calls.append('LogOut')
+
+    def SearchSubtitles(self, token, params, count):
+        self.calls.append('SearchSubtitles')
+        imdbid, lang = params[0]['imdbid'], params[0]['sublanguageid']
+        if imdbid == '404':
+            return {'status': '200 OK', 'data': []}
+        name = '{}_{}'.format(imdbid, lang)
+        return {'status': '200 OK', 'data': [{
+            'SubDownloadsCnt': '1', 'SubLanguageID': lang,
+            'SubFileName': name, 'SubEncoding': 'utf-8',
+            'MovieName': 'Movie {}'.format(imdbid),
+            'IDMovieImdb': imdbid, 'IDSubtitleFile': name}]}
+
+    def DownloadSubtitles(self, token, ids):
+        self.calls.append('DownloadSubtitles')
+        return {'data': [{'idsubtitlefile': x,
+                          'data': base64.b64encode(zlib.compress(gen_srt(x)))}
+                         for x in ids]}
+
+
+@pytest.fixture
+def db(monkeypatch, tmp_path):
+    monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+    monkeypatch.setattr(xmlrpc.client, 'ServerProxy', mockproxy)
+    monkeypatch.setattr(mockproxy, 'instances', [])
+    monkeypatch.setattr(SubDb, 'load_data', Mock(return_value={}))
+    monkeypatch.setattr(SubDb, 'write_db', Mock())
+    return SubDb()
+
+
+def test_parse_jobs():
+    lines = ['# movies', 'tt001 eng rus', '', 'https://www.imdb.com/title/tt002/',
+             'tt003 eng fre  # comment']
+    assert parse_jobs(lines, ('eng', 'spa')) == [
+            ImportJob('tt001', 'eng', 'rus'),
+            ImportJob('https://www.imdb.com/title/tt002/', 'eng', 'spa'),
+            ImportJob('tt003', 'eng', 'fre')]
+    with pytest.raises(ValueError):
+        parse_jobs(['tt001 eng'])
+
+
+def test_bulk_import(db, tmp_path):
+    jobs = [ImportJob('tt{}'.format(i), 'eng', 'rus') for i in range(1, 6)]
+    jobs += [ImportJob('tt404', 'eng', 'rus'), ImportJob('tt1', 'eng', 'rus')]
+    report = bulk_import(db, jobs, workers=3, rate=1000, batch_size=2)
+
+    assert len(report.added) == 5
+    assert report.skipped == [ImportJob('tt1', 'eng', 'rus')]
+    assert [job for job, reason in report.failed] == [ImportJob('tt404', 'eng', 'rus')]
+    assert len(db.data) == 5
+    assert report.commits == db.write_db.call_count <= 4
+    assert (tmp_path / '3_eng').read_bytes() == gen_srt('3_eng')
+
+    # one shared session
+    assert len(mockproxy.instances) == 1
+    calls = mockproxy.instances[0].calls
+    assert calls.count('LogIn') == 1 and calls[0] == 'LogIn'
+    assert calls.count('LogOut') == 1 and calls[-1] == 'LogOut'
+    # one download call per batch with new pairs
+    assert calls.count('DownloadSubtitles') == 3
+
+    # the limiter of a caller's session is restored
+    osub = pairsubs.Opensubtitles()
+    report = bulk_import(db, [ImportJob('tt6', 'eng', 'rus')], rate=1000, osub=osub)
+    assert report.added and osub.rate_limiter is None
@@ -0,0 +1,53 @@
+import os
+
+from pairsubs_index import SubIndex, tokenize
+
+
+def texts(n):
+    return (['Hello world {}'.format(n), '<i>Good</i> bye'],
+            ['Hallo Welt {}'.format(n), 'Auf Wiedersehen'])
+
+
+def test_tokenize():
+    assert tokenize("<i>Don't</i> STOP, me now!") == ['don', 't', 'stop', 'me', 'now']
+
+
+class TestSubIndex:
+
+    def test_search(self, tmp_path):
+        index = SubIndex(str(tmp_path))
+        index.add('a', texts(1))
+        index.add_many([('b', texts(2)), ('c', texts(3))])
+        assert index.search('hello') == [('a', 0, 0), ('b', 0, 0), ('c', 0, 0)]
+        assert index.search('World 2') == [('b', 0, 0)]
+        assert index.search('good', limit=2) == [('a', 0, 1), ('b', 0, 1)]
+        assert index.search('wiedersehen') == [('a', 1, 1), ('b', 1, 1), ('c', 1, 1)]
+        assert index.search('i') == []
+        assert index.search('hello bye') == []
+        assert index.search('1') == [('a', 0, 0), ('a', 1, 0)]
+        assert index.search('bye 1') == []
+
+        index.remove_many(['b'])
+        assert [x[0] for x in index.search('hello')] == ['a', 'c']
+        # re-indexed pair replaces the old one
+        index.add('a', (['Another text'], []))
+        assert [x[0] for x in index.search('hello')] == ['c']
+        index.close()
+
+        index = SubIndex(str(tmp_path))
+        assert len(index) == 2
+        assert index.search('text') == [('a', 0, 0)]
+        assert [x[0] for x in index.search('hello')] == ['c']
+        index.close()
+
+    def test_merge(self, tmp_path):
+        index = SubIndex(str(tmp_path))
+        for n in range(16):
+            index.add(str(n), texts(n))
+        index.remove_many(['3'])
+        index.add('16', texts(16))
+        assert len(index.segments) <= 5
+        files = {x for x in os.listdir(str(tmp_path)) if x.startswith('seg_')}
+        assert files == {x[0] + ext for x in index.segments for ext in ('.terms', '.post')}
+        assert [x[0] for x in index.search('hello')] == [str(n) for n in range(17) if n != 3]
+        index.close()
@@ -1,13 +1,24 @@
+import gc
+import os
+import threading
+import weakref
+from time import sleep
+from timeit import default_timer as timer
 import pytest
 from unittest.mock import Mock
+from xmlrpc.server import SimpleXMLRPCServer, SimpleXMLRPCRequestHandler
 
 import srt
+from array import array
 import xmlrpc.client
 import zlib
 import base64
 from datetime import timedelta
 
-from pairsubs import Subs, SubPair, Opensubtitles, SubDb
+import pairsubs
+import pairsubs_srt
+from pairsubs import Subs, SubPair, Opensubtitles, SubDb, CueStore, OpensubtitlesError
+from pairsubs_storage import SearchCache
 
 mocksubs = [
 {'SubDownloadsCnt':10, 'MovieReleaseName':'Release_10', 'IDMovieImdb':'ID_10', 'SubLanguageID':'Lang_10'},
@@ -95,6 +106,53 @@ class mockproxy():
 
 
 
+class mockserver(mockproxy):
+    '''
+    Opensubtitles stand-in served by a local XML-RPC server
+    '''
+    def LogOut(self, token):
+        return {'status': '200 OK'}
+
+    def DownloadSubtitles(self, token, params):
+        res = super().DownloadSubtitles(token, params)
+        for d in res['data']:
+            d['data'] = d['data'].decode()
+        return res
+
+
+class KeepAliveHandler(SimpleXMLRPCRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    rpc_paths = ('/xml-rpc',)
+
+
+@pytest.fixture
+def xmlrpc_server(monkeypatch):
+    monkeypatch.setattr(pairsubs.PooledTransport, 'pool', pairsubs.ConnectionPool())
+    monkeypatch.delenv('http_proxy', raising=False)
+    server = SimpleXMLRPCServer(('127.0.0.1', 0), KeepAliveHandler,
+                                logRequests=False, allow_none=True)
+    server.register_instance(mockserver(None))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield 'http://127.0.0.1:{}/xml-rpc'.format(server.server_address[1])
+    pairsubs.PooledTransport.pool.clear()
+    server.shutdown()
+    server.server_close()
+
+
+def test_keep_alive(xmlrpc_server):
+    for _ in range(2):
+        osub = Opensubtitles(xmlrpc_server)
+        osub.login()
+        sub = osub.search_sub('tt1853728', 'rus')
+        assert sub == mocksubs[1]
+        assert osub.download_sub({'IDSubtitleFile': 12}) == mocksrt[0].encode()
+        osub.logout()
+    stats = pairsubs.PooledTransport.pool.stats()
+    assert stats['opened'] == 1
+    assert stats['reused'] == 7
+
+
 def test_login(monkeypatch):
     monkeypatch.setattr(xmlrpc.client, 'ServerProxy', mockproxy)
 
@@ -120,6 +178,199 @@ def test_download_sub(monkeypatch):
     sub = os.download_sub({'IDSubtitleFile': 12})
     assert sub == mocksrt[0].encode()
 
+
+def test_search_cache(monkeypatch, tmp_path):
+    class mockcountproxy(mockproxy):
+        calls = 0
+        status = None
+
+        def SearchSubtitles(self, token, params, count):
+            mockcountproxy.calls += 1
+            if self.status:
+                return {'status': self.status}
+            return super().SearchSubtitles(token, params, count)
+
+    monkeypatch.setattr(xmlrpc.client, 'ServerProxy', mockcountproxy)
+    cache = SearchCache(str(tmp_path / 'search.sqlite'), ttl=10, stale_ttl=10)
+    os = Opensubtitles(search_cache=cache)
+    os.login()
+    url = "https://www.imdb.com/title/tt1853728/?ref_=nv_sr_1"
+    assert os.search_sub(url, "rus") == mocksubs[1]
+    assert os.search_sub('tt1853728', "rus") == mocksubs[1]
+    assert mockcountproxy.calls == 1
+
+    # stale result is returned and refreshed in background
+    cache.conn.execute('UPDATE search_cache SET created = created - 15')
+    assert os.search_sub('tt1853728', "rus") == mocksubs[1]
+    os.wait_refresh()
+    assert mockcountproxy.calls == 2
+    assert cache.get('1853728', 'rus')[1] is True
+    assert cache.stats()['hits'] == 2
+
+    # failed responses aren't cached, a failed refresh is only logged
+    mockcountproxy.status = '503 Service Unavailable'
+    with pytest.raises(OpensubtitlesError):
+        os.search_sub('tt1853728', "eng")
+    assert cache.get('1853728', 'eng') is None
+    cache.conn.execute('UPDATE search_cache SET created = created - 15')
+    assert os.search_sub('tt1853728', "rus") == mocksubs[1]
+    os.wait_refresh()
+    assert cache.get('1853728', 'rus')[1] is False
+    cache.close()
+
+
+def test_login_retries(monkeypatch):
+    class mockfailproxy(mockproxy):
+        logins = 0
+
+        def LogIn(self, login, password, lang, agent):
+            mockfailproxy.logins += 1
+            raise xmlrpc.client.ProtocolError('url', 503, 'Unavailable', {})
+
+    monkeypatch.setattr(xmlrpc.client, 'ServerProxy', mockfailproxy)
+    monkeypatch.setattr(pairsubs, 'RETRY_DELAY', 0)
+    with pytest.raises(OpensubtitlesError):
+        Opensubtitles().search_sub('tt1853728', 'rus')
+    # the lazy login isn't retried inside the retried search
+    assert mockfailproxy.logins == pairsubs.MAX_RETRY
+
+
+class TestSession:
+
+    class mocksessionproxy(mockproxy):
+        logins = 0
+        valid = set()
+
+        def LogIn(self, login, password, lang, agent):
+            cls = type(self)
+            cls.logins += 1
+            token = 'token_{}'.format(cls.logins)
+            cls.valid.add(token)
+            return {'token': token}
+
+        def LogOut(self, token):
+            type(self).valid.discard(token)
+
+        def SearchSubtitles(self, token, params, count):
+            if token not in self.valid:
+                return {'status': '401 Unauthorized'}
+            return super().SearchSubtitles(token, params, count)
+
+    @pytest.fixture
+    def session_file(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(self.mocksessionproxy, 'logins', 0)
+        monkeypatch.setattr(self.mocksessionproxy, 'valid', set())
+        monkeypatch.setattr(xmlrpc.client, 'ServerProxy', self.mocksessionproxy)
+        return str(tmp_path / 'session.json')
+
+    def test_reuse(self, session_file):
+        os1 = Opensubtitles(session_file=session_file)
+        assert os1.search_sub('tt1853728', 'rus') == mocksubs[1]
+        assert os1.search_sub('tt1853728', 'eng') == mocksubs[1]
+        os1.close()
+        os2 = Opensubtitles(session_file=session_file)
+        assert os2.search_sub('tt1853728', 'rus') == mocksubs[1]
+        assert os2.token == 'token_1'
+        assert self.mocksessionproxy.logins == 1
+
+        os2.logout()
+        assert not self.mocksessionproxy.valid
+        assert not os.path.exists(session_file)
+
+    def test_rejected_token(self, session_file):
+        os1 = Opensubtitles(session_file=session_file)
+        os1.login()
+        self.mocksessionproxy.valid.clear()
+        assert os1.search_sub('tt1853728', 'rus') == mocksubs[1]
+        assert os1.token == 'token_2'
+
+    def test_expired_session(self, session_file, monkeypatch):
+        os1 = Opensubtitles(session_file=session_file)
+        os1.login()
+        os1.close()
+        monkeypatch.setattr(pairsubs, 'SESSION_TTL', 0)
+        os2 = Opensubtitles(session_file=session_file)
+        assert os2.search_sub('tt1853728', 'rus') == mocksubs[1]
+        assert self.mocksessionproxy.logins == 2
+
+
+def test_download_subs(monkeypatch):
+    class mockbatchproxy(mockproxy):
+        calls = []
+
+        def DownloadSubtitles(self, token, ids):
+            self.calls.append(ids)
+            return {'data': [{'idsubtitlefile': str(x),
+                              'data': base64.b64encode(zlib.compress(str(x).encode()))}
+                             for x in reversed(ids) if x != 'missing']}
+
+    monkeypatch.setattr(xmlrpc.client, 'ServerProxy', mockbatchproxy)
+    os = Opensubtitles()
+    os.login()
+    subs = [{'IDSubtitleFile': x} for x in ('1', '2', '3', '2', 'missing', '4')]
+    data = os.download_subs(subs, chunk_size=2)
+    assert data == [b'1', b'2', b'3', b'2', None, b'4']
+    assert sorted(mockbatchproxy.calls) == [['1', '2'], ['3', 'missing'], ['4']]
+
+
+class mockdelayproxy(mockproxy):
+    '''
+    xmlrpc.client.ServerProxy mock class with delayed responses
+    '''
+    delay = 0.2
+    found = ('rus', 'eng')
+
+    def __init__(self, path, transport=None):
+        self.logout = Mock()
+        self.downloads = []
+
+    def LogOut(self, token):
+        self.logout(token)
+
+    def SearchSubtitles(self, token, params, count):
+        sleep(self.delay)
+        lang = params[0]['sublanguageid']
+        if lang not in self.found:
+            return {'status': '200 OK', 'data': []}
+        info = dict(mocksubsinfo[0], SubLanguageID=lang, SubDownloadsCnt=1,
+                    IDSubtitleFile='file_{}'.format(lang))
+        return {'status': '200 OK', 'data': [info]}
+
+    def DownloadSubtitles(self, token, params):
+        sleep(self.delay)
+        self.downloads.append(params)
+        data = super().DownloadSubtitles(token, params)['data'][0]['data']
+        return {'data': [{'idsubtitlefile': x, 'data': data} for x in params]}
+
+
+class TestSubPairDownload:
+
+    @pytest.fixture
+    def proxies(self, monkeypatch):
+        proxies = []
+
+        def make_proxy(*args, **kwargs):
+            proxies.append(mockdelayproxy(*args, **kwargs))
+            return proxies[-1]
+        monkeypatch.setattr(xmlrpc.client, 'ServerProxy', make_proxy)
+        return proxies
+
+    def test_concurrent(self, proxies):
+        t = timer()
+        sp = SubPair.download('tt1853728', 'rus', 'eng')
+        elapsed = timer() - t
+        assert [s.sub_info['SubLanguageID'] for s in sp.subs] == ['rus', 'eng']
+        assert sp.subs[0].sub == list(srt.parse(mocksrt[0]))
+        # two sequential steps (search, download) instead of four
+        assert elapsed < 3*mockdelayproxy.delay
+        assert proxies[0].downloads == [['file_rus', 'file_eng']]
+        proxies[0].logout.assert_called_once_with('42')
+
+    def test_not_found(self, proxies):
+        assert SubPair.download('tt1853728', 'rus', 'fre') is None
+        proxies[0].logout.assert_called_once_with('42')
+
+
 # def test_read_sub(monkeypatch):
 #     sp = SubPair.read('file1.srt', 'file2.srt')
 #     assert len(sp.subs[0]) == 5
@@ -143,6 +394,87 @@ class TestSubs:
         end = 25.0
         assert s.get_subs(start, end) == list(srt.parse(mocksrt[0]))[1:3]
 
+    def test_get_sub_unsorted(self):
+        blocks = mocksrt[0].strip().split('\n\n')
+        data = '\n\n'.join(blocks[::-1]).encode()
+        s = Subs(data, mocksubsinfo[0])
+        for start, end in [(0, 50), (10.5, 25.0), (21, 21), (31.5, 40.02),
+                           (44, 50), (20, 10)]:
+            expected = [x for x in s.sub
+                        if s.seconds_to_timedelta(start) <= x.start <= s.seconds_to_timedelta(end)]
+            assert s.get_subs(start, end) == expected
+
+
+class TestCueStore:
+
+    def test_items(self):
+        subtitles = list(srt.parse(mocksrt[0]))
+        subtitles[2].proprietary = 'X1:0'
+        cues = CueStore(subtitles)
+        assert len(cues) == 5
+        assert cues == subtitles
+        assert list(cues) == subtitles
+        assert cues[-1] == subtitles[-1]
+        assert cues[1:3] == subtitles[1:3]
+        assert cues[2].proprietary == 'X1:0'
+        with pytest.raises(IndexError):
+            cues[5]
+
+    def test_nbytes(self):
+        subtitles = list(srt.parse(mocksrt[0]))
+        assert CueStore(subtitles).nbytes() < CueStore.list_nbytes(subtitles)
+
+    def test_bytes(self):
+        subtitles = list(srt.parse(mocksrt[0]))
+        subtitles[0].content = 'Фраза #1'
+        subtitles[1].proprietary = 'X1:0'
+        cues = CueStore(subtitles)
+        assert CueStore.from_bytes(cues.to_bytes()) == subtitles
+        with pytest.raises(ValueError):
+            CueStore.from_bytes(cues.to_bytes()[:-10])
+
+
+class TestCuesCache:
+
+    @pytest.fixture
+    def srt_file(self, tmp_path, monkeypatch):
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        (tmp_path / 'File_10').write_text(mocksrt[0])
+        return tmp_path / 'File_10'
+
+    def test_warm_read(self, srt_file, monkeypatch):
+        expected = list(srt.parse(mocksrt[0]))
+        cold = Subs.read(mocksubsinfo[0])
+        assert os.path.isfile(str(srt_file) + pairsubs.CUES_CACHE_EXT)
+
+        monkeypatch.setattr(pairsubs_srt, 'iter_srt', Mock(side_effect=AssertionError))
+        warm = Subs.read(mocksubsinfo[0])
+        assert warm.sub == cold.sub == expected
+        assert warm.sub_info == cold.sub_info
+        assert warm.get_subs(10.5, 25.0) == cold.get_subs(10.5, 25.0)
+
+    def test_touched_file(self, srt_file, monkeypatch):
+        Subs.read(mocksubsinfo[0])
+        st = os.stat(str(srt_file))
+        os.utime(str(srt_file), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        monkeypatch.setattr(pairsubs_srt, 'iter_srt', Mock(side_effect=AssertionError))
+        assert len(Subs.read(mocksubsinfo[0]).sub) == 5
+
+    def test_stale_cache(self, srt_file):
+        Subs.read(mocksubsinfo[0])
+        srt_file.write_text(mocksrt[1])
+        st = os.stat(str(srt_file))
+        os.utime(str(srt_file), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert Subs.read(mocksubsinfo[0]).sub == list(srt.parse(mocksrt[1]))
+
+    def test_old_version(self, srt_file, monkeypatch):
+        Subs.read(mocksubsinfo[0])
+        # the cache of an older parser is stale
+        monkeypatch.setattr(pairsubs, 'CUES_CACHE_VERSION', pairsubs.CUES_CACHE_VERSION + 1)
+        assert pairsubs.read_cues_cache(str(srt_file)) is None
+        assert len(Subs.read(mocksubsinfo[0]).sub) == 5
+        assert pairsubs.read_cues_cache(str(srt_file)) is not None
+
 
 def gen_sub_info(sub_id, idx):
     return {'MovieName': 'Name_{}'.format(sub_id),
@@ -175,12 +507,72 @@ def gen_subpair(sub_id):
     return SubPair(subs)
 
 
+class TestSubPairAnchors:
+
+    def test_map_times(self):
+        sub_pair = gen_subpair(1)
+        sub_pair.set_anchors([(100, 110), (0, 0), (50, 60)])
+        assert sub_pair.anchors == [(0, 0), (50, 60), (100, 110)]
+        assert sub_pair.map_times([-10, 25, 50, 75, 120]) == [-12, 30, 60, 85, 130]
+        # unsorted times
+        assert sub_pair.map_times([75, 25]) == [85, 30]
+        assert sub_pair.map_time(100) == 110
+
+    def test_read_two_anchors(self, monkeypatch):
+        sub_pair = gen_subpair(1)
+        monkeypatch.setattr(Subs, 'read', Mock(side_effect=sub_pair.subs))
+        info = sub_pair.get_data()
+        del info['anchors']
+        info.update(first_start=10, first_end=40, second_start=12, second_end=42)
+        old = SubPair.read(info)
+        assert old.anchors == [(10, 12), (40, 42)]
+        assert old.get_parallel_subs(0, 20) == [old.subs[0].get_subs(10, 30),
+                                                 old.subs[1].get_subs(12, 32)]
+
+        old.add_anchor(20, 30)
+        monkeypatch.setattr(Subs, 'read', Mock(side_effect=sub_pair.subs))
+        assert SubPair.read(old.get_data()).anchors == [(10, 12), (20, 30), (40, 42)]
+
+    def test_cue_table(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        sub_pair = gen_subpair(1)
+        # no table yet: the card is cut by timing
+        assert sub_pair.get_card(0, count=2) == sub_pair.get_parallel_subs(
+                0, pairsubs.CARD_LENGTH)
+        sub_pair.set_anchors([(0, 5), (50, 55)])
+        assert sub_pair.get_card_at(1, 2) == [sub_pair.subs[0].get_subs(15, 35),
+                                              sub_pair.subs[1].get_subs(20, 40)]
+        sub_pair.set_anchors([(0, 0), (50, 50)])
+        assert sub_pair.cue_table is None
+
+        sub_pair.get_cue_table()
+        first, second = sub_pair.get_card(0, count=2)
+        assert [x.index for x in first] == [1, 2]
+        assert [x.index for x in second] == [1, 2]
+        assert sub_pair.get_card(100, count=2)[0][-1].index == 5
+        table_file = tmp_path / (sub_pair.get_id() + pairsubs.CUE_TABLE_EXT)
+        assert table_file.exists()
+
+        # the stored table is reused by another instance
+        other = SubPair(sub_pair.subs)
+        monkeypatch.setattr(SubPair, 'build_cue_table', Mock(return_value=array('i')))
+        assert other.get_card(0, count=2) == [first, second]
+        SubPair.build_cue_table.assert_not_called()
+        # and rebuilt after alignment, but not by get_card
+        other.add_anchor(25, 25)
+        other.get_card(0, count=2)
+        SubPair.build_cue_table.assert_not_called()
+        other.get_cue_table()
+        SubPair.build_cue_table.assert_called_once()
+
+
 class TestsDb:
 
     @pytest.fixture
-    def gen_db(self):
-        SubDb.load_data = Mock()
-        SubDb.write_db = Mock()
+    def gen_db(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        monkeypatch.setattr(SubDb, 'load_data', Mock())
+        monkeypatch.setattr(SubDb, 'write_db', Mock())
 
         dbdata = {}
         for i in range(3):
@@ -192,16 +584,216 @@ class TestsDb:
         db.data = dbdata
         return db
 
-    def test_download(self, gen_db):
+    def test_download(self, gen_db, monkeypatch):
         imdb = 'some_imdb_url_012345_'
-        SubPair.download = Mock(return_value=gen_subpair(imdb))
+        monkeypatch.setattr(SubPair, 'download', Mock(return_value=gen_subpair(imdb)))
         gen_db.download('some_imdb_url_012345_', 'rus', 'eng')
         assert len(gen_db.data) == 4
+        ids = gen_db.ids()
+        assert ids == list(gen_db.data)
+        assert gen_db.info(ids[-1]) is gen_db.data[ids[-1]]
+        assert gen_db.info('missing') is None
 
-    def test_download_not_found(self, gen_db):
-        SubPair.download = Mock(return_value=None)
+    def test_download_not_found(self, gen_db, monkeypatch):
+        monkeypatch.setattr(SubPair, 'download', Mock(return_value=None))
         gen_db.download('some_imdb_url_012345_', 'rus', 'eng')
         assert len(gen_db.data) == 3
 
+    def test_subs_to_align(self, gen_db, monkeypatch, tmp_path):
+        sub_id = next(iter(gen_db.data))
+        for n, info in enumerate(gen_db.data[sub_id]['subs']):
+            (tmp_path / info['SubFileName']).write_text(mocksrt[n])
+        # the files are read without loading the pair
+        monkeypatch.setattr(SubPair, 'read', Mock(side_effect=AssertionError))
+        first, second = [list(srt.parse(x)) for x in mocksrt]
+        expected = (first[:2], second[:2], first[-3:-1], second[-3:-1])
+        assert gen_db.get_subs_to_align(sub_id, 2) == expected
+
+        # the cue offsets are reused until the file is changed
+        name = tmp_path / gen_db.data[sub_id]['subs'][0]['SubFileName']
+        assert os.path.isfile(str(name) + pairsubs.CUE_OFFSETS_EXT)
+        with monkeypatch.context() as m:
+            m.setattr(pairsubs_srt, 'cue_offsets', Mock(side_effect=AssertionError))
+            assert gen_db.get_subs_to_align(sub_id, 2) == expected
+        name.write_text(mocksrt[1])
+        st = os.stat(str(name))
+        os.utime(str(name), ns=(st.st_atime_ns, st.st_mtime_ns + 10**9))
+        assert gen_db.get_subs_to_align(sub_id, 2)[0] == second[:2]
+
+    def test_align_write_delay(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'APP_DIR', str(tmp_path))
+        monkeypatch.setattr(pairsubs, 'INDEX_DIR', str(tmp_path / 'index'))
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        sub_pairs = [gen_subpair(i) for i in range(2)]
+        storage = Mock()
+        storage.load.return_value = {x.get_id(): x.get_data() for x in sub_pairs}
+        db = SubDb(storage, write_delay=0.1)
+        for x in sub_pairs:
+            db.add_to_cache(x)
+        sub_id = sub_pairs[0].get_id()
+
+        db.align_subs(sub_id, 1, 1, 4, 4)
+        db.align_subs(sub_id, 2, 1, 5, 4)
+        assert db.version == 2
+        storage.put_many.assert_not_called()
+        sleep(0.3)
+        # one write of the changed pair only
+        storage.put_many.assert_called_once_with({sub_id: db.data[sub_id]})
+        assert db.data[sub_id]['first_start'] == 20
+        assert not sub_pairs[0].dirty
+
+        db.align_subs(sub_id, 1, 1, 4, 4)
+        db.close()
+        assert storage.put_many.call_count == 2
+        assert db.data[sub_id]['first_start'] == 10
+
+    def test_flush_on_exit(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(SubDb, 'load_data', Mock(return_value={}))
+        db = SubDb()
+        db.flush = Mock()
+        pairsubs._flush_open_dbs()
+        db.flush.assert_called_once_with()
+        # the exit handler doesn't keep the db alive
+        ref = weakref.ref(db)
+        del db
+        gc.collect()
+        assert ref() is None
+
+        db = SubDb(storage=Mock())
+        db.close()
+        assert db not in pairsubs._open_dbs
+
+    def test_background_cue_tables(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'APP_DIR', str(tmp_path))
+        monkeypatch.setattr(pairsubs, 'INDEX_DIR', str(tmp_path / 'index'))
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        sub_pair = gen_subpair(1)
+        sub_id = sub_pair.get_id()
+        storage = Mock()
+        storage.load.return_value = {sub_id: sub_pair.get_data()}
+        db = SubDb(storage, write_delay=0)
+        db.add_to_cache(sub_pair)
+
+        # the table of the realigned pair is built after the write
+        db.align_subs(sub_id, 2, 1, 5, 4)
+        db._table_queue.join()
+        key = sub_pair.alignment_key()
+        assert sub_pair.cue_table_key == key
+        assert pairsubs.read_cue_table(
+                str(tmp_path / (sub_id + pairsubs.CUE_TABLE_EXT)), key) is not None
+        db.close()
+
+    def test_cue_table_threads(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        sub_pair = gen_subpair(1)
+        build = sub_pair.build_cue_table
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_build():
+            started.set()
+            release.wait(5)
+            return build()
+
+        sub_pair.build_cue_table = Mock(side_effect=slow_build)
+        threads = [threading.Thread(target=sub_pair.get_cue_table) for _ in range(2)]
+        for t in threads:
+            t.start()
+        started.wait(5)
+        # readers don't wait for the build
+        assert sub_pair.get_cue_table(build=False) is None
+        release.set()
+        for t in threads:
+            t.join()
+        assert sub_pair.build_cue_table.call_count == 1
+        assert sub_pair.get_cue_table(build=False) is sub_pair.cue_table
+        assert [x.name for x in tmp_path.iterdir()] == [sub_pair.get_id() + pairsubs.CUE_TABLE_EXT]
+
+    def test_cache_eviction(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'APP_DIR', str(tmp_path))
+        monkeypatch.setattr(pairsubs, 'INDEX_DIR', str(tmp_path / 'index'))
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        sub_pairs = [gen_subpair(i) for i in range(3)]
+        ids = [x.get_id() for x in sub_pairs]
+        storage = Mock()
+        storage.load.return_value = {x.get_id(): x.get_data() for x in sub_pairs}
+        monkeypatch.setattr(SubPair, 'read', Mock(
+            side_effect=lambda info: sub_pairs[ids.index(SubPair.make_id(info['subs']))]))
+        db = SubDb(storage, write_delay=10, cache_pairs=2)
+
+        db.align_subs(ids[0], 2, 1, 5, 4)
+        db.get_subs(ids[1])
+        db.get_subs(ids[0])
+        # the least recently used pair is evicted
+        db.get_subs(ids[2])
+        assert list(db.cache) == [ids[0], ids[2]]
+        db.get_subs(ids[1])
+        # the aligned pair is written on eviction
+        assert list(db.cache) == [ids[2], ids[1]]
+        storage.put_many.assert_called_once_with({ids[0]: db.data[ids[0]]})
+        assert db.data[ids[0]]['first_start'] == 20
+
+        stats = db.cache.stats()
+        assert stats['hits'] == 1
+        assert stats['misses'] == 4
+        assert stats['evictions'] == 2
+        assert stats['nbytes'] == sub_pairs[1].nbytes() + sub_pairs[2].nbytes()
+        db.close()
+
+    def test_search(self, monkeypatch, tmp_path):
+        monkeypatch.setattr(pairsubs, 'APP_DIR', str(tmp_path))
+        monkeypatch.setattr(pairsubs, 'FILES_DIR', str(tmp_path))
+        monkeypatch.setattr(pairsubs, 'INDEX_DIR', str(tmp_path / 'index'))
+        storage = Mock()
+        storage.load.return_value = {}
+        db = SubDb(storage)
+        sub_pairs = [gen_subpair(i) for i in range(2)]
+        db.add_subpairs(sub_pairs)
+        for x in sub_pairs:
+            db.add_to_cache(x)
+
+        cards = db.search('Sentence 3')
+        assert [x[0] for x in cards] == [x.get_id() for x in sub_pairs for side in (0, 1)]
+        sub_id, (first, second) = cards[0]
+        assert 'ID=0, IDX=0, Sentence #3' in [x.content for x in first]
+        assert [x[0] for x in db.search('sentence 3', lang='Lang_1')] == [
+                sub_pairs[1].get_id()] * 2
+        # words order
+        assert db.search('3 sentence') == []
+
+        # the index is asked for a bounded number of hits, a pair is read once
+        db._table_queue.join()
+        db.cache.pop(sub_pairs[1].get_id())
+        monkeypatch.setattr(SubPair, 'read', Mock(return_value=sub_pairs[1]))
+        monkeypatch.setattr(db.index, 'search', Mock(wraps=db.index.search))
+        assert len(db.search('sentence', lang='Lang_1', limit=3)) == 3
+        db.index.search.assert_called_once_with(
+                'sentence', limit=3 * pairsubs.SEARCH_CANDIDATES)
+        SubPair.read.assert_called_once()
+
+        db.delete_many([sub_id])
+        assert [x[0] for x in db.search('sentence 3')] == [sub_pairs[1].get_id()] * 2
+        db.close()
+
+    def test_delete_many(self, gen_db, tmp_path):
+        ids = list(gen_db.data)
+        for sub_id in ids:
+            for s in gen_db.data[sub_id]['subs']:
+                (tmp_path / s['SubFileName']).write_text('')
+        missing = gen_db.data[ids[1]]['subs'][0]['SubFileName']
+        (tmp_path / missing).unlink()
+        # a file which can't be removed
+        locked = gen_db.data[ids[2]]['subs'][1]['SubFileName']
+        (tmp_path / locked).unlink()
+        (tmp_path / locked).mkdir()
+
+        report = gen_db.delete_many(ids + ['unknown'])
+        assert report.deleted == ids[:2]
+        assert report.not_found == ['unknown']
+        assert report.missing_files == [(ids[1], str(tmp_path / missing))]
+        assert [x[0] for x in report.failed] == [ids[2]]
+        assert list(gen_db.data) == [ids[2]]
+        gen_db.write_db.assert_called_once_with([], removed=ids[:2])
+
 
 
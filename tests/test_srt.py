@@ -0,0 +1,54 @@
+import io
+
+import pytest
+import srt
+
+from pairsubs_srt import BadBlock, cue_offsets, iter_srt
+
+CUES = ''.join(srt.Subtitle(index=i, start=srt.timedelta(seconds=i),
+                            end=srt.timedelta(seconds=i+1),
+                            content='Sentence #{}'.format(i)).to_srt()
+               for i in range(1, 11))
+
+
+@pytest.mark.parametrize('data', [
+    CUES,
+    CUES.replace('\n', '\r\n'),
+    # blank lines in content
+    '1\n00:00:01,000 --> 00:00:02,000\nA\n\nstill A\n\n2\n00:00:03,000 --> 00:00:04,000 X1:2\nB',
+    # no blank line before the next cue
+    '1\n00:00:01,000 --> 00:00:02,000\nA\n2\n00:00:03.000 --> 00:00:04.000\nB\n',
+    # no indexes
+    '\n\n00:00:01,000 --> 00:00:02,000\nA\n\n3.5\n00:00:03,000 --> 00:00:04,000\n\n4\n00:00:05,000 --> 00:00:06,000\nB\n',
+    # arrows in content
+    '1\n00:00:01,000 --> 00:00:02,000\n2 --> 3\n\n2\n00:00:03,000 --> 00:00:04,000\nB\n',
+])
+def test_iter_srt(data):
+    assert list(iter_srt(io.StringIO(data))) == list(srt.parse(data))
+
+
+def test_bad_blocks():
+    data = ('garbage\n\n'
+            '1\n00:00:01,000 --> 00:00:02,000\nA\n\n'
+            '2\n00:00:0x,000 --> 00:00:04,000\nB\n\n'
+            '3\n00:00:05,000 --> 00:00:06,000\nC\n')
+    errors = []
+    assert [x.content for x in iter_srt(data.splitlines(), errors)] == ['A', 'C']
+    assert errors == [BadBlock(1, 'garbage'),
+                      BadBlock(7, '2\n00:00:0x,000 --> 00:00:04,000\nB')]
+
+
+def test_cue_offsets():
+    data = ('garbage\n\n'
+            '1\n00:00:01,000 --> 00:00:02,000\nÄ\n\n'
+            '2\n00:00:0x,000 --> 00:00:04,000\nB\n\n'
+            '00:00:05,000 --> 00:00:06,000\nC\n\nstill C\n'
+            '4\r\n00:00:07,000 --> 00:00:08,000\r\nD').encode('utf-8')
+    offsets = cue_offsets(io.BytesIO(data))
+    assert len(offsets) == 4
+    assert offsets[-1] == len(data)
+    cues = list(iter_srt(io.StringIO(data.decode('utf-8'))))
+    for i in range(3):
+        for j in range(i, 4):
+            part = data[offsets[i]:offsets[j]].decode('utf-8')
+            assert list(iter_srt(io.StringIO(part))) == cues[i:j]
@@ -0,0 +1,163 @@
+import json
+
+import pytest
+
+import pairsubs_storage
+from pairsubs_storage import JsonStorage, SqliteStorage, SearchCache, migrate_json
+
+
+def gen_info(sub_id, imdb='imdb_1', langs=('eng', 'rus')):
+    return {'first_start': 0, 'first_end': 10.0,
+            'second_start': 0, 'second_end': 12.0,
+            'subs': [{'IDMovieImdb': imdb, 'SubLanguageID': langs[0],
+                      'SubFileName': '{}_0'.format(sub_id)},
+                     {'IDMovieImdb': imdb, 'SubLanguageID': langs[1],
+                      'SubFileName': '{}_1'.format(sub_id)}]}
+
+
+@pytest.fixture(params=['json', 'sqlite'])
+def storage(request, tmp_path):
+    if request.param == 'json':
+        s = JsonStorage(str(tmp_path / 'cache.json'))
+    else:
+        s = SqliteStorage(str(tmp_path / 'cache.sqlite'))
+    s.load()
+    yield s
+    s.close()
+
+
+class TestStorage:
+
+    def test_put_remove(self, storage, tmp_path):
+        storage.put_many({'a': gen_info('a'), 'b': gen_info('b')})
+        storage.put('c', gen_info('c'))
+        storage.remove('b')
+        info = gen_info('a')
+        info['first_end'] = 20.0
+        storage.put('a', info)
+        data = storage.load()
+        assert list(data) == ['a', 'c']
+        assert data['a']['first_end'] == 20.0
+
+    def test_save_all(self, storage):
+        storage.put('a', gen_info('a'))
+        storage.save_all({'b': gen_info('b')})
+        assert list(storage.load()) == ['b']
+
+
+class TestJsonStorage:
+
+    def test_journal(self, tmp_path):
+        path = str(tmp_path / 'cache.json')
+        s = JsonStorage(path, compact_every=3)
+        s.load()
+        s.put_many({'a': gen_info('a'), 'b': gen_info('b')})
+        s.remove('b')
+        # the snapshot isn't rewritten by changes
+        assert (tmp_path / 'cache.json').read_text() == ''
+        assert len((tmp_path / 'cache.json.journal').read_text().splitlines()) == 2
+        s.put('c', gen_info('c'))
+        # compaction
+        assert list(json.loads((tmp_path / 'cache.json').read_text())) == ['a', 'c']
+        assert (tmp_path / 'cache.json.journal').read_text() == ''
+        s.put('d', gen_info('d'))
+        s.close()
+
+        # torn last record
+        with open(path + '.journal', 'a') as f:
+            f.write('{"put": {"e": ')
+        s = JsonStorage(path)
+        assert list(s.load()) == ['a', 'c', 'd']
+        assert (tmp_path / 'cache.json.journal').read_text() == ''
+        s.close()
+
+    def test_append_after_torn_record(self, tmp_path):
+        path = str(tmp_path / 'cache.json')
+        # the only record of the journal is torn
+        (tmp_path / 'cache.json.journal').write_text('{"put": {"e": ')
+        s = JsonStorage(path)
+        assert s.load() == {}
+        s.put('a', gen_info('a'))
+        s.put('b', gen_info('b'))
+        s.close()
+        s = JsonStorage(path)
+        assert list(s.load()) == ['a', 'b']
+        s.close()
+
+    def test_corrupted_snapshot(self, tmp_path):
+        (tmp_path / 'cache.json').write_text('{"a": ')
+        s = JsonStorage(str(tmp_path / 'cache.json'))
+        assert s.load() == {}
+        assert (tmp_path / 'cache.json.corrupt').read_text() == '{"a": '
+        s.close()
+
+
+class TestSqliteStorage:
+
+    def test_wal_and_find(self, tmp_path):
+        s = SqliteStorage(str(tmp_path / 'cache.sqlite'))
+        mode = s.conn.execute('PRAGMA journal_mode').fetchone()[0]
+        assert mode == 'wal'
+        s.put_many({'a': gen_info('a', 'imdb_1', ('eng', 'rus')),
+                    'b': gen_info('b', 'imdb_1', ('eng', 'fre')),
+                    'c': gen_info('c', 'imdb_2', ('eng', 'rus'))})
+        assert sorted(s.find('imdb_1')) == ['a', 'b']
+        assert s.find('imdb_1', 'eng', 'fre') == ['b']
+        assert s.find('imdb_3') == []
+        # an update changes the indexed columns and keeps the order
+        s.put('a', gen_info('a', 'imdb_1', ('eng', 'fre')))
+        assert s.find('imdb_1', 'eng', 'fre') == ['a', 'b']
+        assert list(s.load()) == ['a', 'b', 'c']
+        s.close()
+
+    def test_migrate_json(self, tmp_path):
+        json_path = str(tmp_path / 'cache.json')
+        data = {'a': gen_info('a'), 'b': gen_info('b')}
+        with open(json_path, 'w') as f:
+            json.dump(data, f)
+        s = SqliteStorage(str(tmp_path / 'cache.sqlite'))
+        assert migrate_json(json_path, s) == 2
+        assert s.load() == data
+        assert not (tmp_path / 'cache.json').exists()
+        assert (tmp_path / 'cache.json.migrated').exists()
+        # second run is a no-op
+        assert migrate_json(json_path, s) == 0
+        assert s.count() == 2
+        s.close()
+
+
+class TestSearchCache:
+
+    @pytest.fixture
+    def clock(self, monkeypatch):
+        clock = [1000.0]
+        monkeypatch.setattr(pairsubs_storage.time, 'time', lambda: clock[0])
+        return clock
+
+    def test_ttl(self, tmp_path, clock):
+        c = SearchCache(str(tmp_path / 'search.sqlite'), ttl=10, stale_ttl=5)
+        assert c.get('1', 'eng') is None
+        c.put('1', 'eng', [{'IDSubtitleFile': '1'}])
+        assert c.get('1', 'eng') == ([{'IDSubtitleFile': '1'}], True)
+        assert c.get('1', 'rus') is None
+        clock[0] += 12
+        assert c.get('1', 'eng') == ([{'IDSubtitleFile': '1'}], False)
+        clock[0] += 5
+        assert c.get('1', 'eng') is None
+        assert c.stats() == {'hits': 1, 'misses': 3, 'stale': 1,
+                             'evictions': 0, 'entries': 1}
+        c.close()
+
+    def test_eviction(self, tmp_path, clock):
+        c = SearchCache(str(tmp_path / 'search.sqlite'), max_entries=2)
+        c.put('1', 'eng', [])
+        clock[0] += 1
+        c.put('2', 'eng', [])
+        clock[0] += 1
+        c.get('1', 'eng')
+        clock[0] += 1
+        c.put('3', 'eng', [])
+        assert c.get('2', 'eng') is None
+        assert c.get('1', 'eng') and c.get('3', 'eng')
+        assert c.stats()['evictions'] == 1
+        c.close()